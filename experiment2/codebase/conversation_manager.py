@@ -12,42 +12,139 @@ It has now been updated to also store the state of the coding agent.
 """
 import sqlite3
 import os
+import atexit
 import datetime
-from typing import List, Dict, Optional
+import hashlib
+import threading
+import zlib
+from urllib.request import pathname2url
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import List, Dict, Optional, Iterator
 
 try:
     from langchain_huggingface import HuggingFaceEmbeddings
-    from langchain_community.vectorstores import Chroma
+    import chromadb
 except ImportError:
-    print("FATAL: Langchain libraries not found. The ConversationManager cannot function.")
+    print("FATAL: Langchain/ChromaDB libraries not found. The ConversationManager cannot function.")
     exit(1)
 
+try:
+    import torch
+    DEFAULT_EMBEDDING_DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
+except ImportError:
+    DEFAULT_EMBEDDING_DEVICE = 'cpu'
+
+try:
+    import zstandard as zstd
+    _ZC = zstd.ZstdCompressor(level=3)
+except ImportError:
+    zstd = None
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+def _compress_text(text: str) -> bytes:
+    """Compresses a large text column (code, test output) for BLOB storage."""
+    data = text.encode("utf-8")
+    return _ZC.compress(data) if zstd else zlib.compress(data, 6)
+
+def _decompress_text(value) -> str:
+    """Reverses _compress_text; rows written before compression are returned as-is."""
+    if value is None or isinstance(value, str):
+        return value
+    if value.startswith(ZSTD_MAGIC):
+        if not zstd:
+            raise RuntimeError("This row was compressed with zstd; install 'zstandard' to read it.")
+        return zstd.ZstdDecompressor().decompress(value).decode("utf-8")
+    return zlib.decompress(value).decode("utf-8")
+
+INSERT_MESSAGE_SQL = "INSERT INTO messages (conversation_id, timestamp, role, content, content_hash) VALUES (?, ?, ?, ?, ?)"
+EMBEDDING_CACHE_SIZE = 4096
+# Same name the Langchain Chroma wrapper used, so previously stored vectors stay reachable
+CHROMA_COLLECTION = "langchain"
+
 class ConversationManager:
     """Manages the storage and retrieval of conversation history and coding agent data."""
 
-    def __init__(self, base_dir: str = "Database", embedding_model: str = "sentence-transformers/all-MiniLM-L6-v2"):
+    def __init__(self, base_dir: str = "Database", embedding_model: str = "sentence-transformers/all-MiniLM-L6-v2", batch_size: int = 64, device: Optional[str] = None):
         print(f"--- Initializing Conversation Manager ---")
         os.makedirs(base_dir, exist_ok=True)
         self.sqlite_path = os.path.join(base_dir, "conversations.sqlite")
         self.chroma_path = os.path.join(base_dir, "conversation_vectors")
 
+        # Turns waiting to be embedded and inserted into ChromaDB in one call
+        self.batch_size = batch_size
+        self._pending_texts: List[str] = []
+        self._pending_metadatas: List[Dict] = []
+        self._pending_ids: List[str] = []
+        # SHA-256 of turn text -> embedding, so retried/duplicate turns skip the model
+        self._embedding_cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        # Single background worker for the embedding + HNSW insert, created on first use
+        self._embed_pool: Optional[ThreadPoolExecutor] = None
+        self._embed_futures: List[Future] = []
+
         try:
-            self.embeddings = HuggingFaceEmbeddings(model_name=embedding_model, model_kwargs={'device': 'cpu'})
-            self.db_conn = sqlite3.connect(self.sqlite_path)
-            self.vector_store = Chroma(persist_directory=self.chroma_path, embedding_function=self.embeddings)
+            self.device = device or DEFAULT_EMBEDDING_DEVICE
+            model_kwargs = {'device': self.device}
+            if self.device == 'cuda':
+                # Half precision on GPU: ~2x throughput, half the memory
+                model_kwargs['model_kwargs'] = {'torch_dtype': torch.float16}
+            self.embeddings = HuggingFaceEmbeddings(
+                model_name=embedding_model,
+                model_kwargs=model_kwargs,
+                encode_kwargs={'batch_size': batch_size, 'normalize_embeddings': True}
+            )
+            # A single shared writer connection; any thread may use it while holding _write_lock.
+            # Reads go through per-thread connections (see _read_conn), which WAL lets run concurrently.
+            self.db_conn = sqlite3.connect(self.sqlite_path, check_same_thread=False)
+            self._write_lock = threading.RLock()
+            self._local = threading.local()
+            self._readers: List[sqlite3.Connection] = []  # every per-thread reader, closed in close()
+            # WAL + relaxed fsync keeps commits cheap; temp tables stay in RAM
+            self.db_conn.execute("PRAGMA journal_mode=WAL;")
+            self.db_conn.execute("PRAGMA synchronous=NORMAL;")
+            self.db_conn.execute("PRAGMA temp_store=MEMORY;")
+            # Talk to Chroma directly: embeddings are computed (and cached) by us, in batches
+            self.chroma_client = chromadb.PersistentClient(path=self.chroma_path)
+            self.collection = self.chroma_client.get_or_create_collection(CHROMA_COLLECTION, metadata={"hnsw:space": "cosine"})
             self._create_sqlite_tables()
+            self._message_cursor = self.db_conn.cursor()  # Reused for the per-turn message inserts
+            # Turns still buffered at exit are written by close(); callers may also close() earlier
+            self._closed = False
+            atexit.register(self.close)
             print("--- Conversation Manager Initialized Successfully ---")
         except Exception as e:
             print(f"\n--- FATAL: Conversation Manager failed to initialize ---")
             raise e
 
+    def _read_conn(self) -> sqlite3.Connection:
+        """Returns this thread's read-only connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Escaped, so '?', '#' or '%' in the path are not read as URI syntax.
+            # check_same_thread=False only so close() may close it; it is used by this thread alone.
+            uri = f"file:{pathname2url(os.path.abspath(self.sqlite_path))}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            with self._write_lock:
+                self._readers.append(conn)
+        return conn
+
     def _create_sqlite_tables(self):
         """Creates all necessary SQLite tables on initialization."""
         cursor = self.db_conn.cursor()
         
         # Original tables
         cursor.execute("CREATE TABLE IF NOT EXISTS conversations (id INTEGER PRIMARY KEY, start_time TEXT, name TEXT, session_summary TEXT);")
-        cursor.execute("CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY, conversation_id INTEGER, timestamp TEXT, role TEXT, content TEXT, FOREIGN KEY (conversation_id) REFERENCES conversations (id));")
+        cursor.execute("CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY, conversation_id INTEGER, timestamp TEXT, role TEXT, content TEXT, content_hash TEXT, embedded INTEGER NOT NULL DEFAULT 0, FOREIGN KEY (conversation_id) REFERENCES conversations (id));")
+        # Databases created before content hashing lack the column
+        message_columns = [row[1] for row in cursor.execute("PRAGMA table_info(messages);")]
+        if "content_hash" not in message_columns:
+            cursor.execute("ALTER TABLE messages ADD COLUMN content_hash TEXT;")
+        # Set once the turn's vector is actually in ChromaDB, not when the message row is written
+        if "embedded" not in message_columns:
+            cursor.execute("ALTER TABLE messages ADD COLUMN embedded INTEGER NOT NULL DEFAULT 0;")
         
         # --- NEW: Tables for the coding agent's history ---
         cursor.execute("""
@@ -56,7 +153,7 @@ class ConversationManager:
                 conversation_id INTEGER,
                 file_name TEXT NOT NULL,
                 prompt TEXT NOT NULL,
-                code_content TEXT NOT NULL,
+                code_content BLOB NOT NULL,
                 test_plan TEXT NOT NULL,
                 timestamp TEXT NOT NULL,
                 FOREIGN KEY (conversation_id) REFERENCES conversations (id)
@@ -69,62 +166,167 @@ class ConversationManager:
                 conversation_id INTEGER,
                 file_name TEXT NOT NULL,
                 prompt TEXT NOT NULL,
-                code_content TEXT NOT NULL,
+                code_content BLOB NOT NULL,
                 test_plan TEXT NOT NULL,
-                test_output TEXT NOT NULL,
+                test_output BLOB NOT NULL,
                 timestamp TEXT NOT NULL,
                 FOREIGN KEY (conversation_id) REFERENCES conversations (id)
             );
         """)
+
+        # Indexes for the per-file lookups (newest first) and per-conversation message scans
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_sol_file_ts ON code_solutions (file_name, timestamp DESC);")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_fail_file_ts ON code_failures (file_name, timestamp DESC);")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_msg_conv ON messages (conversation_id, timestamp);")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_msg_hash ON messages (content_hash);")
         
         self.db_conn.commit()
 
     def add_turn_to_history(self, conversation_id: int, user_content: str, assistant_content: str):
         """Adds a conversation turn to SQLite and ChromaDB."""
         try:
-            cursor = self.db_conn.cursor()
             now = datetime.datetime.now().isoformat()
-            cursor.execute("INSERT INTO messages (conversation_id, timestamp, role, content) VALUES (?, ?, ?, ?)", (conversation_id, now, 'user', user_content))
-            user_message_id = cursor.lastrowid
-            cursor.execute("INSERT INTO messages (conversation_id, timestamp, role, content) VALUES (?, ?, ?, ?)", (conversation_id, now, 'assistant', assistant_content))
-            assistant_message_id = cursor.lastrowid
-            
             combined_content = f"User: {user_content}\n\nAssistant: {assistant_content}"
+            # Both messages of a turn carry the hash of the combined text that gets embedded
+            content_hash = hashlib.sha256(combined_content.encode("utf-8")).hexdigest()
+            with self._write_lock, self.db_conn:  # Both inserts commit (or roll back) as one transaction
+                cursor = self._message_cursor
+                already_embedded = (cursor.execute("SELECT 1 FROM messages WHERE content_hash = ? AND embedded = 1 LIMIT 1", (content_hash,)).fetchone() is not None
+                                    or combined_content in self._pending_texts)
+                cursor.executemany(INSERT_MESSAGE_SQL, [(conversation_id, now, 'user', user_content, content_hash), (conversation_id, now, 'assistant', assistant_content, content_hash)])
+                # cursor.lastrowid is not updated by executemany, so ask SQLite directly.
+                # The two rows are inserted back to back inside one transaction.
+                assistant_message_id = cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
+                user_message_id = assistant_message_id - 1
+
+            if already_embedded:
+                # A retried/duplicate turn: its text is already in the vector store
+                print(f"Successfully added turn (User: {user_message_id}, Assistant: {assistant_message_id}) to conversation {conversation_id} (duplicate content, embedding skipped).")
+                return
             metadata = {"conversation_id": conversation_id, "user_message_id": user_message_id, "assistant_message_id": assistant_message_id, "timestamp": now}
             chroma_id = f"turn_{user_message_id}_{assistant_message_id}"
-            
-            self.vector_store.add_texts(texts=[combined_content], metadatas=[metadata], ids=[chroma_id])
-            self.db_conn.commit()
+
+            with self._write_lock:
+                self._pending_texts.append(combined_content)
+                self._pending_metadatas.append(metadata)
+                self._pending_ids.append(chroma_id)
+                if len(self._pending_texts) >= self.batch_size:
+                    self._submit_pending()
             print(f"Successfully added turn (User: {user_message_id}, Assistant: {assistant_message_id}) to conversation {conversation_id}.")
         except Exception as e:
             print(f"Error adding turn to history: {e}")
-            self.db_conn.rollback()
-            
+
+    def _take_pending(self):
+        """Removes and returns the buffered turns as (texts, metadatas, ids), or None if there are none."""
+        with self._write_lock:
+            if not self._pending_texts:
+                return None
+            # Sort by length so each encoder batch pads to a similar size
+            pending = sorted(zip(self._pending_texts, self._pending_metadatas, self._pending_ids), key=lambda p: len(p[0]))
+            self._pending_texts, self._pending_metadatas, self._pending_ids = [], [], []
+            return tuple(list(col) for col in zip(*pending))
+
+    def _submit_pending(self):
+        """Hands the buffered turns to the background worker; returns without waiting."""
+        with self._write_lock:
+            batch = self._take_pending()
+            if batch is None:
+                return
+            texts, metadatas, ids = batch
+            if self._embed_pool is None:
+                self._embed_pool = ThreadPoolExecutor(max_workers=1)
+            self._embed_futures = [f for f in self._embed_futures if not f.done()]
+            self._embed_futures.append(self._embed_pool.submit(self._add_to_vector_store, texts, metadatas, ids))
+
+    def flush(self):
+        """Embeds and inserts all buffered turns into ChromaDB and waits until every batch is stored."""
+        self._submit_pending()
+        with self._write_lock:
+            futures, self._embed_futures = self._embed_futures, []
+        for future in futures:
+            future.result()
+
+    def close(self):
+        """Flushes outstanding vector writes and releases the worker and database connection.
+
+        Registered with atexit, so buffered turns are stored even if the caller never closes.
+        """
+        if getattr(self, "_closed", True):
+            return
+        self._closed = True
+        atexit.unregister(self.close)
+        with self._write_lock:
+            futures, self._embed_futures = self._embed_futures, []
+        for future in futures:
+            future.result()
+        # The last batch is written on this thread: at interpreter shutdown the executor no longer accepts work
+        batch = self._take_pending()
+        if batch is not None:
+            self._add_to_vector_store(*batch)
+        if self._embed_pool is not None:
+            self._embed_pool.shutdown(wait=True)
+            self._embed_pool = None
+        with self._write_lock:
+            readers, self._readers = self._readers, []
+        for conn in readers:
+            conn.close()
+        self.db_conn.close()
+
+    def _add_to_vector_store(self, texts: List[str], metadatas: List[Dict], ids: List[str]):
+        """Runs on the embedding worker: encodes one batch and inserts it into ChromaDB."""
+        try:
+            embeddings = self._embed_texts(texts)
+            self.collection.add(embeddings=embeddings, documents=texts, metadatas=metadatas, ids=ids)
+            # Only now may an identical later turn skip embedding; a failed batch stays unmarked
+            hashes = [(hashlib.sha256(text.encode("utf-8")).hexdigest(),) for text in texts]
+            with self._write_lock, self.db_conn:
+                self.db_conn.executemany("UPDATE messages SET embedded = 1 WHERE content_hash = ?", hashes)
+            print(f"Flushed {len(texts)} turn(s) to the vector store.")
+        except Exception as e:
+            print(f"Error flushing turns to vector store: {e}")
+
+    def _embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Embeds texts, reusing cached vectors and encoding only the misses in one batch."""
+        keys = [hashlib.sha256(text.encode("utf-8")).hexdigest() for text in texts]
+        misses = {key: text for key, text in zip(keys, texts) if key not in self._embedding_cache}
+        if misses:
+            for key, vector in zip(misses, self.embeddings.embed_documents(list(misses.values()))):
+                self._embedding_cache[key] = vector
+        vectors = []
+        for key in keys:
+            self._embedding_cache.move_to_end(key)
+            vectors.append(self._embedding_cache[key])
+        while len(self._embedding_cache) > EMBEDDING_CACHE_SIZE:
+            self._embedding_cache.popitem(last=False)
+        return vectors
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
     def start_new_conversation(self, name: Optional[str] = None) -> int:
         """Starts a new conversation and returns its ID."""
         start_time = datetime.datetime.now().isoformat()
-        cursor = self.db_conn.cursor()
-        cursor.execute("INSERT INTO conversations (start_time, name) VALUES (?, ?)", (start_time, name))
-        self.db_conn.commit()
+        with self._write_lock, self.db_conn:
+            cursor = self.db_conn.execute("INSERT INTO conversations (start_time, name) VALUES (?, ?)", (start_time, name))
         return cursor.lastrowid
 
-    def list_conversations(self) -> List[Dict]:
-        """Lists all existing conversations."""
-        cursor = self.db_conn.cursor()
-        cursor.execute("SELECT id, start_time, name, session_summary FROM conversations ORDER BY start_time DESC")
-        rows = cursor.fetchall()
-        return [{"id": r[0], "start_time": r[1], "name": r[2], "summary_exists": bool(r[3])} for r in rows]
+    def list_conversations(self) -> Iterator[Dict]:
+        """Lazily yields all existing conversations, newest first."""
+        cursor = self._read_conn().execute("SELECT id, start_time, name, session_summary FROM conversations ORDER BY start_time DESC")
+        for r in cursor:
+            yield {"id": r["id"], "start_time": r["start_time"], "name": r["name"], "summary_exists": bool(r["session_summary"])}
 
     def update_conversation_summary(self, conversation_id: int, summary: str):
         """Updates the summary for a given conversation ID."""
-        cursor = self.db_conn.cursor()
-        cursor.execute("UPDATE conversations SET session_summary = ? WHERE id = ?", (summary, conversation_id))
-        self.db_conn.commit()
+        with self._write_lock, self.db_conn:
+            self.db_conn.execute("UPDATE conversations SET session_summary = ? WHERE id = ?", (summary, conversation_id))
 
     def get_conversation_summary(self, conversation_id: int) -> Optional[str]:
         """Retrieves the summary for a given conversation ID."""
-        cursor = self.db_conn.cursor()
-        cursor.execute("SELECT session_summary FROM conversations WHERE id = ?", (conversation_id,))
+        cursor = self._read_conn().execute("SELECT session_summary FROM conversations WHERE id = ?", (conversation_id,))
         result = cursor.fetchone()
         return result[0] if result and result[0] else None
         
@@ -132,37 +334,66 @@ class ConversationManager:
     def save_successful_code(self, conversation_id: int, file_name: str, prompt: str, code_content: str, test_plan: str):
         """Saves a successfully tested code solution to the database."""
         try:
-            cursor = self.db_conn.cursor()
             now = datetime.datetime.now().isoformat()
-            cursor.execute(
-                "INSERT INTO code_solutions (conversation_id, file_name, prompt, code_content, test_plan, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
-                (conversation_id, file_name, prompt, code_content, test_plan, now)
-            )
-            self.db_conn.commit()
+            with self._write_lock, self.db_conn:
+                self.db_conn.execute(
+                    "INSERT INTO code_solutions (conversation_id, file_name, prompt, code_content, test_plan, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+                    (conversation_id, file_name, prompt, _compress_text(code_content), test_plan, now)
+                )
             print(f"Successfully saved a new code solution for file '{file_name}'.")
         except Exception as e:
             print(f"Error saving successful code: {e}")
-            self.db_conn.rollback()
+
+    def bulk_save_successful_code(self, solutions: List[Dict]):
+        """
+        Saves many code solutions in a single transaction (e.g. for backfills).
+        Each dict needs the same keys as the arguments of save_successful_code.
+        """
+        try:
+            now = datetime.datetime.now().isoformat()
+            rows = [(s["conversation_id"], s["file_name"], s["prompt"], _compress_text(s["code_content"]), s["test_plan"], now) for s in solutions]
+            with self._write_lock, self.db_conn:
+                self.db_conn.executemany(
+                    "INSERT INTO code_solutions (conversation_id, file_name, prompt, code_content, test_plan, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+            print(f"Successfully saved {len(rows)} code solutions.")
+        except Exception as e:
+            print(f"Error bulk saving successful code: {e}")
 
     def save_failed_code(self, conversation_id: int, file_name: str, prompt: str, code_content: str, test_plan: str, test_output: str):
         """Saves a failed code attempt to the database."""
         try:
-            cursor = self.db_conn.cursor()
             now = datetime.datetime.now().isoformat()
-            cursor.execute(
-                "INSERT INTO code_failures (conversation_id, file_name, prompt, code_content, test_plan, test_output, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (conversation_id, file_name, prompt, code_content, test_plan, test_output, now)
-            )
-            self.db_conn.commit()
+            with self._write_lock, self.db_conn:
+                self.db_conn.execute(
+                    "INSERT INTO code_failures (conversation_id, file_name, prompt, code_content, test_plan, test_output, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (conversation_id, file_name, prompt, _compress_text(code_content), test_plan, _compress_text(test_output), now)
+                )
             print(f"Successfully saved a new failed code attempt for file '{file_name}'.")
         except Exception as e:
             print(f"Error saving failed code: {e}")
-            self.db_conn.rollback()
+
+    def bulk_save_failed_code(self, failures: List[Dict]):
+        """
+        Saves many failed code attempts in a single transaction (e.g. for backfills).
+        Each dict needs the same keys as the arguments of save_failed_code.
+        """
+        try:
+            now = datetime.datetime.now().isoformat()
+            rows = [(f["conversation_id"], f["file_name"], f["prompt"], _compress_text(f["code_content"]), f["test_plan"], _compress_text(f["test_output"]), now) for f in failures]
+            with self._write_lock, self.db_conn:
+                self.db_conn.executemany(
+                    "INSERT INTO code_failures (conversation_id, file_name, prompt, code_content, test_plan, test_output, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+            print(f"Successfully saved {len(rows)} failed code attempts.")
+        except Exception as e:
+            print(f"Error bulk saving failed code: {e}")
             
     def get_code_solution(self, file_name: str) -> Optional[Dict]:
         """Retrieves the most recent successful code solution for a given file name."""
-        cursor = self.db_conn.cursor()
-        cursor.execute(
+        cursor = self._read_conn().execute(
             "SELECT id, conversation_id, file_name, prompt, code_content, test_plan, timestamp FROM code_solutions WHERE file_name = ? ORDER BY timestamp DESC LIMIT 1",
             (file_name,)
         )
@@ -174,32 +405,20 @@ class ConversationManager:
                 "conversation_id": row[1],
                 "file_name": row[2],
                 "prompt": row[3],
-                "code_content": row[4],
+                "code_content": _decompress_text(row[4]),
                 "test_plan": row[5],
                 "timestamp": row[6]
             }
         return None
 
-    def get_failed_attempts(self, file_name: str) -> List[Dict]:
-        """Retrieves all failed code attempts for a given file name."""
-        cursor = self.db_conn.cursor()
-        cursor.execute(
+    def get_failed_attempts(self, file_name: str) -> Iterator[Dict]:
+        """Lazily yields all failed code attempts for a given file name, newest first."""
+        cursor = self._read_conn().execute(
             "SELECT id, conversation_id, file_name, prompt, code_content, test_plan, test_output, timestamp FROM code_failures WHERE file_name = ? ORDER BY timestamp DESC",
             (file_name,)
         )
-        rows = cursor.fetchall()
-        
-        failures = []
-        for row in rows:
-            failures.append({
-                "id": row[0],
-                "conversation_id": row[1],
-                "file_name": row[2],
-                "prompt": row[3],
-                "code_content": row[4],
-                "test_plan": row[5],
-                "test_output": row[6],
-                "timestamp": row[7]
-            })
-        return failures
-
+        for row in cursor:
+            failure = {key: row[key] for key in row.keys()}
+            failure["code_content"] = _decompress_text(failure["code_content"])
+            failure["test_output"] = _decompress_text(failure["test_output"])
+            yield failure
@@ -15,14 +15,27 @@ generates and runs unit tests to ensure correctness. It can now be run
 interactively from the CLI and can auto-generate test plans.
 """
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import traceback
 import re
+import io
 import os
+import atexit
 import shutil
 import sys # Needed for interactive multi-line input
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, Optional
 
+try:
+    import orjson # Optional: much faster encoding of large prompts
+    json_dumps = orjson.dumps
+    json_loads = orjson.loads
+except ImportError:
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+    json_loads = json.loads
+
 from project_manager import ProjectManager
 from conversation_manager import ConversationManager
 
@@ -42,14 +55,32 @@ CODING_AGENT_CONFIG = {
 MAX_DEBUG_ATTEMPTS = 3
 MAX_TEST_REGEN_ATTEMPTS = 2
 
+# Shared HTTP session so every Ollama call reuses the same keep-alive connection
+OLLAMA_SESSION = requests.Session()
+OLLAMA_SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Markdown code fences (```python or bare ```) stripped from LLM replies
+CODE_FENCE_RE = re.compile(r'```(?:python)?')
+
 class CodingAgentV2:
     """
     A self-correcting coding agent that generates, tests, and debugs code.
     """
     def __init__(self, conversation_manager: ConversationManager):
         self.manager = conversation_manager
-        self.project_manager = ProjectManager(base_dir="temp_coding_project")
+        self.project_manager = ProjectManager()  # Scratch dir on tmpfs when available
         os.makedirs(CODING_AGENT_CONFIG["OUTPUT_DIR"], exist_ok=True)
+        # Runs speculative LLM calls in the debug loop; requests releases the GIL while waiting
+        self._llm_pool = ThreadPoolExecutor(max_workers=2)
+        # The project dir and pytest worker are reused across tasks and torn down once, at session end
+        atexit.register(self.close)
+
+    def close(self):
+        """Final teardown: removes the project directory and stops the pytest worker and LLM pool."""
+        atexit.unregister(self.close)
+        self.project_manager.cleanup()
+        self._llm_pool.shutdown(wait=False, cancel_futures=True)
 
     def _call_ollama_api(self, messages: list, model_key: str) -> str:
         """Internal helper to send requests to the Ollama API."""
@@ -62,13 +93,26 @@ class CodingAgentV2:
                 "model": model_config["name"],
                 "messages": messages,
                 "options": model_config["options"],
-                "stream": False
+                "stream": True
             }
             # Setting timeout to None for potentially long-running generation tasks
-            response = requests.post(CODING_AGENT_CONFIG["OLLAMA_API_URL"], json=payload, timeout=None)
-            response.raise_for_status()
-            return response.json().get("message", {}).get("content", "").strip()
-        except requests.exceptions.RequestException as e:
+            # Serialize once ourselves; requests' json= would go through the stdlib encoder
+            body = json_dumps(payload)
+            with OLLAMA_SESSION.post(CODING_AGENT_CONFIG["OLLAMA_API_URL"], data=body, headers=JSON_HEADERS, timeout=None, stream=True) as response:
+                response.raise_for_status()
+                # Ollama streams one JSON object per line; assemble the content as it arrives
+                content_parts = []
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json_loads(line)
+                    if "error" in chunk:
+                        raise requests.exceptions.RequestException(chunk["error"])
+                    content_parts.append(chunk.get("message", {}).get("content", ""))
+                    if chunk.get("done"):
+                        break
+            return "".join(content_parts).strip()
+        except (requests.exceptions.RequestException, ValueError) as e: # ValueError: a garbled NDJSON line
             print(f"Coding Agent API Error: {e}")
             return f"Error: Failed to connect to '{model_config['name']}' API. Details: {e}"
 
@@ -115,7 +159,7 @@ class CodingAgentV2:
         
         messages = [{'role': 'system', 'content': system_prompt}, {'role': 'user', 'content': user_message}]
         raw_code = self._call_ollama_api(messages, "coder")
-        cleaned_code = re.sub(r'```python|```', '', raw_code).strip()
+        cleaned_code = CODE_FENCE_RE.sub('', raw_code).strip()
         return cleaned_code
 
     def _generate_unit_tests(self, file_name: str, code_content: str, test_plan_description: str) -> str:
@@ -144,7 +188,7 @@ class CodingAgentV2:
         6.  Return ONLY the Python code for the unit tests. Do NOT include any explanations or markdown fences.
         """
         raw_test_code = self._call_ollama_api([{'role': 'user', 'content': prompt}], "tester")
-        cleaned_test_code = re.sub(r'```python|```', '', raw_test_code).strip()
+        cleaned_test_code = CODE_FENCE_RE.sub('', raw_test_code).strip()
         return cleaned_test_code
 
     def _debug_code(self, code_content: str, test_output: str, test_file: str) -> str:
@@ -171,7 +215,7 @@ class CodingAgentV2:
         """
         messages = [{'role': 'user', 'content': prompt}]
         raw_fixed_code = self._call_ollama_api(messages, "debugger")
-        cleaned_fixed_code = re.sub(r'```python|```', '', raw_fixed_code).strip()
+        cleaned_fixed_code = CODE_FENCE_RE.sub('', raw_fixed_code).strip()
         return cleaned_fixed_code
     
     def _analyze_test_failure(self, code_content: str, test_output: str) -> str:
@@ -218,10 +262,15 @@ class CodingAgentV2:
             test_file = f"test_{code_file}"
             test_output = ""
             analysis_result = 'code_bug' # Default assumption
+            regenerated_tests = None # Future holding tests regenerated while the last failure was analyzed
             
             for attempt in range(MAX_DEBUG_ATTEMPTS + MAX_TEST_REGEN_ATTEMPTS):
                 print(f"  -> [CodingAgentV2] Starting test attempt {attempt + 1}...")
-                generated_tests = self._generate_unit_tests(code_file, generated_code, test_plan)
+                if regenerated_tests is not None:
+                    generated_tests = regenerated_tests.result()
+                    regenerated_tests = None
+                else:
+                    generated_tests = self._generate_unit_tests(code_file, generated_code, test_plan)
                 self.project_manager.write_file(test_file, generated_tests)
                 
                 stdout, stderr, returncode = self.project_manager.run_command(['pytest', '-q', '--tb=no', test_file])
@@ -236,18 +285,34 @@ class CodingAgentV2:
                     print(f"  -> [CodingAgentV2] Tests failed on attempt {attempt + 1}. Analyzing failure...")
                     test_output = stdout + stderr
                     
+                    # Both possible follow-ups depend only on this failure, so start them
+                    # speculatively while the analyzer decides which one is needed.
+                    fixed_code = None
+                    if attempt < MAX_DEBUG_ATTEMPTS:
+                        fixed_code = self._llm_pool.submit(self._debug_code, generated_code, test_output, test_file)
+                    new_tests = None
+                    if attempt < MAX_TEST_REGEN_ATTEMPTS:
+                        new_tests = self._llm_pool.submit(self._generate_unit_tests, code_file, generated_code, test_plan)
+
                     analysis_result = self._analyze_test_failure(generated_code, test_output)
                     print(f"  -> [CodingAgentV2] Analysis result: '{analysis_result}'")
                     
-                    if analysis_result == 'code_bug' and attempt < MAX_DEBUG_ATTEMPTS:
+                    if analysis_result == 'code_bug' and fixed_code is not None:
                         print("  -> [CodingAgentV2] Identified as a code bug. Attempting to debug...")
-                        generated_code = self._debug_code(generated_code, test_output, test_file)
+                        if new_tests is not None:
+                            new_tests.cancel()
+                        generated_code = fixed_code.result()
                         self.project_manager.write_file(code_file, generated_code)
-                    elif analysis_result == 'test_bug' and attempt < MAX_TEST_REGEN_ATTEMPTS:
+                    elif analysis_result == 'test_bug' and new_tests is not None:
                         print("  -> [CodingAgentV2] Identified as a test bug. Regenerating tests...")
-                        pass # Loop will regenerate tests
+                        if fixed_code is not None:
+                            fixed_code.cancel()
+                        regenerated_tests = new_tests # Picked up at the start of the next attempt
                     else:
                         print("  -> [CodingAgentV2] Cannot determine cause or max attempts reached. Stopping.")
+                        for future in (fixed_code, new_tests):
+                            if future is not None:
+                                future.cancel()
                         break
 
             final_file_path = os.path.join(CODING_AGENT_CONFIG["OUTPUT_DIR"], code_file)
@@ -270,8 +335,6 @@ class CodingAgentV2:
                 
         except Exception as e:
             final_answer = f"An unexpected error occurred during coding agent execution: {e}\n{traceback.format_exc()}"
-        finally:
-            self.project_manager.cleanup()
         
         return final_answer
 
@@ -281,14 +344,18 @@ def _get_multiline_input(prompt_message: str) -> str:
     """Helper function to get multi-line input from the user."""
     print(f"\n{prompt_message}")
     print(" (Enter your text. Press Ctrl-D on Linux/macOS or Ctrl-Z+Enter on Windows when done)")
-    lines = sys.stdin.readlines()
-    return "".join(lines).strip()
+    # Stream into one buffer instead of materializing a list of lines first
+    buffer = io.StringIO()
+    for line in sys.stdin:
+        buffer.write(line)
+    return buffer.getvalue().strip()
 
 def main():
     """The main function to run the agent in an interactive CLI mode."""
     print("--- Coding Agent V2: Interactive Mode ---")
     print("Please provide the following details for your coding task.")
     
+    coding_agent = None
     try:
         language = input("\n▶ Enter the programming language (e.g., python): ")
         code_file = input("▶ Enter the target filename (e.g., my_module.py): ")
@@ -353,6 +420,9 @@ def main():
         print("\n\n--- Operation cancelled by user. Exiting. ---")
     except Exception as e:
         print(f"\n--- An unexpected error occurred: {e} ---")
+    finally:
+        if coding_agent is not None:
+            coding_agent.close()
 
 if __name__ == "__main__":
     main()
@@ -10,9 +10,19 @@ isolated, temporary working directory. This is essential for safely
 executing generated code and unit tests.
 """
 import os
+import sys
+import json
+import queue
 import shutil
 import subprocess
-from typing import Tuple, Any
+import tempfile
+import threading
+from pathlib import Path
+from typing import Tuple, Any, Optional
+
+# RAM-backed scratch space, when the platform has one
+TMPFS_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+PYTEST_WORKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pytest_worker.py")
 
 class ProjectManager:
     """
@@ -20,23 +30,42 @@ class ProjectManager:
     Ensures a clean, isolated environment for each task.
     """
 
-    def __init__(self, base_dir: str = "temp_project"):
+    def __init__(self, base_dir: Optional[str] = None):
+        """
+        Args:
+            base_dir (Optional[str]): Directory to work in. If omitted, a unique
+                directory is created on tmpfs (or the system temp dir) on demand.
+        """
         self.base_dir = base_dir
         self.current_dir = None
+        self._written: set[str] = set()
+        self._pytest_worker: Optional[subprocess.Popen] = None
+        self._worker_replies: "queue.Queue[str]" = queue.Queue()
 
     def create_project(self):
         """
-        Creates a new, unique temporary directory for the project.
-        Deletes any existing directory with the same name first.
+        Prepares the project directory for a new task.
+        An existing directory is reused; only the files written by the previous
+        task are removed instead of deleting and recreating the whole tree.
         """
-        print(f"ProjectManager: Creating new project directory at '{self.base_dir}'...")
-        if os.path.exists(self.base_dir):
-            shutil.rmtree(self.base_dir)
-            print(f"ProjectManager: Removed old directory.")
-        
-        os.makedirs(self.base_dir)
+        if not self.base_dir:
+            self.base_dir = tempfile.mkdtemp(prefix="cap_", dir=TMPFS_DIR)
+        print(f"ProjectManager: Preparing project directory at '{self.base_dir}'...")
+        os.makedirs(self.base_dir, exist_ok=True)
+
+        for file_name in self._written:
+            try:
+                os.unlink(os.path.join(self.base_dir, file_name))
+            except FileNotFoundError:
+                pass
+        if self._written:
+            # Bytecode of the old modules must not shadow the new sources
+            shutil.rmtree(os.path.join(self.base_dir, "__pycache__"), ignore_errors=True)
+            print(f"ProjectManager: Removed {len(self._written)} file(s) from the previous task.")
+        self._written.clear()
+
         self.current_dir = self.base_dir
-        print(f"ProjectManager: Directory created.")
+        print(f"ProjectManager: Directory ready.")
 
     def write_file(self, file_name: str, content: str):
         """
@@ -47,8 +76,16 @@ class ProjectManager:
         
         file_path = os.path.join(self.current_dir, file_name)
         print(f"ProjectManager: Writing file '{file_name}'...")
-        with open(file_path, "w") as f:
-            f.write(content)
+        # Unbuffered write straight to the descriptor: one open, one write, one close
+        data = memoryview(content.encode("utf-8"))
+        fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            while data:
+                written = os.write(fd, data)
+                data = data[written:]
+        finally:
+            os.close(fd)
+        self._written.add(file_name)
 
     def read_file(self, file_name: str) -> str:
         """
@@ -57,13 +94,12 @@ class ProjectManager:
         if not self.current_dir:
             raise RuntimeError("No project directory exists. Call create_project() first.")
         
-        file_path = os.path.join(self.current_dir, file_name)
-        if not os.path.exists(file_path):
+        file_path = Path(self.current_dir, file_name)
+        try:
+            return file_path.read_bytes().decode("utf-8")
+        except FileNotFoundError:
             raise FileNotFoundError(f"File not found: {file_name}")
 
-        with open(file_path, "r") as f:
-            return f.read()
-
     def run_command(self, command: list[str], timeout: int = 60) -> Tuple[str, str, int]:
         """
         Runs a shell command within the project directory and captures its output.
@@ -79,6 +115,8 @@ class ProjectManager:
             raise RuntimeError("No project directory exists. Call create_project() first.")
 
         print(f"ProjectManager: Executing command: {' '.join(command)}")
+        if command and command[0] == "pytest":
+            return self._run_pytest(command[1:], timeout)
         try:
             result = subprocess.run(
                 command,
@@ -93,15 +131,61 @@ class ProjectManager:
         except Exception as e:
             return "", f"Error: Failed to execute command. Details: {e}", 1
 
+    def _start_pytest_worker(self):
+        """Starts the persistent pytest worker and a thread that collects its replies."""
+        self._pytest_worker = subprocess.Popen(
+            [sys.executable, "-u", PYTEST_WORKER],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True
+        )
+        self._worker_replies = queue.Queue()
+        threading.Thread(
+            target=lambda out, replies: [replies.put(line) for line in out],
+            args=(self._pytest_worker.stdout, self._worker_replies),
+            daemon=True
+        ).start()
+
+    def _stop_pytest_worker(self):
+        if self._pytest_worker:
+            self._pytest_worker.kill()
+            self._pytest_worker.wait()
+            self._pytest_worker = None
+
+    def _run_pytest(self, args: list[str], timeout: int) -> Tuple[str, str, int]:
+        """
+        Runs pytest in the persistent worker, so the interpreter start-up and
+        pytest import are paid once instead of on every test attempt.
+        """
+        try:
+            if not self._pytest_worker or self._pytest_worker.poll() is not None:
+                self._start_pytest_worker()
+            request = {"cwd": os.path.abspath(self.current_dir), "args": args}
+            self._pytest_worker.stdin.write(json.dumps(request) + "\n")
+            self._pytest_worker.stdin.flush()
+            reply = json.loads(self._worker_replies.get(timeout=timeout))
+            return reply["stdout"], reply["stderr"], reply["returncode"]
+        except queue.Empty:
+            # The worker is stuck in the tests; a fresh one is started next time
+            self._stop_pytest_worker()
+            return "", "Error: Command timed out.", 1
+        except Exception as e:
+            self._stop_pytest_worker()
+            return "", f"Error: Failed to execute command. Details: {e}", 1
+
     def cleanup(self):
         """
-        Removes the entire project directory.
+        Removes the entire project directory. Meant for final teardown;
+        between tasks create_project() resets the directory more cheaply.
         """
         if self.base_dir and os.path.exists(self.base_dir):
             print(f"ProjectManager: Cleaning up project directory '{self.base_dir}'...")
             shutil.rmtree(self.base_dir)
             self.current_dir = None
+            self._written.clear()
             print("ProjectManager: Cleanup complete.")
+        self._stop_pytest_worker()
 
 
 if __name__ == '__main__':
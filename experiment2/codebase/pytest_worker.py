@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Oct 15 20:30:00 2026
+
+@author: marek
+
+Long-lived pytest runner used by ProjectManager. It imports pytest once and
+then serves one run per JSON line read from stdin:
+
+    {"cwd": "/path/to/project", "args": ["-q", "--tb=no", "test_x.py"]}
+
+and answers with one JSON line on stdout:
+
+    {"stdout": "...", "stderr": "...", "returncode": 0}
+"""
+import contextlib
+import importlib
+import io
+import json
+import os
+import sys
+
+import pytest
+
+
+def _forget_project_modules(project_dir: str):
+    """Drops modules imported from the project dir so each run sees fresh sources."""
+    project_dir = os.path.abspath(project_dir) + os.sep
+    for name, module in list(sys.modules.items()):
+        module_file = getattr(module, "__file__", None)
+        if module_file and os.path.abspath(module_file).startswith(project_dir):
+            del sys.modules[name]
+    importlib.invalidate_caches()
+
+
+def run_pytest(cwd: str, args: list) -> dict:
+    """Runs pytest in-process inside cwd and returns its captured output."""
+    out, err = io.StringIO(), io.StringIO()
+    saved_path = list(sys.path)
+    os.chdir(cwd)
+    sys.path.insert(0, cwd)
+    try:
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            returncode = int(pytest.main(["-p", "no:cacheprovider", *args]))
+    except Exception as e:
+        err.write(f"Error: pytest crashed. Details: {e}")
+        returncode = 1
+    finally:
+        sys.path[:] = saved_path
+        _forget_project_modules(cwd)
+    return {"stdout": out.getvalue(), "stderr": err.getvalue(), "returncode": returncode}
+
+
+def main():
+    # Keep the real stdout for replies only; stray fd-level writes from the
+    # code under test go to stderr instead of corrupting the protocol.
+    replies = os.fdopen(os.dup(sys.__stdout__.fileno()), "w")
+    os.dup2(sys.__stderr__.fileno(), sys.__stdout__.fileno())
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        result = run_pytest(request["cwd"], request["args"])
+        replies.write(json.dumps(result) + "\n")
+        replies.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -32,6 +32,20 @@ CODING_AGENT_CONFIG = {
 MAX_DEBUG_ATTEMPTS = 3
 MAX_TEST_REGEN_ATTEMPTS = 2
 
+# Old one-shot pattern, kept for replies that contain more than the outer fence pair
+_FENCE_RE = re.compile(r'```python|```')
+
+def _strip_fences(raw: str) -> str:
+    """Strips the markdown fences around a code reply with C-level partition scans."""
+    text = raw.strip()
+    fenced = text.startswith("```")
+    body = text.partition("```")[2] if fenced else text
+    if body.endswith("```"):
+        body = body.rpartition("```")[0]
+    if "```" in body:
+        return _FENCE_RE.sub('', raw).strip()
+    return (body.removeprefix("python") if fenced else body).strip()
+
 class ProjectManager:
     def __init__(self, base_dir="temp_project"):
         self.base_dir = base_dir
@@ -99,7 +113,7 @@ class CodingAgentV2:
 
         messages = [{'role': 'system', 'content': system_prompt}, {'role': 'user', 'content': prompt}]
         raw_code = self._call_ollama_api(messages, "coder")
-        return re.sub(r'```python|```', '', raw_code).strip()
+        return _strip_fences(raw_code).strip()
 
     def _generate_unit_tests(self, file_name: str, code_content: str, test_plan_description: str) -> str:
         prompt = f"""
@@ -122,7 +136,7 @@ class CodingAgentV2:
         3. Implement test cases that cover all aspects mentioned in the `Test Plan`.
         """
         raw_test_code = self._call_ollama_api([{'role': 'user', 'content': prompt}], "tester")
-        return re.sub(r'```python|```', '', raw_test_code).strip()
+        return _strip_fences(raw_test_code).strip()
 
     def _debug_code(self, code_content: str, test_output: str) -> str:
         prompt = f"""
@@ -143,7 +157,7 @@ class CodingAgentV2:
         """
         messages = [{'role': 'user', 'content': prompt}]
         raw_fixed_code = self._call_ollama_api(messages, "debugger")
-        return re.sub(r'```python|```', '', raw_fixed_code).strip()
+        return _strip_fences(raw_fixed_code).strip()
 
     def execute_coding_agent_v2(self, language: str, code_file: str, prompt: str, test_plan: str, mode: str = 'generate', initial_code: Optional[str] = None) -> str:
         final_answer = "An error occurred during the coding process."
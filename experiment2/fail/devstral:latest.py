@@ -5,12 +5,27 @@ Simplified Coding Agent V2 (Single File Script)
 """
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
+import hashlib
+import threading
 import traceback
 import re
 import os
+import io
+import contextlib
+import importlib
+import subprocess
 import shutil
 import sys # Needed for interactive multi-line input
+from collections import OrderedDict
+from typing import Optional
+
+try:
+    import pytest  # Run tests in-process when available
+except ImportError:
+    pytest = None
 
 CODING_AGENT_CONFIG = {
     "OLLAMA_API_URL": "http://192.168.1.127:11434/api/chat",
@@ -21,8 +36,177 @@ CODING_AGENT_CONFIG = {
     }
 }
 
+# Shared HTTP session: keep-alive connections are reused across all Ollama calls
+_SESSION = requests.Session()
+# Refused connections and 502/503/504 (e.g. while a model loads) are retried with
+# exponential backoff; a request that timed out mid-generation is re-sent only once
+_RETRY = Retry(total=3, read=1, backoff_factor=0.5, status_forcelist=(502, 503, 504),
+               allowed_methods=frozenset({"GET", "POST"}), raise_on_status=False)
+try:
+    _RETRY = _RETRY.new(backoff_jitter=0.5)  # urllib3 >= 2
+except TypeError:
+    pass
+_SESSION.mount("http://", HTTPAdapter(pool_connections=10, pool_maxsize=10, max_retries=_RETRY))
+_SESSION.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=10, max_retries=_RETRY))
+_SESSION.headers.update({"Connection": "keep-alive", "Accept-Encoding": "gzip, deflate"})
+SOLUTION_INDEX_FILE = ".cache_index.json"  # in OUTPUT_DIR: exact-match cache of passing solutions
+OLLAMA_TIMEOUT = (10, 300)  # (connect, read) seconds
+OLLAMA_KEEP_ALIVE = "30m"  # keep models loaded for the whole session
+
+class LLMCache:
+    """Small LRU cache of LLM replies, keyed by a SHA-256 of the request payload."""
+
+    def __init__(self, maxsize: int = 512):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def cache_key(model: str, messages: list, options: dict) -> str:
+        payload = {"model": model, "messages": messages, "options": options}
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def is_cacheable(options: dict) -> bool:
+        """Only (near-)deterministic sampling gives a reply worth reusing."""
+        return options.get("temperature", 1) <= 0.1
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+_LLM_CACHE = LLMCache()
+
+# Leading ```lang / trailing ``` fence lines of a markdown code block
+_FENCE_RE = re.compile(r"^\s*```(?:python|[a-zA-Z]*)?\s*\n?|\n?```\s*$", re.MULTILINE)
+
+def _clean_code(raw: str) -> str:
+    """Strip out any accidental markdown fences."""
+    text = raw.strip()
+    if text.startswith("```") and text.endswith("```") and text.count("```") == 2:
+        # Quick path: a single fenced block, drop the opening line and closing fence
+        body = text.removesuffix("```")
+        opening, newline, code = body.partition("\n")
+        return (code if newline else opening[3:]).strip()
+    return _FENCE_RE.sub("", raw).strip()
+
+NUM_CTX_BUCKETS = (2048, 4096, 8192, 16384)  # few sizes, so Ollama rarely has to reload the model
+NUM_CTX_REPLY_RESERVE = 2048  # tokens left free for the model's answer
+
+def _pick_num_ctx(messages: list, max_ctx: int) -> int:
+    """Smallest context bucket that fits the prompt (~3 chars/token) plus the reply."""
+    needed = sum(len(m["content"]) for m in messages) // 3 + NUM_CTX_REPLY_RESERVE
+    bucket = next((b for b in NUM_CTX_BUCKETS if b >= needed), NUM_CTX_BUCKETS[-1])
+    return min(bucket, max_ctx)
+
+def _read_ollama_stream(response: requests.Response) -> str:
+    """Assemble the reply from Ollama's line-delimited JSON stream as chunks arrive."""
+    content = bytearray()
+    for line in response.iter_lines():
+        if not line:
+            continue
+        chunk = json.loads(line)
+        if "error" in chunk:
+            raise requests.exceptions.RequestException(chunk["error"])
+        content += chunk.get("message", {}).get("content", "").encode("utf-8")
+        if chunk.get("done"):
+            break
+    return content.decode("utf-8").strip()
+
+def _warm_up_models(session: requests.Session):
+    """Load every configured model into Ollama (empty prompt) so the first real call skips the load."""
+    url = CODING_AGENT_CONFIG["OLLAMA_API_URL"].replace("/api/chat", "/api/generate")
+    for name in {cfg["name"] for cfg in CODING_AGENT_CONFIG["MODELS"].values()}:
+        try:
+            session.post(url, json={"model": name, "prompt": "", "keep_alive": OLLAMA_KEEP_ALIVE},
+                         timeout=OLLAMA_TIMEOUT).raise_for_status()
+        except requests.exceptions.RequestException as e:
+            print(f"Warm-up of '{name}' failed: {e}")
+
+def _write_text(path: str, text: str):
+    """Write text with a single unbuffered os.write loop (the payloads are small)."""
+    data = text.encode("utf-8")
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
+def _solution_key(language: str, prompt: str) -> str:
+    return hashlib.sha256(f"{language}\0{prompt}".encode("utf-8")).hexdigest()
+
+def _load_solution_index() -> dict:
+    path = os.path.join(CODING_AGENT_CONFIG["OUTPUT_DIR"], SOLUTION_INDEX_FILE)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def _store_solution(key: str, entry: dict):
+    """Add an entry to the solution index, replacing the file atomically."""
+    index = _load_solution_index()
+    index[key] = entry
+    path = os.path.join(CODING_AGENT_CONFIG["OUTPUT_DIR"], SOLUTION_INDEX_FILE)
+    _write_text(path + ".tmp", json.dumps(index))
+    os.replace(path + ".tmp", path)
+
+def _run_pytest_in_process(args, cwd):
+    """Run pytest inside this interpreter (no process spawn, plugins imported once)."""
+    out, err = io.StringIO(), io.StringIO()
+    prev_cwd, saved_path = os.getcwd(), list(sys.path)
+    os.chdir(cwd)
+    try:
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            returncode = int(pytest.main([*args, "-p", "no:cacheprovider", "-p", "no:randomly"]))
+    finally:
+        os.chdir(prev_cwd)
+        sys.path[:] = saved_path
+        # Forget the modules under test so the next attempt imports the rewritten files
+        project_dir = os.path.abspath(cwd)
+        for name, module in list(sys.modules.items()):
+            module_file = getattr(module, "__file__", None)
+            if name != "__main__" and module_file and os.path.dirname(os.path.abspath(module_file)) == project_dir:
+                del sys.modules[name]
+        importlib.invalidate_caches()
+    return out.getvalue(), err.getvalue(), returncode
+
+# System prompts: built once so every call sends byte-identical leading messages
+_SYSTEM_CODER_TMPL = """You are an expert {language} programmer. Your task is to write a single, clean, well-commented, and efficient code snippet that fulfills the user's request.
+        Respond with ONLY the code snippet, enclosed in a single markdown code block. Do not include any explanations or conversational text outside the code block."""
+_SYSTEM_TESTER_MSG = {'role': 'system', 'content': """
+        You are an expert Python unit test developer. Your task is to write pytest unit tests for the Python code provided by the user.
+
+        == Instructions ==
+        1. Write valid `pytest` test functions.
+        2. Import necessary classes/functions from the original file.
+        3. Implement test cases that cover all aspects of the code.
+        4. Return ONLY the Python code for the unit tests without markdown fences.
+        """}
+
 class CodingAgentV2:
     def __init__(self):
+        self._session = _SESSION
+        # Load the models in the background while the user is still typing
+        threading.Thread(target=_warm_up_models, args=(self._session,), daemon=True).start()
+        self._system_coder_msgs = {}  # language -> system message, formatted once
         os.makedirs(CODING_AGENT_CONFIG["OUTPUT_DIR"], exist_ok=True)
 
     def _call_ollama_api(self, messages: list, model_key: str) -> str:
@@ -31,71 +215,91 @@ class CodingAgentV2:
         if not model_config:
             raise ValueError(f"Model key '{model_key}' not found in config.")
 
+        key = None
+        if LLMCache.is_cacheable(model_config["options"]):
+            key = LLMCache.cache_key(model_config["name"], messages, model_config["options"])
+            cached = _LLM_CACHE.get(key)
+            if cached is not None:
+                return cached
+
         try:
+            options = dict(model_config["options"])
+            options["num_ctx"] = _pick_num_ctx(messages, options.get("num_ctx", NUM_CTX_BUCKETS[-1]))
             payload = {
                 "model": model_config["name"],
                 "messages": messages,
-                "options": model_config["options"],
-                "stream": False
+                "options": options,
+                "stream": True,
+                "keep_alive": OLLAMA_KEEP_ALIVE
             }
-            response = requests.post(CODING_AGENT_CONFIG["OLLAMA_API_URL"], json=payload, timeout=None)
-            response.raise_for_status()
-            return response.json().get("message", {}).get("content", "").strip()
+            with self._session.post(CODING_AGENT_CONFIG["OLLAMA_API_URL"], json=payload, timeout=OLLAMA_TIMEOUT, stream=True) as response:
+                response.raise_for_status()
+                content = _read_ollama_stream(response)
         except requests.exceptions.RequestException as e:
             print(f"Coding Agent API Error: {e}")
             return f"Error: Failed to connect to '{model_config['name']}' API. Details: {e}"
+        if key is not None:
+            _LLM_CACHE.set(key, content)
+        return content
 
     def _generate_code(self, language: str, prompt: str) -> str:
         """Generates a code snippet based on a natural language prompt."""
         print(f"  -> Generating {language} code...")
-        system_prompt = f"""You are an expert {language} programmer. Your task is to write a single, clean, well-commented, and efficient code snippet that fulfills the user's request.
-        Respond with ONLY the code snippet, enclosed in a single markdown code block. Do not include any explanations or conversational text outside the code block."""
+        system_msg = self._system_coder_msgs.get(language)
+        if system_msg is None:
+            system_msg = self._system_coder_msgs[language] = {'role': 'system', 'content': _SYSTEM_CODER_TMPL.format(language=language)}
 
-        messages = [{'role': 'system', 'content': system_prompt}, {'role': 'user', 'content': prompt}]
+        messages = [system_msg, {'role': 'user', 'content': prompt}]
         raw_code = self._call_ollama_api(messages, "coder")
-        cleaned_code = re.sub(r'```python|```', '', raw_code).strip()
+        cleaned_code = _clean_code(raw_code)
         return cleaned_code
 
     def _generate_unit_tests(self, code_content: str) -> str:
         """Generates unit tests based on the provided code content."""
         print("  -> Generating unit tests...")
-        prompt = f"""
-        You are an expert Python unit test developer. Your task is to write pytest unit tests for the provided Python code.
-
+        # Fixed instructions go first so the server can reuse their prefix; the code comes last
+        user_message = f"""
         == Generated Python Code ==
         ```python
         {code_content}
         ```
-
-        == Instructions ==
-        1. Write valid `pytest` test functions.
-        2. Import necessary classes/functions from the original file.
-        3. Implement test cases that cover all aspects of the code.
-        4. Return ONLY the Python code for the unit tests without markdown fences.
         """
-        raw_test_code = self._call_ollama_api([{'role': 'user', 'content': prompt}], "tester")
-        cleaned_test_code = re.sub(r'```python|```', '', raw_test_code).strip()
+        messages = [_SYSTEM_TESTER_MSG, {'role': 'user', 'content': user_message}]
+        raw_test_code = self._call_ollama_api(messages, "tester")
+        cleaned_test_code = _clean_code(raw_test_code)
         return cleaned_test_code
 
     def execute_coding_agent_v2(self, language: str, code_file: str, prompt: str) -> str:
         """Orchestrates the entire code generation and testing process."""
+        # The same request already produced passing code: answer without any LLM call or test run
+        solution_key = _solution_key(language, prompt)
+        cached = _load_solution_index().get(solution_key)
+        if cached is not None:
+            print(f"  -> Reusing cached solution, saving code to '{code_file}'...")
+            _write_text(code_file, cached["code"])
+            return f"Code generation and testing successful (cached solution). All tests passed.\n\nFinal code:\n```python\n{cached['code']}\n```\n\nTest results:\n{cached['test_output']}"
+
         try:
             generated_code = self._generate_code(language, prompt)
             print(f"  -> Saving code to '{code_file}'...")
-            with open(code_file, "w") as f:
-                f.write(generated_code)
+            _write_text(code_file, generated_code)
 
             test_file = f"test_{code_file}"
             generated_tests = self._generate_unit_tests(generated_code)
             print(f"  -> Saving tests to '{test_file}'...")
-            with open(test_file, "w") as f:
-                f.write(generated_tests)
+            _write_text(test_file, generated_tests)
 
             # Run pytest (assuming it's installed in the environment)
             print("  -> Running unit tests...")
-            test_output = os.popen(f"pytest -q --tb=no {test_file}").read()
+            if pytest is not None:
+                stdout, stderr, returncode = _run_pytest_in_process(["-q", "--tb=no", test_file], os.getcwd())
+            else:
+                res = subprocess.run(["pytest", "-q", "--tb=no", test_file], capture_output=True, text=True)
+                stdout, stderr, returncode = res.stdout, res.stderr, res.returncode
+            test_output = stdout + stderr
 
-            if "FAILED" not in test_output:
+            if returncode == 0:
+                _store_solution(solution_key, {"file": code_file, "code": generated_code, "test_output": test_output})
                 return f"Code generation and testing successful. All tests passed.\n\nFinal code:\n```python\n{generated_code}\n```\n\nTest results:\n{test_output}"
             else:
                 return f"Code generation failed. Tests did not pass.\n\nGenerated code:\n```python\n{generated_code}\n```\n\nTest output:\n{test_output}"
@@ -107,8 +311,11 @@ def _get_multiline_input(prompt_message: str) -> str:
     """Helper function to get multi-line input from the user."""
     print(f"\n{prompt_message}")
     print(" (Enter your text. Press Ctrl-D on Linux/macOS or Ctrl-Z+Enter on Windows when done)")
-    lines = sys.stdin.readlines()
-    return "".join(lines).strip()
+    if sys.stdin.isatty():
+        # Earlier input() answers went through readline, so nothing is left in
+        # sys.stdin's text buffer: read the raw bytes in one go and decode once
+        return sys.stdin.buffer.read().decode("utf-8", "replace").strip()
+    return sys.stdin.read().strip()
 
 def main():
     """Main function to run the agent in an interactive CLI mode."""
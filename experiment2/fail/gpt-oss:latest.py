@@ -6,14 +6,31 @@ Created on Sat Oct 25 21:28:26 2025
 @author: marek
 """
 import os
+import io
 import sys
 import json
+import multiprocessing
+import contextlib
+import errno
+import importlib
+import hashlib
+import threading
 import re
 import shutil
 import subprocess
+import tempfile
+import time
 import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple, Optional, Dict, List
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+try:
+    import pytest  # Run tests in-process when available
+except ImportError:
+    pytest = None
 
 # ----------------------------------------------------------------------
 # Configuration
@@ -25,55 +42,330 @@ CODING_AGENT_CONFIG = {
         "coder": {"name": "qwen3-coder:latest", "options": {"temperature": 0.6, "num_ctx": 16000, "top_p": 0.95}},
         "tester": {"name": "qwen3-coder:latest", "options": {"temperature": 0.1, "num_ctx": 16000, "top_p": 0.8}},
         "debugger": {"name": "qwen3-coder:latest", "options": {"temperature": 0.1, "num_ctx": 16000, "top_p": 0.95}},
-        "analyzer": {"name": "qwen3-coder:latest", "options": {"temperature": 0.0, "num_ctx": 16000}},
         "planner": {"name": "qwen3-coder:latest", "options": {"temperature": 0.2, "num_ctx": 16000, "top_p": 0.8}},
     }
 }
 MAX_DEBUG_ATTEMPTS = 3
 MAX_TEST_REGEN_ATTEMPTS = 2
+MAX_INFLIGHT_LLM_CALLS = 2  # keep within the server's parallel slots (OLLAMA_NUM_PARALLEL)
+SOLUTION_INDEX_FILE = ".cache_index.json"  # in OUTPUT_DIR: exact-match cache of passing solutions
+
+# Shared HTTP session: keep-alive connections are reused across all Ollama calls
+_SESSION = requests.Session()
+# Refused connections and 502/503/504 (e.g. while a model loads) are retried with
+# exponential backoff; a request that timed out mid-generation is re-sent only once
+_RETRY = Retry(total=3, read=1, backoff_factor=0.5, status_forcelist=(502, 503, 504),
+               allowed_methods=frozenset({"GET", "POST"}), raise_on_status=False)
+try:
+    _RETRY = _RETRY.new(backoff_jitter=0.5)  # urllib3 >= 2
+except TypeError:
+    pass
+_SESSION.mount("http://", HTTPAdapter(pool_connections=10, pool_maxsize=10, max_retries=_RETRY))
+_SESSION.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=10, max_retries=_RETRY))
+_SESSION.headers.update({"Connection": "keep-alive", "Accept-Encoding": "gzip, deflate"})
+OLLAMA_TIMEOUT = (10, 300)  # (connect, read) seconds
+OLLAMA_KEEP_ALIVE = "30m"  # keep models loaded for the whole session
+
+
+class LLMCache:
+    """Small LRU cache of LLM replies, keyed by a SHA-256 of the request payload."""
+
+    def __init__(self, maxsize: int = 512):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def cache_key(model: str, messages: list, options: dict) -> str:
+        payload = {"model": model, "messages": messages, "options": options}
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def is_cacheable(options: dict) -> bool:
+        """Only (near-)deterministic sampling gives a reply worth reusing."""
+        return options.get("temperature", 1) <= 0.1
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+_LLM_CACHE = LLMCache()
+
 
 # ----------------------------------------------------------------------
 # Helpers
 # ----------------------------------------------------------------------
-def _call_ollama(messages: List[Dict], model_key: str) -> str:
-    """Send a request to Ollama and return the response string."""
+NUM_CTX_BUCKETS = (2048, 4096, 8192, 16384)  # few sizes, so Ollama rarely has to reload the model
+NUM_CTX_REPLY_RESERVE = 2048  # tokens left free for the model's answer
+
+
+def _pick_num_ctx(messages: List[Dict], max_ctx: int) -> int:
+    """Smallest context bucket that fits the prompt (~3 chars/token) plus the reply."""
+    needed = sum(len(m["content"]) for m in messages) // 3 + NUM_CTX_REPLY_RESERVE
+    bucket = next((b for b in NUM_CTX_BUCKETS if b >= needed), NUM_CTX_BUCKETS[-1])
+    return min(bucket, max_ctx)
+
+
+def _read_ollama_stream(response: requests.Response) -> str:
+    """Assemble the reply from Ollama's line-delimited JSON stream as chunks arrive."""
+    content = bytearray()
+    for line in response.iter_lines():
+        if not line:
+            continue
+        chunk = json.loads(line)
+        if "error" in chunk:
+            raise requests.exceptions.RequestException(chunk["error"])
+        content += chunk.get("message", {}).get("content", "").encode("utf-8")
+        if chunk.get("done"):
+            break
+    return content.decode("utf-8").strip()
+
+
+def _call_ollama(messages: List[Dict], model_key: str, session: requests.Session = _SESSION,
+                 response_format: Optional[str] = None, use_cache: bool = True) -> str:
+    """Send a request to Ollama and return the response string (response_format="json" forces JSON).
+
+    use_cache=False skips the cache lookup and forces a new reply (the reply is still stored).
+    """
     cfg = CODING_AGENT_CONFIG["MODELS"].get(model_key)
     if not cfg:
         raise ValueError(f"Model '{model_key}' not configured")
 
+    key = None
+    if LLMCache.is_cacheable(cfg["options"]):
+        key_options = dict(cfg["options"], format=response_format) if response_format else cfg["options"]
+        key = LLMCache.cache_key(cfg["name"], messages, key_options)
+        cached = _LLM_CACHE.get(key) if use_cache else None
+        if cached is not None:
+            return cached
+
+    options = dict(cfg["options"])
+    options["num_ctx"] = _pick_num_ctx(messages, options.get("num_ctx", NUM_CTX_BUCKETS[-1]))
     payload = {
         "model": cfg["name"],
         "messages": messages,
-        "options": cfg["options"],
-        "stream": False,
+        "options": options,
+        "stream": True,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
     }
+    if response_format:
+        payload["format"] = response_format
 
     try:
-        r = requests.post(CODING_AGENT_CONFIG["OLLAMA_API_URL"], json=payload, timeout=None)
-        r.raise_for_status()
-        return r.json().get("message", {}).get("content", "").strip()
+        with session.post(CODING_AGENT_CONFIG["OLLAMA_API_URL"], json=payload,
+                          timeout=OLLAMA_TIMEOUT, stream=True) as r:
+            r.raise_for_status()
+            content = _read_ollama_stream(r)
     except Exception as e:
         return f"Error calling Ollama: {e}"
+    if key is not None:
+        _LLM_CACHE.set(key, content)
+    return content
+
+
+def _warm_up_models(session: requests.Session) -> None:
+    """Load every configured model into Ollama (empty prompt) so the first real call skips the load."""
+    url = CODING_AGENT_CONFIG["OLLAMA_API_URL"].replace("/api/chat", "/api/generate")
+    for name in {cfg["name"] for cfg in CODING_AGENT_CONFIG["MODELS"].values()}:
+        try:
+            session.post(url, json={"model": name, "prompt": "", "keep_alive": OLLAMA_KEEP_ALIVE},
+                         timeout=OLLAMA_TIMEOUT).raise_for_status()
+        except requests.exceptions.RequestException as e:
+            print(f"Warm-up of '{name}' failed: {e}")
+
+
+def _run_pytest_in_process(args: List[str], cwd: str) -> Tuple[str, str, int]:
+    """Run pytest inside this interpreter (no process spawn, plugins imported once)."""
+    out, err = io.StringIO(), io.StringIO()
+    prev_cwd, saved_path = os.getcwd(), list(sys.path)
+    os.chdir(cwd)
+    try:
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            returncode = int(pytest.main([*args, "-p", "no:cacheprovider", "-p", "no:randomly"]))
+    finally:
+        os.chdir(prev_cwd)
+        sys.path[:] = saved_path
+        # Forget the modules under test so the next attempt imports the rewritten files
+        project_dir = os.path.abspath(cwd)
+        for name, module in list(sys.modules.items()):
+            module_file = getattr(module, "__file__", None)
+            if name != "__main__" and module_file and os.path.dirname(os.path.abspath(module_file)) == project_dir:
+                del sys.modules[name]
+        importlib.invalidate_caches()
+    return out.getvalue(), err.getvalue(), returncode
+
+
+# Leading ```lang / trailing ``` fence lines of a markdown code block
+_FENCE_RE = re.compile(r"^\s*```(?:python|[a-zA-Z]*)?\s*\n?|\n?```\s*$", re.MULTILINE)
 
 
 def _clean_code(raw: str) -> str:
     """Strip out any accidental markdown fences."""
-    return re.sub(r"```(?:python)?|```", "", raw).strip()
+    text = raw.strip()
+    if text.startswith("```") and text.endswith("```") and text.count("```") == 2:
+        # Quick path: a single fenced block, drop the opening line and closing fence
+        body = text.removesuffix("```")
+        opening, newline, code = body.partition("\n")
+        return (code if newline else opening[3:]).strip()
+    return _FENCE_RE.sub("", raw).strip()
+
+
+# System prompts: built once so every call sends byte-identical leading messages
+_SYSTEM_CODER_TMPL = (
+    "You are an expert {language} programmer. "
+    "Write a single, clean, well‑commented snippet that fulfills the user's request.\n"
+    "Respond with ONLY the code snippet, no explanations."
+)
+_SYSTEM_PLANNER_TMPL = (
+    "You are an expert QA engineer. Create a numbered list of test cases for code that will be written in {language}.\n"
+    "Provide ONLY a numbered list, no markdown or explanations.\n"
+)
+_SYSTEM_TESTER_MSG = {"role": "system", "content": (
+    "Write pytest tests for the code given by the user (strictly following the test plan).\n"
+    "Return only the test file content, no markdown."
+)}
+_SYSTEM_FIXER_MSG = {"role": "system", "content": (
+    "You are a senior software engineer. The code given by the user failed its tests.\n"
+    "Decide whether the failure is due to a code bug, a test bug, or cannot determine, "
+    "and unless the tests are to blame, fix the code.\n"
+    'Respond with a JSON object: {"verdict": "code_bug" | "test_bug" | "cannot_determine", '
+    '"fixed_code": "<the full corrected code, or an empty string for test_bug>"}'
+)}
+
+
+def _persist_file(src: str, dst: str) -> None:
+    """Move src to dst (a rename on the same filesystem); copy only across devices."""
+    try:
+        os.replace(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.copyfile(src, dst)
+
+
+def _solution_key(language: str, prompt: str, mode: str, initial_code: Optional[str]) -> str:
+    raw = "\0".join((language, prompt, mode, initial_code or ""))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _load_solution_index() -> Dict[str, Dict]:
+    path = os.path.join(CODING_AGENT_CONFIG["OUTPUT_DIR"], SOLUTION_INDEX_FILE)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _store_solution(key: str, entry: Dict) -> None:
+    """Add an entry to the solution index, replacing the file atomically."""
+    index = _load_solution_index()
+    index[key] = entry
+    path = os.path.join(CODING_AGENT_CONFIG["OUTPUT_DIR"], SOLUTION_INDEX_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, path)
+
+
+def _pytest_worker_loop(conn) -> None:
+    """Child process body: run each (cwd, args) pytest job received until None or EOF."""
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        cwd, args = job
+        try:
+            conn.send(_run_pytest_in_process(args, cwd))
+        except Exception as e:
+            conn.send(("", f"Error: pytest crashed. Details: {e}", 1))
+
+
+class PytestWorker:
+    """Long-lived pytest process: interpreter start-up and plugin imports are paid once.
+
+    Tests still run outside the agent's process, so generated code cannot
+    crash it, and a run that hangs is killed (a fresh worker is started on
+    the next call).
+    """
+
+    def __init__(self):
+        # spawn: the child starts clean instead of inheriting the agent's memory and threads
+        self._ctx = multiprocessing.get_context("spawn")
+        self._proc = None
+        self._conn = None
+
+    def start(self) -> None:
+        if self._proc is not None and self._proc.is_alive():
+            return
+        parent_conn, child_conn = self._ctx.Pipe()
+        self._proc = self._ctx.Process(target=_pytest_worker_loop, args=(child_conn,), daemon=True)
+        self._proc.start()
+        child_conn.close()
+        self._conn = parent_conn
+
+    def run(self, args: List[str], cwd: str, timeout: int) -> Tuple[str, str, int]:
+        self.start()
+        try:
+            self._conn.send((cwd, args))
+            if self._conn.poll(timeout):
+                return self._conn.recv()
+            error = f"Error: pytest timed out after {timeout}s"
+        except (EOFError, OSError) as e:
+            error = f"Error: pytest worker died. Details: {e}"
+        self.close()
+        return "", error, 1
+
+    def close(self) -> None:
+        if self._proc is None:
+            return
+        try:
+            self._conn.send(None)
+        except OSError:
+            pass
+        self._proc.join(timeout=1)
+        if self._proc.is_alive():
+            self._proc.terminate()
+            self._proc.join()
+        self._conn.close()
+        self._proc = None
+        self._conn = None
 
 
 # ----------------------------------------------------------------------
 # Project management – a lightweight temp dir
 # ----------------------------------------------------------------------
 class ProjectManager:
-    def __init__(self, base_dir: str = "temp_coding_project"):
-        self.base_dir = base_dir
+    def __init__(self, base_dir: Optional[str] = None, pytest_worker: Optional[PytestWorker] = None):
+        self.base_dir = base_dir  # parent of the per-run project dirs (None: system temp dir)
+        self.pytest_worker = pytest_worker
         self.current_dir = None
+        self.mtimes: Dict[str, float] = {}  # file name -> mtime of its last write
 
     def create_project(self):
-        if os.path.exists(self.base_dir):
-            shutil.rmtree(self.base_dir)
-        os.makedirs(self.base_dir, exist_ok=True)
-        self.current_dir = self.base_dir
+        # A fresh, uniquely named dir per run: never wipes a project another run still uses
+        self.cleanup()
+        if self.base_dir:
+            os.makedirs(self.base_dir, exist_ok=True)
+        self.current_dir = tempfile.mkdtemp(prefix="proj_", dir=self.base_dir)
+        self.mtimes.clear()
 
     def write_file(self, file_name: str, content: str):
         if not self.current_dir:
@@ -81,10 +373,17 @@ class ProjectManager:
         path = os.path.join(self.current_dir, file_name)
         with open(path, "w", encoding="utf-8") as f:
             f.write(content)
+            f.flush()
+            # fstat on the open fd: no second path lookup
+            self.mtimes[file_name] = os.fstat(f.fileno()).st_mtime
 
     def run_command(self, cmd: List[str], timeout: int = 60) -> Tuple[str, str, int]:
         if not self.current_dir:
             raise RuntimeError("Project not created")
+        if cmd and cmd[0] == "pytest" and self.pytest_worker is not None:
+            return self.pytest_worker.run(cmd[1:], self.current_dir, timeout)
+        if cmd and cmd[0] == "pytest" and pytest is not None:
+            return _run_pytest_in_process(cmd[1:], self.current_dir)
         try:
             res = subprocess.run(
                 cmd,
@@ -98,8 +397,8 @@ class ProjectManager:
             return "", f"Command error: {e}", 1
 
     def cleanup(self):
-        if self.base_dir and os.path.exists(self.base_dir):
-            shutil.rmtree(self.base_dir)
+        if self.current_dir:
+            shutil.rmtree(self.current_dir, ignore_errors=True)
             self.current_dir = None
 
 
@@ -126,18 +425,19 @@ class ConversationManager:
         self.conversations[cid]["turns"].append((user, assistant))
 
     def save_successful_code(self, cid: int, file_name: str, prompt: str,
-                              code: str, test_plan: str):
+                              code: str, test_plan: str, write_time: Optional[float] = None):
         self.conversations[cid]["solutions"].append(
             {"file": file_name, "prompt": prompt, "code": code,
-             "test_plan": test_plan, "time": os.path.getmtime(file_name)}
+             "test_plan": test_plan, "time": write_time or time.time()}
         )
 
     def save_failed_code(self, cid: int, file_name: str, prompt: str,
-                         code: str, test_plan: str, test_output: str):
+                         code: str, test_plan: str, test_output: str,
+                         write_time: Optional[float] = None):
         self.conversations[cid]["failures"].append(
             {"file": file_name, "prompt": prompt, "code": code,
              "test_plan": test_plan, "output": test_output,
-             "time": os.path.getmtime(file_name)}
+             "time": write_time or time.time()}
         )
 
 
@@ -147,18 +447,46 @@ class ConversationManager:
 class CodingAgentV2:
     def __init__(self, conv_manager: ConversationManager):
         self.conv = conv_manager
-        self.project = ProjectManager()
+        # Started now so its start-up overlaps with the first LLM calls
+        self._pytest_worker = PytestWorker() if pytest is not None else None
+        if self._pytest_worker is not None:
+            self._pytest_worker.start()
+        self.project = ProjectManager(pytest_worker=self._pytest_worker)
+        self._session = _SESSION
+        # Independent LLM calls are overlapped on these threads (network-bound, GIL released)
+        self._pool = ThreadPoolExecutor(max_workers=MAX_INFLIGHT_LLM_CALLS)
+        # Load the models in the background while the user is still typing
+        self._pool.submit(_warm_up_models, self._session)
+        # Language-specific system messages, formatted once per (template, language)
+        self._system_msgs: Dict[Tuple[str, str], Dict] = {}
+        # Last (code, "=== Code ===" section) and ((plan, code), tester message): the debug
+        # loop sends the same multi-KB code in several prompts, so it is formatted once
+        self._code_section: Tuple[str, str] = ("", "")
+        self._tests_msg: Tuple[Tuple[str, str], Dict] = (("", ""), {})
         os.makedirs(CODING_AGENT_CONFIG["OUTPUT_DIR"], exist_ok=True)
 
+    def close(self) -> None:
+        """Stop the background threads and the pytest worker."""
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        if self._pytest_worker is not None:
+            self._pytest_worker.close()
+
+    def _system_msg(self, template: str, language: str) -> Dict:
+        key = (template, language)
+        msg = self._system_msgs.get(key)
+        if msg is None:
+            msg = self._system_msgs[key] = {"role": "system", "content": template.format(language=language)}
+        return msg
+
+    def _format_code_section(self, code: str) -> str:
+        if self._code_section[0] is not code:
+            self._code_section = (code, "".join(("=== Code ===\n```python\n", code, "\n```\n")))
+        return self._code_section[1]
+
     # --- Code generation -------------------------------------------------
     def _generate_code(self, language: str, prompt: str,
                        initial_code: Optional[str] = None,
                        mode: str = "generate") -> str:
-        system_prompt = (
-            f"You are an expert {language} programmer. "
-            "Write a single, clean, well‑commented snippet that fulfills the user's request.\n"
-            "Respond with ONLY the code snippet, no explanations."
-        )
         user_msg = prompt
         if initial_code:
             if mode == "refactor":
@@ -175,74 +503,101 @@ class CodingAgentV2:
                 )
 
         resp = _call_ollama(
-            [{"role": "system", "content": system_prompt},
+            [self._system_msg(_SYSTEM_CODER_TMPL, language),
              {"role": "user", "content": user_msg}],
             "coder",
+            self._session,
         )
         return _clean_code(resp)
 
     # --- Test plan generation -------------------------------------------
     def _generate_test_plan(self, language: str, code_prompt: str) -> str:
-        plan_prompt = (
-            f"You are an expert QA engineer. Create a numbered list of test cases for code that will be written in {language}.\n"
-            f"=== User Request ===\n{code_prompt}\n"
-            "Provide ONLY a numbered list, no markdown or explanations.\n"
-        )
-        resp = _call_ollama([{"role": "user", "content": plan_prompt}], "planner")
+        # Static instructions first (system), request last, so the server can reuse the prompt prefix
+        user_msg = f"=== User Request ===\n{code_prompt}\n"
+        resp = _call_ollama(
+            [self._system_msg(_SYSTEM_PLANNER_TMPL, language),
+             {"role": "user", "content": user_msg}],
+            "planner", self._session)
         return resp.strip()
 
     # --- Unit test generation --------------------------------------------
-    def _generate_unit_tests(self, file_name: str, code: str, test_plan: str) -> str:
-        test_prompt = (
-            f"Write pytest tests for the following code (strictly following the test plan):\n"
-            f"=== Code ===\n```python\n{code}\n```\n"
-            f"=== Test Plan ===\n{test_plan}\n"
-            "Return only the test file content, no markdown."
-        )
-        resp = _call_ollama([{"role": "user", "content": test_prompt}], "tester")
-        return _clean_code(resp)
-
-    # --- Debugging -------------------------------------------------------
-    def _debug_code(self, code: str, test_output: str, test_file: str) -> str:
-        debug_prompt = (
-            f"You are a senior software engineer. The following code failed its tests:\n"
-            f"=== Code ===\n```python\n{code}\n```\n"
-            f"=== Test Failure ===\n```\n{test_output}\n```\n"
-            "Fix the code and return ONLY the corrected snippet, no markdown."
-        )
-        resp = _call_ollama([{"role": "user", "content": debug_prompt}], "debugger")
+    def _generate_unit_tests(self, file_name: str, code: str, test_plan: str,
+                             use_cache: bool = True) -> str:
+        """Pass use_cache=False to get a fresh set when the previous tests were judged faulty."""
+        # The plan never changes between attempts, so it goes before the code
+        key, user_msg = self._tests_msg
+        if key[0] is not test_plan or key[1] is not code:
+            content = "".join(("=== Test Plan ===\n", test_plan, "\n", self._format_code_section(code)))
+            user_msg = {"role": "user", "content": content}
+            self._tests_msg = ((test_plan, code), user_msg)
+        resp = _call_ollama([_SYSTEM_TESTER_MSG, user_msg], "tester", self._session,
+                            use_cache=use_cache)
         return _clean_code(resp)
 
-    # --- Test‑failure analysis ------------------------------------------
-    def _analyze_test_failure(self, code: str, test_output: str) -> str:
-        analysis_prompt = (
-            f"You are a QA expert. Determine whether the failure is due to a code bug, a test bug, or cannot determine.\n"
-            f"=== Code ===\n```python\n{code}\n```\n"
-            f"=== Test Output ===\n```\n{test_output}\n```\n"
-            "Respond with ONE of: 'code_bug', 'test_bug', 'cannot_determine'."
-        )
-        resp = _call_ollama([{"role": "user", "content": analysis_prompt}], "analyzer")
-        ans = resp.strip().lower()
-        return ans if ans in {"code_bug", "test_bug"} else "cannot_determine"
+    # --- Test‑failure analysis and debugging -----------------------------
+    def _analyze_and_fix(self, code: str, test_output: str,
+                         use_cache: bool = True) -> Tuple[str, Optional[str]]:
+        """Classify the failure and get the fixed code in one round-trip: (verdict, fixed_code)."""
+        user_msg = "".join((self._format_code_section(code),
+                            "=== Test Output ===\n```\n", test_output, "\n```\n"))
+        resp = _call_ollama(
+            [_SYSTEM_FIXER_MSG, {"role": "user", "content": user_msg}],
+            "debugger", self._session, response_format="json", use_cache=use_cache)
+        try:
+            obj = json.loads(resp)
+        except json.JSONDecodeError:
+            return "cannot_determine", None
+        if not isinstance(obj, dict):
+            return "cannot_determine", None
+        verdict = str(obj.get("verdict", "")).strip().lower()
+        if verdict not in {"code_bug", "test_bug"}:
+            verdict = "cannot_determine"
+        fixed_code = obj.get("fixed_code")
+        if not isinstance(fixed_code, str) or not fixed_code.strip():
+            return verdict, None
+        return verdict, _clean_code(fixed_code)
 
     # --- Main orchestration ---------------------------------------------
     def run(self, conv_id: int, language: str, file_name: str,
-            prompt: str, test_plan: str, mode: str = "generate",
+            prompt: str, test_plan: Optional[str], mode: str = "generate",
             initial_code: Optional[str] = None) -> str:
+        """If test_plan is None it is generated alongside the code."""
+        # The same request already produced passing code: answer without any LLM call or test run
+        solution_key = _solution_key(language, prompt, mode, initial_code)
+        cached = _load_solution_index().get(solution_key)
+        if cached is not None:
+            final_path = os.path.join(CODING_AGENT_CONFIG["OUTPUT_DIR"], file_name)
+            with open(final_path, "w", encoding="utf-8") as f:
+                f.write(cached["code"])
+            self.conv.save_successful_code(conv_id, file_name, prompt, cached["code"],
+                                          cached["test_plan"])
+            return (
+                f"✅ All tests passed (cached solution).\n"
+                f"Code saved to: {final_path}\n\n"
+                f"--- CODE ---\n```python\n{cached['code']}\n```\n\n"
+                f"--- TESTS OUTPUT ---\n```\n{cached['stdout']}\n```\n"
+            )
+
         try:
             self.project.create_project()
 
-            # Generate (or refactor/debug) code
+            # Generate (or refactor/debug) code; a missing test plan is generated concurrently
+            plan_future = None
+            if test_plan is None:
+                plan_future = self._pool.submit(self._generate_test_plan, language, prompt)
             code = self._generate_code(language, prompt, initial_code, mode)
+            if plan_future is not None:
+                test_plan = plan_future.result()
             self.project.write_file(file_name, code)
 
             test_file = f"test_{file_name}"
             test_passed = False
             analysis = "code_bug"
+            regenerate = False  # set after a test_bug verdict: the cached tests are the faulty ones
 
             for attempt in range(MAX_DEBUG_ATTEMPTS + MAX_TEST_REGEN_ATTEMPTS):
                 print(f"\n[Attempt {attempt+1}] Generating tests...")
-                tests = self._generate_unit_tests(file_name, code, test_plan)
+                tests = self._generate_unit_tests(file_name, code, test_plan, use_cache=not regenerate)
                 self.project.write_file(test_file, tests)
 
                 stdout, stderr, rc = self.project.run_command(
@@ -251,29 +606,43 @@ class CodingAgentV2:
                 if rc == 0:
                     print("[Tests] Passed")
                     test_passed = True
-                    self.conv.save_successful_code(conv_id, file_name, prompt, code, test_plan)
+                    self.conv.save_successful_code(conv_id, file_name, prompt, code, test_plan,
+                                                  self.project.mtimes.get(file_name))
                     break
                 else:
                     print("[Tests] Failed")
                     failure_output = stdout + stderr
-                    analysis = self._analyze_test_failure(code, failure_output)
+                    # Verdict and fix come back together, so a code bug costs a single LLM call
+                    analysis, fixed_code = self._analyze_and_fix(code, failure_output,
+                                                                 use_cache=not regenerate)
                     print(f"[Analysis] {analysis}")
 
-                    if analysis == "code_bug" and attempt < MAX_DEBUG_ATTEMPTS:
-                        code = self._debug_code(code, failure_output, test_file)
+                    if analysis == "code_bug" and fixed_code and attempt < MAX_DEBUG_ATTEMPTS:
+                        code = fixed_code
                         self.project.write_file(file_name, code)
                         continue
                     elif analysis == "test_bug" and attempt < MAX_TEST_REGEN_ATTEMPTS:
                         print("[Regenerate] Will regenerate tests")
+                        regenerate = True
+                        continue
+                    elif analysis == "cannot_determine" and fixed_code and attempt < MAX_TEST_REGEN_ATTEMPTS:
+                        # Ambiguous: take the fix, the next attempt also regenerates the tests
+                        print("[Fix] Applying the fix and regenerating tests")
+                        regenerate = True
+                        code = fixed_code
+                        self.project.write_file(file_name, code)
                         continue
                     else:
                         print("[Stop] Max attempts or unknown issue")
                         break
 
             final_path = os.path.join(CODING_AGENT_CONFIG["OUTPUT_DIR"], file_name)
-            shutil.copy(os.path.join(self.project.current_dir, file_name), final_path)
+            # The project dir is removed in cleanup(), so the file can be moved out of it
+            _persist_file(os.path.join(self.project.current_dir, file_name), final_path)
 
             if test_passed:
+                _store_solution(solution_key, {"file": file_name, "code": code,
+                                               "test_plan": test_plan, "stdout": stdout})
                 result = (
                     f"✅ All tests passed.\n"
                     f"Code saved to: {final_path}\n\n"
@@ -282,7 +651,8 @@ class CodingAgentV2:
                 )
             else:
                 self.conv.save_failed_code(conv_id, file_name, prompt, code,
-                                          test_plan, failure_output)
+                                          test_plan, failure_output,
+                                          self.project.mtimes.get(file_name))
                 result = (
                     f"❌ Failed to produce working code after {attempt+1} attempts.\n"
                     f"Last code saved to: {final_path}\n\n"
@@ -304,8 +674,11 @@ class CodingAgentV2:
 def _multiline_input(prompt: str) -> str:
     """Read a block of text terminated by EOF (Ctrl-D/Z)."""
     print(prompt)
-    lines = sys.stdin.read()
-    return lines.strip()
+    if sys.stdin.isatty():
+        # Earlier input() answers went through readline, so nothing is left in
+        # sys.stdin's text buffer: read the raw bytes in one go and decode once
+        return sys.stdin.buffer.read().decode("utf-8", "replace").strip()
+    return sys.stdin.read().strip()
 
 
 def main():
@@ -314,12 +687,14 @@ def main():
     file_name = input("▶ Target file name (e.g., my_module.py): ").strip() or "my_module.py"
     prompt = _multiline_input("\n▶ Describe the code you want to generate:")
 
+    # One conversation tracker and agent for the whole session
+    conv = ConversationManager()
+    agent = CodingAgentV2(conv)
+
     # Test plan
     while True:
         choice = input("\n▶ Test Plan – (M)anual or (A)uto? [m/a] ").strip().lower() or "m"
         if choice == "a":
-            conv = ConversationManager()
-            agent = CodingAgentV2(conv)
             plan = agent._generate_test_plan(language, prompt)
             print("\n--- Generated Test Plan ---")
             print(plan)
@@ -351,11 +726,11 @@ def main():
                 print("File not found – proceeding without initial code.")
                 initial_code = None
 
-    conv = ConversationManager()
     conv_id = conv.start_new_conversation(f"{language} code for {file_name}")
-
-    agent = CodingAgentV2(conv)
-    result = agent.run(conv_id, language, file_name, prompt, test_plan, mode, initial_code)
+    try:
+        result = agent.run(conv_id, language, file_name, prompt, test_plan, mode, initial_code)
+    finally:
+        agent.close()
 
     print("\n" + "=" * 60)
     print("=== Agent Execution Completed ===")
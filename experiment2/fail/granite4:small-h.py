@@ -29,6 +29,20 @@ CODING_AGENT_CONFIG = {
 MAX_DEBUG_ATTEMPTS = 3
 MAX_TEST_REGEN_ATTEMPTS = 2
 
+# Old one-shot pattern, kept for replies that contain more than the outer fence pair
+_FENCE_RE = re.compile(r'```python|```')
+
+def _strip_fences(raw: str) -> str:
+    """Strips the markdown fences around a code reply with C-level partition scans."""
+    text = raw.strip()
+    fenced = text.startswith("```")
+    body = text.partition("```")[2] if fenced else text
+    if body.endswith("```"):
+        body = body.rpartition("```")[0]
+    if "```" in body:
+        return _FENCE_RE.sub('', raw).strip()
+    return (body.removeprefix("python") if fenced else body).strip()
+
 class CodingAgentV2:
     """
     A self-correcting coding agent that generates, tests, and debugs code.
@@ -100,7 +114,7 @@ class CodingAgentV2:
         
         messages = [{'role': 'system', 'content': system_prompt}, {'role': 'user', 'content': user_message}]
         raw_code = self._call_ollama_api(messages, "coder")
-        cleaned_code = re.sub(r'```python|```', '', raw_code).strip()
+        cleaned_code = _strip_fences(raw_code).strip()
         return cleaned_code
 
     def _generate_unit_tests(self, file_name: str, code_content: str, test_plan_description: str) -> str:
@@ -129,7 +143,7 @@ class CodingAgentV2:
         6. Return ONLY the Python code for the unit tests. Do NOT include any explanations or markdown fences.
         """
         raw_test_code = self._call_ollama_api([{'role': 'user', 'content': prompt}], "tester")
-        cleaned_test_code = re.sub(r'```python|```', '', raw_test_code).strip()
+        cleaned_test_code = _strip_fences(raw_test_code).strip()
         return cleaned_test_code
 
     def _debug_code(self, code_content: str, test_output: str, test_file: str) -> str:
@@ -156,7 +170,7 @@ class CodingAgentV2:
         """
         messages = [{'role': 'user', 'content': prompt}]
         raw_fixed_code = self._call_ollama_api(messages, "debugger")
-        cleaned_fixed_code = re.sub(r'```python|```', '', raw_fixed_code).strip()
+        cleaned_fixed_code = _strip_fences(raw_fixed_code).strip()
         return cleaned_fixed_code
     
     def _analyze_test_failure(self, code_content: str, test_output: str) -> str:
@@ -11,15 +11,30 @@ Simplified Coding Agent (Single File)
 """
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
+import hashlib
+import threading
 import re
 import os
+import errno
 import shutil
 import sys
 import tempfile
 import subprocess
 import traceback
 import time
+import io
+import contextlib
+import importlib
+from collections import OrderedDict
+from typing import Optional
+
+try:
+    import pytest  # Run tests in-process when available
+except ImportError:
+    pytest = None
 
 # Configuration
 CODING_AGENT_CONFIG = {
@@ -29,88 +44,257 @@ CODING_AGENT_CONFIG = {
         "coder": {"name": "qwen3-coder:latest", "options": {"temperature": 0.6, "num_ctx": 16000, "top_p": 0.95}},
         "tester": {"name": "qwen3-coder:latest", "options": {"temperature": 0.1, "num_ctx": 16000, "top_p": 0.8}},
         "debugger": {"name": "qwen3-coder:latest", "options": {"temperature": 0.1, "num_ctx": 16000, "top_p": 0.95}},
-        "analyzer": {"name": "qwen3-coder:latest", "options": {"temperature": 0.0, "num_ctx": 16000}},
         "planner": {"name": "qwen3-coder:latest", "options": {"temperature": 0.2, "num_ctx": 16000, "top_p": 0.8}}
     }
 }
 MAX_DEBUG_ATTEMPTS = 1  # Simplified to 1 attempt
 MAX_TEST_REGEN_ATTEMPTS = 1
 
-def call_ollama_api(messages, model_key):
-    """Send request to Ollama API"""
+# Shared HTTP session: keep-alive connections are reused across all Ollama calls
+_SESSION = requests.Session()
+# Refused connections and 502/503/504 (e.g. while a model loads) are retried with
+# exponential backoff; a request that timed out mid-generation is re-sent only once
+_RETRY = Retry(total=3, read=1, backoff_factor=0.5, status_forcelist=(502, 503, 504),
+               allowed_methods=frozenset({"GET", "POST"}), raise_on_status=False)
+try:
+    _RETRY = _RETRY.new(backoff_jitter=0.5)  # urllib3 >= 2
+except TypeError:
+    pass
+_SESSION.mount("http://", HTTPAdapter(pool_connections=10, pool_maxsize=10, max_retries=_RETRY))
+_SESSION.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=10, max_retries=_RETRY))
+_SESSION.headers.update({"Connection": "keep-alive", "Accept-Encoding": "gzip, deflate"})
+OLLAMA_TIMEOUT = (10, 300)  # (connect, read) seconds
+OLLAMA_KEEP_ALIVE = "30m"  # keep models loaded for the whole session
+
+class LLMCache:
+    """Small LRU cache of LLM replies, keyed by a SHA-256 of the request payload."""
+
+    def __init__(self, maxsize: int = 512):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def cache_key(model: str, messages: list, options: dict) -> str:
+        payload = {"model": model, "messages": messages, "options": options}
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def is_cacheable(options: dict) -> bool:
+        """Only (near-)deterministic sampling gives a reply worth reusing."""
+        return options.get("temperature", 1) <= 0.1
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+_LLM_CACHE = LLMCache()
+
+# Leading ```lang / trailing ``` fence lines of a markdown code block
+FENCE_RE = re.compile(r"^\s*```(?:python|[a-zA-Z]*)?\s*\n?|\n?```\s*$", re.MULTILINE)
+
+def clean_code(raw):
+    """Strip markdown code fences from an LLM reply"""
+    text = raw.strip()
+    if text.startswith("```") and text.endswith("```") and text.count("```") == 2:
+        # Quick path: a single fenced block, drop the opening line and closing fence
+        body = text.removesuffix("```")
+        opening, newline, code = body.partition("\n")
+        return (code if newline else opening[3:]).strip()
+    return FENCE_RE.sub("", raw).strip()
+
+NUM_CTX_BUCKETS = (2048, 4096, 8192, 16384)  # few sizes, so Ollama rarely has to reload the model
+NUM_CTX_REPLY_RESERVE = 2048  # tokens left free for the model's answer
+
+def pick_num_ctx(messages, max_ctx):
+    """Pick the smallest context bucket that fits the prompt plus the reply"""
+    needed = sum(len(m["content"]) for m in messages) // 3 + NUM_CTX_REPLY_RESERVE
+    bucket = next((b for b in NUM_CTX_BUCKETS if b >= needed), NUM_CTX_BUCKETS[-1])
+    return min(bucket, max_ctx)
+
+def read_ollama_stream(response):
+    """Assemble the reply from Ollama's streamed JSON lines as they arrive"""
+    content = bytearray()
+    for line in response.iter_lines():
+        if not line:
+            continue
+        chunk = json.loads(line)
+        if "error" in chunk:
+            raise requests.exceptions.RequestException(chunk["error"])
+        content += chunk.get("message", {}).get("content", "").encode("utf-8")
+        if chunk.get("done"):
+            break
+    return content.decode("utf-8").strip()
+
+def call_ollama_api(messages, model_key, response_format=None):
+    """Send request to Ollama API (response_format="json" forces a JSON reply)"""
     model_config = CODING_AGENT_CONFIG["MODELS"][model_key]
+    key = None
+    if LLMCache.is_cacheable(model_config["options"]):
+        key_options = dict(model_config["options"], format=response_format) if response_format else model_config["options"]
+        key = LLMCache.cache_key(model_config["name"], messages, key_options)
+        cached = _LLM_CACHE.get(key)
+        if cached is not None:
+            return cached
     try:
+        options = dict(model_config["options"])
+        options["num_ctx"] = pick_num_ctx(messages, options.get("num_ctx", NUM_CTX_BUCKETS[-1]))
         payload = {
             "model": model_config["name"],
             "messages": messages,
-            "options": model_config["options"],
-            "stream": False
+            "options": options,
+            "stream": True,
+            "keep_alive": OLLAMA_KEEP_ALIVE
         }
-        response = requests.post(CODING_AGENT_CONFIG["OLLAMA_API_URL"], json=payload, timeout=120)
-        response.raise_for_status()
-        return response.json().get("message", {}).get("content", "").strip()
+        if response_format:
+            payload["format"] = response_format
+        with _SESSION.post(CODING_AGENT_CONFIG["OLLAMA_API_URL"], json=payload, timeout=OLLAMA_TIMEOUT, stream=True) as response:
+            response.raise_for_status()
+            content = read_ollama_stream(response)
     except Exception as e:
         return f"Error: API call failed - {str(e)}"
+    if key is not None:
+        _LLM_CACHE.set(key, content)
+    return content
+
+# System prompts: built once so every call sends byte-identical leading messages
+SYSTEM_PLANNER_TMPL = """
+You are a QA engineer. Create a numbered test plan for {language} code based on the user's request.
+Format as a clean numbered list (no explanations or markdown).
+"""
+SYSTEM_CODER_TMPL = "You are an expert {language} programmer. Respond ONLY with the code in a single markdown code block."
+SYSTEM_TESTER_MSG = {"role": "system", "content": """
+You are a Python test developer. Create pytest tests for the file, code and test plan given by the user.
+Return ONLY the test code (no explanations or markdown).
+"""}
+SYSTEM_FIXER_MSG = {"role": "system", "content": """
+The user's code failed its tests. Decide whether the failure is due to a 'code_bug' or a 'test_bug'; for a code bug, fix the code.
+Respond with a JSON object: {"verdict": "code_bug" or "test_bug", "fixed_code": "<the full corrected code, empty for test_bug>"}
+"""}
+_system_msgs = {}  # (template, language) -> system message
+
+def system_msg(template, language):
+    """System message for a language-specific template, formatted once per session"""
+    key = (template, language)
+    if key not in _system_msgs:
+        _system_msgs[key] = {"role": "system", "content": template.format(language=language)}
+    return _system_msgs[key]
 
 def generate_test_plan(language, prompt):
     """Generate test plan using LLM"""
     print("  -> Generating test plan...")
-    prompt_text = f"""
-You are a QA engineer. Create a numbered test plan for {language} code based on this request:
-{prompt}
-
-Format as a clean numbered list (no explanations or markdown).
-"""
-    return call_ollama_api([{"role": "user", "content": prompt_text}], "planner")
+    # Static instructions in the system message, request last: keeps the prompt prefix reusable
+    messages = [system_msg(SYSTEM_PLANNER_TMPL, language), {"role": "user", "content": prompt}]
+    return call_ollama_api(messages, "planner")
 
 def generate_code(language, prompt, mode="generate"):
     """Generate code using LLM"""
     print(f"  -> Generating {language} code...")
-    system_prompt = f"You are an expert {language} programmer. Respond ONLY with the code in a single markdown code block."
-    user_prompt = prompt
-    messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}]
+    messages = [system_msg(SYSTEM_CODER_TMPL, language), {"role": "user", "content": prompt}]
     raw_code = call_ollama_api(messages, "coder")
-    return re.sub(r'```python|```', '', raw_code).strip()
+    return clean_code(raw_code)
 
 def generate_unit_tests(file_name, code_content, test_plan):
     """Generate unit tests using LLM"""
     print("  -> Generating unit tests...")
-    prompt_text = f"""
-You are a Python test developer. Create pytest tests for:
+    user_prompt = f"""
 File: {file_name}
-Code:
-{code_content}
 Test Plan:
 {test_plan}
-
-Return ONLY the test code (no explanations or markdown).
-"""
-    return call_ollama_api([{"role": "user", "content": prompt_text}], "tester")
-
-def debug_code(code_content, test_output, test_file):
-    """Debug code using LLM"""
-    print("  -> Debugging code...")
-    prompt_text = f"""
-Code failed tests. Analyze and fix:
 Code:
 {code_content}
-Test Output:
-{test_output}
 """
-    return call_ollama_api([{"role": "user", "content": prompt_text}], "debugger").strip()
+    messages = [SYSTEM_TESTER_MSG, {"role": "user", "content": user_prompt}]
+    return call_ollama_api(messages, "tester")
 
-def analyze_test_failure(code_content, test_output):
-    """Analyze test failure cause"""
-    print("  -> Analyzing test failure...")
-    prompt_text = f"""
+def analyze_and_fix(code_content, test_output):
+    """Analyze test failure cause and fix the code in one LLM call: (verdict, fixed_code)"""
+    print("  -> Analyzing test failure and debugging code...")
+    user_prompt = f"""
 Code:
 {code_content}
 Test Output:
 {test_output}
-Is failure due to 'code_bug' or 'test_bug'? Return ONLY one word.
 """
-    result = call_ollama_api([{"role": "user", "content": prompt_text}], "analyzer").strip().lower()
-    return "code_bug" if "code" in result else "test_bug"
+    messages = [SYSTEM_FIXER_MSG, {"role": "user", "content": user_prompt}]
+    try:
+        result = json.loads(call_ollama_api(messages, "debugger", response_format="json"))
+    except json.JSONDecodeError:
+        return "test_bug", None
+    if not isinstance(result, dict):
+        return "test_bug", None
+    verdict = "code_bug" if "code" in str(result.get("verdict", "")).lower() else "test_bug"
+    fixed_code = result.get("fixed_code")
+    if not isinstance(fixed_code, str) or not fixed_code.strip():
+        return verdict, None
+    return verdict, clean_code(fixed_code)
+
+def _run_pytest_in_process(args, cwd):
+    """Run pytest inside this interpreter (no process spawn, plugins imported once)."""
+    out, err = io.StringIO(), io.StringIO()
+    prev_cwd, saved_path = os.getcwd(), list(sys.path)
+    os.chdir(cwd)
+    try:
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            returncode = int(pytest.main([*args, "-p", "no:cacheprovider", "-p", "no:randomly"]))
+    finally:
+        os.chdir(prev_cwd)
+        sys.path[:] = saved_path
+        # Forget the modules under test so the next attempt imports the rewritten files
+        project_dir = os.path.abspath(cwd)
+        for name, module in list(sys.modules.items()):
+            module_file = getattr(module, "__file__", None)
+            if name != "__main__" and module_file and os.path.dirname(os.path.abspath(module_file)) == project_dir:
+                del sys.modules[name]
+        importlib.invalidate_caches()
+    return out.getvalue(), err.getvalue(), returncode
+
+def warm_up_models(session):
+    """Preload every configured model so the first real call skips the load"""
+    url = CODING_AGENT_CONFIG["OLLAMA_API_URL"].replace("/api/chat", "/api/generate")
+    for name in {cfg["name"] for cfg in CODING_AGENT_CONFIG["MODELS"].values()}:
+        try:
+            session.post(url, json={"model": name, "prompt": "", "keep_alive": OLLAMA_KEEP_ALIVE},
+                         timeout=OLLAMA_TIMEOUT).raise_for_status()
+        except requests.exceptions.RequestException as e:
+            print(f"Warm-up of '{name}' failed: {e}")
+
+def run_tests(test_path, temp_dir):
+    """Run pytest once and return (stdout, stderr, returncode)"""
+    if pytest is not None:
+        return _run_pytest_in_process(["-q", "--tb=no", test_path], temp_dir)
+    res = subprocess.run(
+        ["pytest", "-q", "--tb=no", test_path],
+        cwd=temp_dir,
+        capture_output=True,
+        text=True,
+        timeout=30
+    )
+    return res.stdout, res.stderr, res.returncode
+
+def persist_file(src, dst):
+    """Move src to dst (a rename on the same filesystem); copy only across devices"""
+    try:
+        os.replace(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.copyfile(src, dst)
 
 def execute_coding_agent(language, code_file, prompt):
     """Main execution flow"""
@@ -139,24 +323,12 @@ def execute_coding_agent(language, code_file, prompt):
         
         # Run tests
         print(f"  -> Running tests in {temp_dir}...")
-        stdout, stderr, returncode = subprocess.run(
-            ["pytest", "-q", "--tb=no", test_path],
-            cwd=temp_dir,
-            capture_output=True,
-            text=True,
-            timeout=30
-        ).stdout, subprocess.run(
-            ["pytest", "-q", "--tb=no", test_path],
-            cwd=temp_dir,
-            capture_output=True,
-            text=True,
-            timeout=30
-        ).stderr, 0
+        stdout, stderr, returncode = run_tests(test_path, temp_dir)
         
         if returncode == 0:
             print("  -> Tests passed! Final code saved.")
             final_path = os.path.join(CODING_AGENT_CONFIG["OUTPUT_DIR"], code_file)
-            shutil.copy(code_path, final_path)
+            persist_file(code_path, final_path)
             return (f"✅ Tests passed!\n\n"
                     f"Code saved to: {final_path}\n\n"
                     f"**Code:**\n```{language}\n{code}\n```")
@@ -164,31 +336,20 @@ def execute_coding_agent(language, code_file, prompt):
         # Debugging loop
         for _ in range(MAX_DEBUG_ATTEMPTS):
             print("  -> Tests failed. Attempting to debug...")
-            if analyze_test_failure(code, stdout + stderr) == "code_bug":
-                code = debug_code(code, stdout + stderr, test_path)
+            verdict, fixed_code = analyze_and_fix(code, stdout + stderr)
+            if verdict == "code_bug" and fixed_code:
+                code = fixed_code
                 # Write fixed code
                 with open(code_path, "w") as f:
                     f.write(code)
                 # Re-run tests
-                stdout, stderr, returncode = subprocess.run(
-                    ["pytest", "-q", "--tb=no", test_path],
-                    cwd=temp_dir,
-                    capture_output=True,
-                    text=True,
-                    timeout=30
-                ).stdout, subprocess.run(
-                    ["pytest", "-q", "--tb=no", test_path],
-                    cwd=temp_dir,
-                    capture_output=True,
-                    text=True,
-                    timeout=30
-                ).stderr, 0
+                stdout, stderr, returncode = run_tests(test_path, temp_dir)
                 if returncode == 0:
                     break
         
         # Save final result
         final_path = os.path.join(CODING_AGENT_CONFIG["OUTPUT_DIR"], code_file)
-        shutil.copy(code_path, final_path)
+        persist_file(code_path, final_path)
         
         if returncode == 0:
             return (f"✅ Tests passed after debugging!\n\n"
@@ -203,20 +364,19 @@ def get_multiline_input(prompt):
     """Get multi-line user input"""
     print(f"\n{prompt}")
     print("Enter text (press Ctrl-D on Linux/macOS or Ctrl-Z+Enter on Windows to finish):")
-    lines = []
-    while True:
-        try:
-            line = input()
-            lines.append(line)
-        except EOFError:
-            break
-    return "\n".join(lines).strip()
+    if sys.stdin.isatty():
+        # Earlier input() answers went through readline, so nothing is left in
+        # sys.stdin's text buffer: read the raw bytes in one go and decode once
+        return sys.stdin.buffer.read().decode("utf-8", "replace").strip()
+    return sys.stdin.read().strip()
 
 def main():
     """Interactive CLI interface"""
     print("="*50)
     print("Simplified Coding Agent (Single File Version)")
     print("="*50)
+    # Load the models in the background while the user is typing
+    threading.Thread(target=warm_up_models, args=(_SESSION,), daemon=True).start()
     
     language = input("\n▶ Language (python, javascript, etc.): ")
     code_file = input("▶ Filename (e.g., my_module.py): ")
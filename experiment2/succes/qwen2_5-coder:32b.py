@@ -13,27 +13,169 @@ This module defines a simplified version of the coding agent. It generates,
 tests, and debugs code without using a database.
 """
 import subprocess
+import compileall
+import difflib
+import hashlib
+import io
+import functools
+import gzip
+import json
+import logging
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 import re
 import os
 import shutil
 import sys
-from typing import Optional
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+try:
+    import orjson # Optional: much faster encoding/decoding of large request and reply bodies
+    json_dumps = orjson.dumps
+    json_loads = orjson.loads
+    def _json_dumps_sorted(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+except ImportError:
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+    json_loads = json.loads
+    def _json_dumps_sorted(obj) -> bytes:
+        return json.dumps(obj, sort_keys=True).encode("utf-8")
+
+logger = logging.getLogger('coding_agent')
 
 # --- Configuration for this specific tool ---
 CODING_AGENT_CONFIG = {
     "OLLAMA_API_URL": "http://192.168.1.127:11434/api/chat",
     "OUTPUT_DIR": "generated_code",
+    # Gzip large request bodies. Ollama itself does not decode Content-Encoding: gzip, so only
+    # enable this behind a proxy that does (e.g. nginx with gunzip on the request body).
+    "GZIP_REQUESTS": False,
     "MODELS": {
         "coder": {"name": "qwen3-coder:latest", "options": {"temperature": 0.6, "num_ctx": 16000, "top_p": 0.95}},
         "tester": {"name": "qwen3-coder:latest", "options": {"temperature": 0.1, "num_ctx": 16000, "top_p": 0.8}},
         "debugger": {"name": "qwen3-coder:latest", "options": {"temperature": 0.1, "num_ctx": 16000, "top_p": 0.95}},
         "analyzer": {"name": "qwen3-coder:latest", "options": {"temperature": 0.0, "num_ctx": 16000}},
-        "planner": {"name": "qwen3-coder:latest", "options": {"temperature": 0.2, "num_ctx": 16000, "top_p": 0.8}}
+        "planner": {"name": "qwen3-coder:latest", "options": {"temperature": 0.2, "num_ctx": 16000, "top_p": 0.8}},
+        "bootstrap": {"name": "qwen3-coder:latest", "options": {"temperature": 0.2, "num_ctx": 16000, "top_p": 0.9}}
     }
 }
 MAX_DEBUG_ATTEMPTS = 3
 MAX_TEST_REGEN_ATTEMPTS = 2
+OLLAMA_KEEP_ALIVE = "30m" # Keep the model (and its prompt cache) loaded between calls
+RESPONSE_CACHE_SIZE = 256 # Replies kept for (near-)deterministic calls, see _call_ollama_api
+GZIP_MIN_BYTES = 4096 # Smaller request bodies are not worth compressing
+ANALYZER_NUM_PREDICT = 16 # Enough tokens for {"verdict": "cannot_determine"}
+ANALYZER_VERDICTS = ('code_bug', 'test_bug', 'cannot_determine')
+MIN_NUM_CTX = 1024 # Smallest context window requested from Ollama
+# Tokens kept free for the reply; the analyzer answers with one keyword, bootstrap writes plan, code and tests
+NUM_CTX_REPLY_RESERVE = {"analyzer": 64, "bootstrap": 4096}
+DEFAULT_REPLY_RESERVE = 1024
+
+def _cache_key(model: str, messages: list, options: dict) -> str:
+    """Hashes everything that determines a reply."""
+    payload = _json_dumps_sorted({'m': model, 'ms': messages, 'o': options})
+    return hashlib.sha256(payload).hexdigest()
+
+def _estimate_tokens(s: str) -> int:
+    """Rough token count (~4 chars per token)."""
+    return len(s) // 4 + 32
+
+def _pick_num_ctx(messages: list, model_key: str, max_ctx: int) -> int:
+    """
+    Next power of two that fits the prompt plus the reply, clamped to [MIN_NUM_CTX, max_ctx].
+    Power-of-two sizes keep the number of distinct values (and Ollama model reloads) small.
+    """
+    needed = sum(_estimate_tokens(m["content"]) for m in messages)
+    needed += NUM_CTX_REPLY_RESERVE.get(model_key, DEFAULT_REPLY_RESERVE)
+    return max(MIN_NUM_CTX, min(1 << (needed - 1).bit_length(), max_ctx))
+
+_FENCE_RE = re.compile(r'```(?:python)?\s*|```')
+
+def _strip_fences(raw: str) -> str:
+    """Removes the markdown code fences around a model reply."""
+    s = raw.strip()
+    body = s
+    if body.startswith('```python'):
+        body = body[9:]
+    elif body.startswith('```'):
+        body = body[3:]
+    if body.endswith('```'):
+        body = body[:-3]
+    # Regex only for the rare reply with fences somewhere in the middle
+    if '```' in body:
+        return _FENCE_RE.sub('', s).strip()
+    return body.strip()
+
+# --- Role system prompts ---
+# Static instructions go first, in the system message, and only the per-call data (code, test output)
+# follows in the user message, so Ollama can reuse the KV cache of the identical prefix.
+_PLANNER_SYSTEM = """You are an expert Quality Assurance (QA) engineer. Your task is to create a detailed, step-by-step test plan for a piece of code that will be written in {language}.
+Analyze the user's code request and break it down into a numbered list of specific test cases.
+
+== Instructions ==
+1. Identify the core functionalities described in the request.
+2. For each functionality, define at least one "happy path" test case (i.e., it works with normal, expected inputs).
+3. Identify and create test cases for edge conditions (e.g., empty inputs, zero, large numbers, empty strings).
+4. Identify and create test cases for error conditions (e.g., invalid input types, division by zero).
+5. Format your output as a clean, numbered list. Do not include any explanations, conversational text, or markdown.
+
+Example Output:
+1. Test the add function with two positive integers.
+2. Test the add function with a positive and a negative integer.
+3. Test the divide function with a non-zero denominator.
+4. Test that the divide function raises a ValueError when the denominator is zero."""
+
+_CODER_SYSTEM = """You are an expert {language} programmer. Your task is to write a single, clean, well-commented, and efficient code snippet that fulfills the user's request.
+Respond with ONLY the code snippet, enclosed in a single markdown code block. Do not include any explanations or conversational text outside the code block."""
+
+_TESTER_SYSTEM = """You are an expert Python unit test developer. Your task is to write pytest unit tests for the Python code provided by the user, strictly following the test plan.
+
+== Instructions ==
+1. Write valid `pytest` test functions. The test file is named `test_<original file name>`.
+2. Import the necessary classes/functions from the original file.
+3. Implement test cases that cover all aspects mentioned in the `Test Plan`.
+4. For negative test cases (e.g., expected errors), use `pytest.raises`.
+5. Use assertions (`assert`) to verify expected behavior.
+6. Return ONLY the Python code for the unit tests. Do NOT include any explanations or markdown fences."""
+
+_DEBUGGER_SYSTEM = """You are a senior software engineer. The code snippet provided by the user failed to pass its unit tests.
+Your task is to analyze the code and the test failure output, identify the bug, and provide a corrected version of the code.
+
+== Instructions ==
+1. Carefully examine the code and the test output to find the root cause of the error.
+2. Provide a corrected version of the ENTIRE code snippet.
+3. Return ONLY the corrected Python code, enclosed in a single markdown code block."""
+
+_ANALYZER_SYSTEM = """You are a quality assurance expert. Analyze the Python code and the output from a failed test run provided by the user.
+Your task is to determine the most likely cause of the failure.
+
+Based on your analysis, state whether the failure is a result of a bug in the code or a flaw in the unit test itself.
+Respond with ONLY a JSON object of the form {"verdict": "<keyword>"} where <keyword> is one of: 'code_bug', 'test_bug', or 'cannot_determine'."""
+
+_BOOTSTRAP_SYSTEM = """You are an expert {language} programmer and Quality Assurance (QA) engineer. For the user's code request you write, in one go, a test plan, the code, and pytest unit tests for that code.
+
+== Instructions ==
+1. test_plan: a clean, numbered list of specific test cases covering the "happy path", edge conditions (e.g., empty inputs, zero, large numbers) and error conditions (e.g., invalid input types, division by zero).
+2. code: a single, clean, well-commented, and efficient code snippet that fulfills the request.
+3. tests: valid `pytest` test functions for a file named `test_<original file name>` that import from the original file, implement every case of the test plan, use `pytest.raises` for expected errors and `assert` for expected behavior.
+4. Respond with ONLY a JSON object of this exact shape, with no markdown fences inside the strings:
+{{"test_plan": "<numbered list>", "code": "<source code>", "tests": "<pytest source code>"}}"""
+
+# The static prompts are interned and the per-language ones built once, so every request reuses
+# the same string objects and only the small dynamic user tail is assembled per call.
+_TESTER_SYSTEM = sys.intern(_TESTER_SYSTEM)
+_DEBUGGER_SYSTEM = sys.intern(_DEBUGGER_SYSTEM)
+_ANALYZER_SYSTEM = sys.intern(_ANALYZER_SYSTEM)
+
+@functools.lru_cache(maxsize=None)
+def _system_prompt(template: str, language: str) -> str:
+    """Fills in a per-language system prompt once per (template, language)."""
+    return sys.intern(template.format(language=language))
 
 class ProjectManager:
     """
@@ -41,23 +183,32 @@ class ProjectManager:
     Ensures a clean, isolated environment for each task.
     """
 
-    def __init__(self, base_dir: str = "temp_project"):
+    def __init__(self, base_dir: Optional[str] = None):
+        # Without a base_dir a private directory is made on tmpfs (/dev/shm) where available
         self.base_dir = base_dir
+        self.owns_dir = base_dir is None
         self.current_dir = None
 
     def create_project(self):
         """
         Creates a new, unique temporary directory for the project.
-        Deletes any existing directory with the same name first.
+        A caller-supplied directory is emptied first; our own mkdtemp directory is
+        unique already and is simply reused, since every attempt overwrites the same files.
         """
-        print(f"ProjectManager: Creating new project directory at '{self.base_dir}'...")
-        if os.path.exists(self.base_dir):
-            shutil.rmtree(self.base_dir)
-            print(f"ProjectManager: Removed old directory.")
-        
-        os.makedirs(self.base_dir)
+        if self.owns_dir:
+            if self.base_dir is None:
+                tmp_root = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+                self.base_dir = tempfile.mkdtemp(prefix='coding_agent_', dir=tmp_root)
+            logger.debug("ProjectManager: Using project directory '%s'...", self.base_dir)
+            os.makedirs(self.base_dir, exist_ok=True)
+        else:
+            logger.debug("ProjectManager: Creating new project directory at '%s'...", self.base_dir)
+            if os.path.exists(self.base_dir):
+                shutil.rmtree(self.base_dir)
+                logger.debug("ProjectManager: Removed old directory.")
+            os.makedirs(self.base_dir)
         self.current_dir = self.base_dir
-        print(f"ProjectManager: Directory created.")
+        logger.debug("ProjectManager: Directory created.")
 
     def write_file(self, file_name: str, content: str):
         """
@@ -67,10 +218,30 @@ class ProjectManager:
             raise RuntimeError("No project directory exists. Call create_project() first.")
         
         file_path = os.path.join(self.current_dir, file_name)
-        print(f"ProjectManager: Writing file '{file_name}'...")
-        with open(file_path, "w") as f:
+        logger.debug("ProjectManager: Writing file '%s'...", file_name)
+        with open(file_path, "w", encoding="utf-8", buffering=131072) as f:
             f.write(content)
 
+    def precompile(self, file_name: str):
+        """
+        Byte-compiles a project module into __pycache__ so the next pytest run imports it
+        without compiling it first.
+        """
+        if not self.current_dir:
+            raise RuntimeError("No project directory exists. Call create_project() first.")
+        compileall.compile_file(os.path.join(self.current_dir, file_name), force=True, quiet=1)
+
+    def write_file_atomic(self, dst: str, content: str):
+        """
+        Writes content to an arbitrary path via a temp file and os.replace, so readers
+        never see a half-written file.
+        """
+        tmp_path = dst + ".tmp"
+        logger.debug("ProjectManager: Writing file '%s'...", dst)
+        with open(tmp_path, "w", encoding="utf-8", buffering=131072) as f:
+            f.write(content)
+        os.replace(tmp_path, dst)
+
     def read_file(self, file_name: str) -> str:
         """
         Reads and returns the content of a file from the project directory.
@@ -94,35 +265,61 @@ class ProjectManager:
             timeout (int): The maximum time to wait for the command to finish.
 
         Returns:
-            A tuple containing (stdout, stderr, returncode).
+            A tuple containing (stdout, stderr, returncode). stderr is merged
+            into stdout and only carries this method's own error messages.
         """
         if not self.current_dir:
             raise RuntimeError("No project directory exists. Call create_project() first.")
 
-        print(f"ProjectManager: Executing command: {' '.join(command)}")
+        logger.debug("ProjectManager: Executing command: %s", command)
         try:
-            result = subprocess.run(
+            proc = subprocess.Popen(
                 command,
                 cwd=self.current_dir,
-                capture_output=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
                 text=True,
-                timeout=timeout
+                bufsize=1
             )
-            return result.stdout, result.stderr, result.returncode
-        except subprocess.TimeoutExpired:
-            return "", "Error: Command timed out.", 1
         except Exception as e:
             return "", f"Error: Failed to execute command. Details: {e}", 1
 
+        # Stream the output and stop the run at the first reported failure;
+        # the analyzer only ever looks at one failure at a time.
+        timed_out = threading.Event()
+
+        def _on_timeout():
+            timed_out.set()
+            proc.kill()
+
+        timer = threading.Timer(timeout, _on_timeout)
+        timer.start()
+        buffer = io.StringIO()
+        try:
+            for line in proc.stdout:
+                buffer.write(line)
+                if line.startswith(('FAILED', 'ERROR')):
+                    proc.kill()
+                    break
+            proc.stdout.close()
+            returncode = proc.wait()
+        finally:
+            timer.cancel()
+        if timed_out.is_set():
+            return buffer.getvalue(), "Error: Command timed out.", 1
+        return buffer.getvalue(), '', returncode
+
     def cleanup(self):
         """
         Removes the entire project directory.
         """
         if self.base_dir and os.path.exists(self.base_dir):
-            print(f"ProjectManager: Cleaning up project directory '{self.base_dir}'...")
+            logger.debug("ProjectManager: Cleaning up project directory '%s'...", self.base_dir)
             shutil.rmtree(self.base_dir)
             self.current_dir = None
-            print("ProjectManager: Cleanup complete.")
+            if self.owns_dir:
+                self.base_dir = None # The next project gets a fresh mkdtemp name
+            logger.debug("ProjectManager: Cleanup complete.")
 
 class CodingAgentV2:
     """
@@ -130,62 +327,155 @@ class CodingAgentV2:
     """
 
     def __init__(self):
-        self.project_manager = ProjectManager(base_dir="temp_coding_project")
+        self.project_manager = ProjectManager()
         os.makedirs(CODING_AGENT_CONFIG["OUTPUT_DIR"], exist_ok=True)
-
-    def _call_ollama_api(self, messages: list, model_key: str) -> str:
-        """Internal helper to send requests to the Ollama API."""
+        # One keep-alive connection pool for every role call (no TCP handshake per request)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=10, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Connection': 'keep-alive', 'Accept-Encoding': 'gzip, deflate', 'User-Agent': 'coding-agent-v2'})
+        # Independent role calls run concurrently (Ollama serves them in parallel with OLLAMA_NUM_PARALLEL > 1)
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        # LRU cache of low-temperature replies; guarded because role calls run on several threads
+        self._resp_cache: "OrderedDict[str, str]" = OrderedDict()
+        self._resp_cache_lock = threading.Lock()
+        # Last debugger exchange (messages incl. its reply, cleaned code) that later fixes build on
+        self._debug_state: Optional[tuple[list, str]] = None
+        # pytest results by (code hash, test hash); an unchanged pair always gives the same outcome
+        self._last_run: dict[tuple[str, str], tuple[str, str, int]] = {}
+
+    def close(self):
+        """Releases the pooled HTTP connections and drops any queued speculative calls."""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+    def _run_tests(self, test_file: str, code: str, tests: str) -> tuple[str, str, int]:
+        """Runs pytest on the written files, reusing the result of an identical earlier run."""
+        key = (hashlib.sha256(code.encode('utf-8')).hexdigest(),
+               hashlib.sha256(tests.encode('utf-8')).hexdigest())
+        if key in self._last_run:
+            logger.info("  -> [CodingAgentV2] Code and tests unchanged since a previous run, reusing its result.")
+            return self._last_run[key]
+        result = self.project_manager.run_command(['pytest', '-xq', '--tb=short', '-p', 'no:cacheprovider', test_file])
+        if not result[1]: # Timeouts and launch errors are reported in stderr and are not cached
+            self._last_run[key] = result
+        return result
+
+    def _call_ollama_api(self, messages: list, model_key: str, use_cache: bool = True, response_format: Optional[str] = None,
+                         options_override: Optional[dict] = None, stream: bool = False,
+                         early_stop: Optional[Callable[[str], bool]] = None) -> str:
+        """
+        Internal helper to send requests to the Ollama API (response_format="json" forces a JSON reply,
+        options_override is merged over the role's configured options for this call only).
+        With stream=True the reply is read chunk by chunk, and the connection is closed (ending
+        generation on the server) as soon as early_stop returns True for the text received so far.
+        Replies of (near-)deterministic calls (temperature <= 0.1) are served from an in-memory
+        cache when the exact same request was made before; use_cache=False forces a new reply.
+        """
         model_config = CODING_AGENT_CONFIG["MODELS"].get(model_key)
         if not model_config:
             raise ValueError(f"Model key '{model_key}' not found in config.")
 
+        options = {**model_config["options"], **(options_override or {})}
+        key = None
+        if options.get("temperature", 1.0) <= 0.1:
+            key = _cache_key(model_config["name"], messages, dict(options, format=response_format))
+            if use_cache:
+                with self._resp_cache_lock:
+                    if key in self._resp_cache:
+                        self._resp_cache.move_to_end(key)
+                        return self._resp_cache[key]
+
         try:
             payload = {
                 "model": model_config["name"],
                 "messages": messages,
-                "options": model_config["options"],
-                "stream": False
+                "options": {**options, "num_ctx": _pick_num_ctx(messages, model_key, options.get("num_ctx", 16000))},
+                "stream": stream,
+                "keep_alive": OLLAMA_KEEP_ALIVE
             }
-            response = requests.post(CODING_AGENT_CONFIG["OLLAMA_API_URL"], json=payload, timeout=None)
-            response.raise_for_status()
-            return response.json().get("message", {}).get("content", "").strip()
-        except requests.exceptions.RequestException as e:
-            print(f"Coding Agent API Error: {e}")
+            if response_format:
+                payload["format"] = response_format
+            body = json_dumps(payload)
+            headers = {'Content-Type': 'application/json'}
+            if CODING_AGENT_CONFIG["GZIP_REQUESTS"] and len(body) > GZIP_MIN_BYTES:
+                body = gzip.compress(body, compresslevel=1)
+                headers['Content-Encoding'] = 'gzip'
+            # Fail fast on connect; no read timeout for potentially long-running generation tasks
+            with self.session.post(CODING_AGENT_CONFIG["OLLAMA_API_URL"], data=body, headers=headers,
+                                   timeout=(10, None), stream=stream) as response:
+                response.raise_for_status()
+                if stream:
+                    content = self._read_stream(response, early_stop).strip()
+                else:
+                    content = json_loads(response.content).get("message", {}).get("content", "").strip()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.error("Coding Agent API Error: %s", e)
             return f"Error: Failed to connect to '{model_config['name']}' API. Details: {e}"
 
+        if key is not None:
+            with self._resp_cache_lock:
+                self._resp_cache[key] = content
+                self._resp_cache.move_to_end(key)
+                if len(self._resp_cache) > RESPONSE_CACHE_SIZE:
+                    self._resp_cache.popitem(last=False)
+        return content
+
+    @staticmethod
+    def _read_stream(response: requests.Response, early_stop: Optional[Callable[[str], bool]]) -> str:
+        """Collects the content of Ollama's NDJSON stream, stopping early once early_stop is satisfied."""
+        parts = []
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = json_loads(line)
+            if "error" in chunk:
+                raise requests.exceptions.RequestException(chunk["error"])
+            parts.append(chunk.get("message", {}).get("content", ""))
+            if chunk.get("done"):
+                break
+            if early_stop is not None and early_stop(''.join(parts)):
+                break # Leaving the with-block closes the connection, which cancels the generation
+        return ''.join(parts)
+
     def _generate_test_plan(self, language: str, code_prompt: str) -> str:
         """Uses an LLM to generate a test plan based on the code prompt."""
-        print("  -> [CodingAgentV2] Generating test plan from prompt...")
-        prompt = f"""
-        You are an expert Quality Assurance (QA) engineer. Your task is to create a detailed, step-by-step test plan for a piece of code that will be written in {language}.
-        Analyze the following user request and break it down into a numbered list of specific test cases.
-
-        == User Code Request ==
-        {code_prompt}
-
-        == Instructions ==
-        1. Identify the core functionalities described in the request.
-        2. For each functionality, define at least one "happy path" test case (i.e., it works with normal, expected inputs).
-        3. Identify and create test cases for edge conditions (e.g., empty inputs, zero, large numbers, empty strings).
-        4. Identify and create test cases for error conditions (e.g., invalid input types, division by zero).
-        5. Format your output as a clean, numbered list. Do not include any explanations, conversational text, or markdown.
-        
-        Example Output:
-        1. Test the add function with two positive integers.
-        2. Test the add function with a positive and a negative integer.
-        3. Test the divide function with a non-zero denominator.
-        4. Test that the divide function raises a ValueError when the denominator is zero.
-        """
-        messages = [{'role': 'user', 'content': prompt}]
+        logger.info("  -> [CodingAgentV2] Generating test plan from prompt...")
+        messages = [{'role': 'system', 'content': _system_prompt(_PLANNER_SYSTEM, language)},
+                    {'role': 'user', 'content': f"== User Code Request ==\n{code_prompt}"}]
         generated_plan = self._call_ollama_api(messages, "planner")
         return generated_plan
 
+    def _generate_plan_code_tests(self, language: str, code_file: str, code_prompt: str) -> Optional[dict]:
+        """
+        Produces the test plan, the code and its unit tests with a single JSON-mode LLM call,
+        paying one prompt prefill instead of three. Returns None if the reply is not usable,
+        in which case the caller falls back to the separate planner/coder/tester calls.
+        """
+        logger.info("  -> [CodingAgentV2] Generating test plan, code and tests in one request...")
+        messages = [{'role': 'system', 'content': _system_prompt(_BOOTSTRAP_SYSTEM, language)},
+                    {'role': 'user', 'content': f"== Original File Name ==\n{code_file}\n\n== User Code Request ==\n{code_prompt}"}]
+        raw = self._call_ollama_api(messages, "bootstrap", response_format="json")
+        try:
+            result = json_loads(raw)
+        except ValueError:
+            logger.info("  -> [CodingAgentV2] Combined reply was not valid JSON, falling back to separate calls.")
+            return None
+        if not isinstance(result, dict):
+            return None
+        plan = result.get("test_plan")
+        if isinstance(plan, list): # Some models return the numbered list as an array
+            plan = "\n".join(str(item) for item in plan)
+        code, tests = result.get("code"), result.get("tests")
+        if not all(isinstance(part, str) and part.strip() for part in (plan, code, tests)):
+            logger.info("  -> [CodingAgentV2] Combined reply is incomplete, falling back to separate calls.")
+            return None
+        return {"test_plan": plan.strip(), "code": _strip_fences(code), "tests": _strip_fences(tests)}
+
     def _generate_code(self, language: str, prompt: str, initial_code: Optional[str] = None, mode: str = 'generate') -> str:
         """Generates a code snippet based on a natural language prompt."""
-        print(f"  -> [CodingAgentV2] Generating {language} code in {mode} mode...")
-        system_prompt = f"""You are an expert {language} programmer. Your task is to write a single, clean, well-commented, and efficient code snippet that fulfills the user's request.
-        Respond with ONLY the code snippet, enclosed in a single markdown code block. Do not include any explanations or conversational text outside the code block."""
-        
+        logger.info("  -> [CodingAgentV2] Generating %s code in %s mode...", language, mode)
         user_message = prompt
         if initial_code:
             if mode == 'refactor':
@@ -193,145 +483,162 @@ class CodingAgentV2:
             elif mode == 'debug':
                 user_message = f"Please debug and fix this existing code based on the following prompt and a test plan that will be provided:\n\n== Existing Code ==\n```python\n{initial_code}\n```\n\n== Debugging Prompt ==\n{prompt}"
         
-        messages = [{'role': 'system', 'content': system_prompt}, {'role': 'user', 'content': user_message}]
+        messages = [{'role': 'system', 'content': _system_prompt(_CODER_SYSTEM, language)}, {'role': 'user', 'content': user_message}]
         raw_code = self._call_ollama_api(messages, "coder")
-        cleaned_code = re.sub(r'```python|```', '', raw_code).strip()
+        cleaned_code = _strip_fences(raw_code)
         return cleaned_code
 
-    def _generate_unit_tests(self, file_name: str, code_content: str, test_plan_description: str) -> str:
-        """Generates pytest unit tests based on the provided code content and test plan."""
-        print("  -> [CodingAgentV2] Generating unit tests...")
-        prompt = f"""
-        You are an expert Python unit test developer. Your task is to write pytest unit tests for the provided Python code, strictly following the test plan.
-
-        == Original Python File Name ==
-        {file_name}
-
-        == Generated Python Code ==
-        ```python
-        {code_content}
-        ```
-
-        == Test Plan ==
-        {test_plan_description}
-
-        == Instructions ==
-        1. Write valid `pytest` test functions. Name the test file `test_{file_name.replace('.py', '')}.py`.
-        2. Import the necessary classes/functions from the original file.
-        3. Implement test cases that cover all aspects mentioned in the `Test Plan`.
-        4. For negative test cases (e.g., expected errors), use `pytest.raises`.
-        5. Use assertions (`assert`) to verify expected behavior.
-        6. Return ONLY the Python code for the unit tests. Do NOT include any explanations or markdown fences.
+    def _generate_unit_tests(self, file_name: str, code_content: str, test_plan_description: str, use_cache: bool = True) -> str:
+        """
+        Generates pytest unit tests based on the provided code content and test plan.
+        Pass use_cache=False to get a fresh set when the previous tests were judged faulty.
         """
-        raw_test_code = self._call_ollama_api([{'role': 'user', 'content': prompt}], "tester")
-        cleaned_test_code = re.sub(r'```python|```', '', raw_test_code).strip()
+        logger.info("  -> [CodingAgentV2] Generating unit tests...")
+        # The test plan is the same on every attempt, so it comes before the code
+        prompt = ''.join(["== Test Plan ==\n", test_plan_description,
+                          "\n\n== Original Python File Name ==\n", file_name,
+                          "\n\n== Generated Python Code ==\n```python\n", code_content, "\n```"])
+        messages = [{'role': 'system', 'content': _TESTER_SYSTEM}, {'role': 'user', 'content': prompt}]
+        raw_test_code = self._call_ollama_api(messages, "tester", use_cache)
+        cleaned_test_code = _strip_fences(raw_test_code)
         return cleaned_test_code
 
-    def _debug_code(self, code_content: str, test_output: str, test_file: str) -> str:
-        """Uses an LLM to debug and fix code based on test output."""
-        print("  -> [CodingAgentV2] Debugging failed code...")
-        prompt = f"""
-        You are a senior software engineer. The following code snippet failed to pass its unit tests.
-        Your task is to analyze the code and the test failure output, identify the bug, and provide a corrected version of the code.
-
-        == Original Code ==
-        ```python
-        {code_content}
-        ```
-
-        == Test Failure Output (from {test_file}) ==
-        ```
-        {test_output}
-        ```
-
-        == Instructions ==
-        1. Carefully examine the code and the test output to find the root cause of the error.
-        2. Provide a corrected version of the ENTIRE code snippet.
-        3. Return ONLY the corrected Python code, enclosed in a single markdown code block.
+    def _debug_code(self, code_content: str, test_output: str, test_file: str) -> tuple[Optional[tuple[list, str]], str]:
+        """
+        Uses an LLM to debug and fix code based on test output.
+        After the first fix the previous exchange is resent unchanged (a prefix Ollama has cached)
+        and only the new failure is appended, plus a diff if the code changed since the model's last fix.
+        Returns (debug_state, fixed_code); the caller stores debug_state only if it applies the fix,
+        so a speculative call that is thrown away leaves no trace.
         """
-        messages = [{'role': 'user', 'content': prompt}]
+        logger.info("  -> [CodingAgentV2] Debugging failed code...")
+        failure = ''.join(["== Test Failure Output (from ", test_file, ") ==\n```\n", test_output, "\n```"])
+        state = self._debug_state
+        if state is None:
+            messages = [{'role': 'system', 'content': _DEBUGGER_SYSTEM},
+                        {'role': 'user', 'content': ''.join(["== Original Code ==\n```python\n", code_content, "\n```\n\n", failure])}]
+        else:
+            history, prev_code = state
+            if code_content == prev_code:
+                update = "Your corrected code still fails.\n\n"
+            else:
+                diff = '\n'.join(difflib.unified_diff(prev_code.splitlines(), code_content.splitlines(),
+                                                       'previous', 'current', n=3, lineterm=''))
+                if len(diff) > len(code_content) // 2: # A diff this large is no cheaper than the code itself
+                    update = ''.join(["The code has since changed to:\n```python\n", code_content, "\n```\n\n"])
+                else:
+                    update = ''.join(["The code has since changed relative to your last version:\n```diff\n", diff, "\n```\n\n"])
+            messages = history + [{'role': 'user', 'content': ''.join([update, failure])}]
         raw_fixed_code = self._call_ollama_api(messages, "debugger")
-        cleaned_fixed_code = re.sub(r'```python|```', '', raw_fixed_code).strip()
-        return cleaned_fixed_code
+        cleaned_fixed_code = _strip_fences(raw_fixed_code)
+        if raw_fixed_code.startswith("Error:"):
+            return None, cleaned_fixed_code
+        return (messages + [{'role': 'assistant', 'content': raw_fixed_code}], cleaned_fixed_code), cleaned_fixed_code
     
     def _analyze_test_failure(self, code_content: str, test_output: str) -> str:
         """Analyzes a test failure to determine if the bug is in the code or the test."""
-        print("  -> [CodingAgentV2] Analyzing test failure with analyzer model...")
-        prompt = f"""
-        You are a quality assurance expert. Analyze the provided Python code and the output from a failed test run.
-        Your task is to determine the most likely cause of the failure.
-
-        == Code ==
-        ```python
-        {code_content}
-        ```
-
-        == Test Failure Output ==
-        ```
-        {test_output}
-        ```
-
-        Based on your analysis, state whether the failure is a result of a bug in the code or a flaw in the unit test itself.
-        Respond with ONLY one of the following keywords: 'code_bug', 'test_bug', or 'cannot_determine'.
-        """
-        messages = [{'role': 'user', 'content': prompt}]
-        analysis_result = self._call_ollama_api(messages, "analyzer").strip().lower()
+        logger.info("  -> [CodingAgentV2] Analyzing test failure with analyzer model...")
+        prompt = ''.join(["== Code ==\n```python\n", code_content,
+                          "\n```\n\n== Test Failure Output ==\n```\n", test_output, "\n```"])
+        messages = [{'role': 'system', 'content': _ANALYZER_SYSTEM}, {'role': 'user', 'content': prompt}]
+        # JSON mode plus a tiny num_predict: the verdict is a handful of tokens, never a sentence.
+        # The reply is streamed and cut off as soon as a verdict keyword shows up.
+        raw = self._call_ollama_api(messages, "analyzer", response_format="json",
+                                    options_override={"num_predict": ANALYZER_NUM_PREDICT}, stream=True,
+                                    early_stop=lambda text: any(k in text.lower() for k in ANALYZER_VERDICTS))
+        lowered = raw.lower()
+        analysis_result = next((k for k in ANALYZER_VERDICTS if k in lowered), 'cannot_determine')
         if analysis_result not in ['code_bug', 'test_bug']:
             return 'cannot_determine'
         return analysis_result
 
-    def execute_coding_agent_v2(self, language: str, code_file: str, prompt: str, test_plan: str, mode: str = 'generate', initial_code: Optional[str] = None) -> str:
-        """Orchestrates the entire code generation, testing, and debugging process."""
+    def execute_coding_agent_v2(self, language: str, code_file: str, prompt: str, test_plan: str, mode: str = 'generate', initial_code: Optional[str] = None, prebuilt: Optional[dict] = None) -> str:
+        """
+        Orchestrates the entire code generation, testing, and debugging process.
+        prebuilt is the result of _generate_plan_code_tests; its code and tests are used
+        for the first attempt instead of new coder/tester calls.
+        """
         final_answer = "An error occurred during the coding process."
         test_passed = False
+        self._debug_state = None
         
         try:
             self.project_manager.create_project()
             
+            next_tests = None # Tests regenerated while the previous failure was being analyzed (or prebuilt)
             if initial_code and mode in ['refactor', 'debug']:
                 generated_code = self._generate_code(language, prompt, initial_code, mode)
+            elif prebuilt:
+                generated_code, next_tests = prebuilt["code"], prebuilt["tests"]
             else:
                 generated_code = self._generate_code(language, prompt)
             
             self.project_manager.write_file(code_file, generated_code)
+            self.project_manager.precompile(code_file)
             
             test_file = f"test_{code_file}"
             test_output = ""
             analysis_result = 'code_bug' # Default assumption
+            prev_output_hash = None # Digest of the previous failing output, to detect a stuck loop
             
             for attempt in range(MAX_DEBUG_ATTEMPTS + MAX_TEST_REGEN_ATTEMPTS):
-                print(f"  -> [CodingAgentV2] Starting test attempt {attempt + 1}...")
-                generated_tests = self._generate_unit_tests(code_file, generated_code, test_plan)
+                logger.info("  -> [CodingAgentV2] Starting test attempt %d...", attempt + 1)
+                if next_tests is not None:
+                    generated_tests, next_tests = next_tests, None
+                else:
+                    generated_tests = self._generate_unit_tests(code_file, generated_code, test_plan)
                 self.project_manager.write_file(test_file, generated_tests)
                 
-                stdout, stderr, returncode = self.project_manager.run_command(['pytest', '-q', '--tb=no', test_file])
+                stdout, stderr, returncode = self._run_tests(test_file, generated_code, generated_tests)
                 
                 if returncode == 0:
-                    print(f"  -> [CodingAgentV2] Tests passed successfully on attempt {attempt + 1}.")
+                    logger.info("  -> [CodingAgentV2] Tests passed successfully on attempt %d.", attempt + 1)
                     test_output = stdout
                     test_passed = True
                     break
                 else:
-                    print(f"  -> [CodingAgentV2] Tests failed on attempt {attempt + 1}. Analyzing failure...")
+                    logger.info("  -> [CodingAgentV2] Tests failed on attempt %d. Analyzing failure...", attempt + 1)
                     test_output = stdout + stderr
+                    output_hash = hashlib.blake2b(test_output.encode('utf-8'), digest_size=8).digest()
+                    if output_hash == prev_output_hash:
+                        logger.info("  -> [CodingAgentV2] Test output is identical to the previous attempt. Stopping.")
+                        break
+                    prev_output_hash = output_hash
                     
+                    # Speculatively regenerate the tests and fix the code while the analyzer runs;
+                    # the verdict decides which of the two results is kept
+                    regen_future = debug_future = None
+                    if attempt < MAX_TEST_REGEN_ATTEMPTS:
+                        regen_future = self.executor.submit(self._generate_unit_tests, code_file, generated_code, test_plan, False)
+                    if attempt < MAX_DEBUG_ATTEMPTS:
+                        debug_future = self.executor.submit(self._debug_code, generated_code, test_output, test_file)
                     analysis_result = self._analyze_test_failure(generated_code, test_output)
-                    print(f"  -> [CodingAgentV2] Analysis result: '{analysis_result}'")
+                    logger.info("  -> [CodingAgentV2] Analysis result: '%s'", analysis_result)
                     
-                    if analysis_result == 'code_bug' and attempt < MAX_DEBUG_ATTEMPTS:
-                        print("  -> [CodingAgentV2] Identified as a code bug. Attempting to debug...")
-                        generated_code = self._debug_code(generated_code, test_output, test_file)
+                    if analysis_result == 'test_bug' and regen_future is not None:
+                        logger.info("  -> [CodingAgentV2] Identified as a test bug. Using regenerated tests...")
+                        if debug_future is not None:
+                            debug_future.cancel()
+                        next_tests = regen_future.result()
+                        continue
+                    if regen_future is not None:
+                        regen_future.cancel()
+                    if analysis_result == 'code_bug' and debug_future is not None:
+                        logger.info("  -> [CodingAgentV2] Identified as a code bug. Attempting to debug...")
+                        debug_state, generated_code = debug_future.result()
+                        if debug_state is not None:
+                            self._debug_state = debug_state
                         self.project_manager.write_file(code_file, generated_code)
-                    elif analysis_result == 'test_bug' and attempt < MAX_TEST_REGEN_ATTEMPTS:
-                        print("  -> [CodingAgentV2] Identified as a test bug. Regenerating tests...")
-                        pass # Loop will regenerate tests
+                        self.project_manager.precompile(code_file)
                     else:
-                        print("  -> [CodingAgentV2] Cannot determine cause or max attempts reached. Stopping.")
+                        if debug_future is not None:
+                            debug_future.cancel()
+                        logger.info("  -> [CodingAgentV2] Cannot determine cause or max attempts reached. Stopping.")
                         break
 
             final_file_path = os.path.join(CODING_AGENT_CONFIG["OUTPUT_DIR"], code_file)
-            print(f"\n  -> [CodingAgentV2] Saving final code to '{final_file_path}'...")
-            shutil.copy(os.path.join(self.project_manager.current_dir, code_file), final_file_path)
+            logger.info("\n  -> [CodingAgentV2] Saving final code to '%s'...", final_file_path)
+            self.project_manager.write_file_atomic(final_file_path, generated_code)
 
             if test_passed:
                 final_answer = (f"I have successfully generated and tested the code. All tests passed.\n"
@@ -350,6 +657,7 @@ class CodingAgentV2:
             final_answer = f"An unexpected error occurred during coding agent execution: {e}"
         finally:
             self.project_manager.cleanup()
+            self.close()
         
         return final_answer
 
@@ -357,11 +665,17 @@ def _get_multiline_input(prompt_message: str) -> str:
     """Helper function to get multi-line input from the user."""
     print(f"\n{prompt_message}")
     print(" (Enter your text. Press Ctrl-D on Linux/macOS or Ctrl-Z+Enter on Windows when done)")
-    lines = sys.stdin.readlines()
-    return "".join(lines).strip()
+    if sys.stdin.isatty():
+        # Earlier input() answers went through readline, so nothing is left in
+        # sys.stdin's text buffer: read the raw bytes in one go and decode once
+        return sys.stdin.buffer.read().decode("utf-8", "replace").strip()
+    return sys.stdin.read().strip()
 
 def main():
     """The main function to run the agent in an interactive CLI mode."""
+    # Agent progress goes through the logger; CODING_AGENT_LOG=DEBUG also shows file and command details
+    log_level = getattr(logging, os.environ.get('CODING_AGENT_LOG', 'INFO').upper(), logging.INFO)
+    logging.basicConfig(level=log_level, format='%(message)s', stream=sys.stdout)
     print("--- Coding Agent V2: Interactive Mode ---")
     print("Please provide the following details for your coding task.")
     
@@ -373,16 +687,19 @@ def main():
         coding_agent = CodingAgentV2()
         
         test_plan = ""
+        prebuilt = None # Code and tests generated together with an accepted auto plan
         while not test_plan:
             plan_choice = input("\n▶ Test Plan: [M]anual entry or [A]uto-generate? (M/a): ").lower().strip() or 'm'
             if plan_choice == 'a':
-                generated_plan = coding_agent._generate_test_plan(language, prompt)
+                bundle = coding_agent._generate_plan_code_tests(language, code_file, prompt)
+                generated_plan = bundle["test_plan"] if bundle else coding_agent._generate_test_plan(language, prompt)
                 print("\n--- Proposed Test Plan ---")
                 print(generated_plan)
                 print("--------------------------")
                 confirm = input("▶ Use this plan? [Y/n] (or 'm' to enter manually): ").lower().strip() or 'y'
                 if confirm == 'y':
                     test_plan = generated_plan
+                    prebuilt = bundle
                 elif confirm == 'n':
                     print("  (Generation cancelled.)")
                     continue # Re-ask the M/A choice
@@ -409,7 +726,9 @@ def main():
                     print(f"Error reading initial code file: {e}")
                     return
 
-        final_result = coding_agent.execute_coding_agent_v2(language, code_file, prompt, test_plan, mode, initial_code)
+        if mode != 'generate':
+            prebuilt = None # Refactor/debug start from the user's code, not from a fresh snippet
+        final_result = coding_agent.execute_coding_agent_v2(language, code_file, prompt, test_plan, mode, initial_code, prebuilt)
         print(final_result)
 
     except KeyboardInterrupt:
@@ -6,14 +6,38 @@ Created on Sat Oct 25 23:50:12 2025
 @author: marek
 """
 
+import contextlib
+import errno
+import hashlib
+import importlib
+import importlib.util
+import io
+import multiprocessing
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import re
 import os
 import shutil
 import subprocess
 import sys
-from typing import Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Tuple
+
+try:
+    import orjson  # Optional: faster encoding of requests and parsing of streamed chunks
+    json_dumps = orjson.dumps
+    json_loads = orjson.loads
+except ImportError:
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+    json_loads = json.loads
+
+try:
+    import pytest  # Optional: lets ProjectManager run tests in a long-lived worker instead of a fresh interpreter
+except ImportError:
+    pytest = None
 
 # --- Configuration ---
 OLLAMA_API_URL = "http://192.168.1.127:11434/api/chat"
@@ -27,28 +51,131 @@ MODELS = {
 MAX_DEBUG_ATTEMPTS = 3
 MAX_TEST_REGEN_ATTEMPTS = 2
 OUTPUT_DIR = "generated_code"
+# pytest-xdist (optional) only pays off once worker start-up is small next to the test run itself
+HAVE_XDIST = importlib.util.find_spec("xdist") is not None
+XDIST_MIN_TESTS = 8
+
+# One keep-alive connection pool for every call in the generate/test/debug loop
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=Retry(total=2, backoff_factor=0.3)))
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=Retry(total=2, backoff_factor=0.3)))
+_SESSION.headers.update({"Connection": "keep-alive"})
+
+# Exact-match reply cache for deterministic calls, kept in memory and on disk across runs
+LLM_CACHE_DIR = os.path.expanduser("~/.cache/ollama_llm")
+CACHED_ROLES = {"analyzer", "planner"}  # cached even though the planner samples at 0.2
+_MEMORY_CACHE = {}
+
+def _cache_key(model_config: dict, messages: list) -> str:
+    """Hashes everything that determines a reply."""
+    payload = {"model": model_config["name"], "messages": messages, "options": model_config["options"]}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+def _cache_get(key: str) -> Optional[str]:
+    """Returns a cached reply from memory or disk, or None."""
+    if key in _MEMORY_CACHE:
+        return _MEMORY_CACHE[key]
+    try:
+        with open(os.path.join(LLM_CACHE_DIR, f"{key}.json"), "r", encoding="utf-8") as f:
+            content = json.load(f)["content"]
+    except (OSError, ValueError, KeyError):
+        return None
+    _MEMORY_CACHE[key] = content
+    return content
+
+def _cache_put(key: str, content: str):
+    """Stores a reply in memory and on disk (written to a temp file, then renamed into place)."""
+    _MEMORY_CACHE[key] = content
+    try:
+        os.makedirs(LLM_CACHE_DIR, exist_ok=True)
+        path = os.path.join(LLM_CACHE_DIR, f"{key}.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"content": content}, f)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        print(f"Could not write LLM cache entry: {e}")
 
 # --- Helper functions ---
-def call_ollama_api(messages: list, model_key: str) -> str:
-    """Internal helper to send requests to the Ollama API."""
+_FENCE_RE = re.compile(r'```(?:python)?\n?|```')
+
+def _strip_fences(raw: str) -> str:
+    """Removes markdown code fences from a model reply."""
+    text = raw.strip()
+    # Fast path: one fenced block that spans the whole reply, no regex needed
+    body = text.removeprefix('```python') if text.startswith('```python') else text.removeprefix('```')
+    body = body.removesuffix('```')
+    if '```' not in body:
+        return body.strip()
+    return _FENCE_RE.sub('', text).strip()
+
+def call_ollama_api(messages: list, model_key: str, stream: bool = True,
+                    on_chunk: Optional[Callable[[str], None]] = None) -> str:
+    """
+    Internal helper to send requests to the Ollama API.
+    With stream=True the reply is read chunk by chunk as the model generates it, and every
+    chunk is passed to on_chunk (if given) so the caller can show progress.
+    """
     model_config = MODELS.get(model_key)
     if not model_config:
         raise ValueError(f"Model key '{model_key}' not found in config.")
 
+    key = None
+    if model_config["options"].get("temperature", 1.0) <= 0.0 or model_key in CACHED_ROLES:
+        key = _cache_key(model_config, messages)
+        cached = _cache_get(key)
+        if cached is not None:
+            if on_chunk is not None:
+                on_chunk(cached)
+            return cached
+
     try:
         payload = {
             "model": model_config["name"],
             "messages": messages,
             "options": model_config["options"],
-            "stream": False
+            "stream": stream
         }
-        response = requests.post(OLLAMA_API_URL, json=payload, timeout=None)
-        response.raise_for_status()
-        return response.json().get("message", {}).get("content", "").strip()
-    except requests.exceptions.RequestException as e:
+        with _SESSION.post(OLLAMA_API_URL, data=json_dumps(payload), headers={"Content-Type": "application/json"},
+                           timeout=None, stream=stream) as response:
+            response.raise_for_status()
+            if not stream:
+                content = json_loads(response.content).get("message", {}).get("content", "").strip()
+                if key is not None:
+                    _cache_put(key, content)
+                return content
+            parts = []
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json_loads(line)
+                if "error" in chunk:
+                    raise requests.exceptions.RequestException(chunk["error"])
+                content = chunk.get("message", {}).get("content", "")
+                parts.append(content)
+                if on_chunk is not None and content:
+                    on_chunk(content)
+            content = "".join(parts).strip()
+            if key is not None:
+                _cache_put(key, content)
+            return content
+    except (requests.exceptions.RequestException, ValueError) as e:
         print(f"API Error: {e}")
         return f"Error: Failed to connect to '{model_config['name']}' API. Details: {e}"
 
+def _persist_file(src: str, dst: str):
+    """Moves src to dst: a rename on the same filesystem, a copy only across devices."""
+    try:
+        os.replace(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.copyfile(src, dst)
+
+def _print_chunk(text: str):
+    """Echoes streamed tokens to the console as they arrive."""
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
 def generate_test_plan(language: str, code_prompt: str) -> str:
     """Uses an LLM to generate a test plan based on the code prompt."""
     print("  -> Generating test plan from prompt...")
@@ -90,8 +217,9 @@ def generate_code(language: str, prompt: str, initial_code: Optional[str] = None
             user_message = f"Please debug and fix this existing code based on the following prompt and a test plan that will be provided:\n\n== Existing Code ==\n```python\n{initial_code}\n```\n\n== Debugging Prompt ==\n{prompt}"
     
     messages = [{'role': 'system', 'content': system_prompt}, {'role': 'user', 'content': user_message}]
-    raw_code = call_ollama_api(messages, "coder")
-    cleaned_code = re.sub(r'```python|```', '', raw_code).strip()
+    raw_code = call_ollama_api(messages, "coder", on_chunk=_print_chunk)
+    print()
+    cleaned_code = _strip_fences(raw_code)
     return cleaned_code
 
 def generate_unit_tests(file_name: str, code_content: str, test_plan_description: str) -> str:
@@ -120,7 +248,7 @@ def generate_unit_tests(file_name: str, code_content: str, test_plan_description
     6.  Return ONLY the Python code for the unit tests. Do NOT include any explanations or markdown fences.
     """
     raw_test_code = call_ollama_api([{'role': 'user', 'content': prompt}], "tester")
-    cleaned_test_code = re.sub(r'```python|```', '', raw_test_code).strip()
+    cleaned_test_code = _strip_fences(raw_test_code)
     return cleaned_test_code
 
 def debug_code(code_content: str, test_output: str, test_file: str) -> str:
@@ -147,7 +275,7 @@ def debug_code(code_content: str, test_output: str, test_file: str) -> str:
     """
     messages = [{'role': 'user', 'content': prompt}]
     raw_fixed_code = call_ollama_api(messages, "debugger")
-    cleaned_fixed_code = re.sub(r'```python|```', '', raw_fixed_code).strip()
+    cleaned_fixed_code = _strip_fences(raw_fixed_code)
     return cleaned_fixed_code
 
 def analyze_test_failure(code_content: str, test_output: str) -> str:
@@ -171,11 +299,106 @@ def analyze_test_failure(code_content: str, test_output: str) -> str:
     Respond with ONLY one of the following keywords: 'code_bug', 'test_bug', or 'cannot_determine'.
     """
     messages = [{'role': 'user', 'content': prompt}]
-    analysis_result = call_ollama_api(messages, "analyzer").strip().lower()
+    analysis_result = call_ollama_api(messages, "analyzer", stream=False).strip().lower()
     if analysis_result not in ['code_bug', 'test_bug']:
         return 'cannot_determine'
     return analysis_result
 
+def pytest_command(test_file: str, test_code: str) -> list[str]:
+    """
+    Builds the pytest invocation: stop at the first failure (one is enough to start debugging),
+    skip the cache plugin, and spread larger suites over all cores when pytest-xdist is installed.
+    """
+    command = ['python', '-m', 'pytest', '-q', '--tb=no', '-x', '-p', 'no:cacheprovider']
+    if HAVE_XDIST and test_code.count("def test_") >= XDIST_MIN_TESTS:
+        command += ['-n', 'auto']
+    return command + [test_file]
+
+def _run_pytest_in_process(args: list, cwd: str) -> Tuple[str, str, int]:
+    """Runs pytest inside the current interpreter, the way `python -m pytest` would from cwd."""
+    out, err = io.StringIO(), io.StringIO()
+    prev_cwd, saved_path = os.getcwd(), list(sys.path)
+    os.chdir(cwd)
+    sys.path.insert(0, cwd)
+    try:
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            returncode = int(pytest.main(args))
+    finally:
+        os.chdir(prev_cwd)
+        sys.path[:] = saved_path
+        # Forget the generated modules so the next run imports the rewritten files
+        project_dir = os.path.abspath(cwd)
+        for name, module in list(sys.modules.items()):
+            module_file = getattr(module, "__file__", None)
+            if name != "__main__" and module_file and os.path.dirname(os.path.abspath(module_file)) == project_dir:
+                del sys.modules[name]
+        importlib.invalidate_caches()
+    return out.getvalue(), err.getvalue(), returncode
+
+def _pytest_worker_loop(conn):
+    """Worker process body: runs each (cwd, args) job it receives until None or EOF."""
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        cwd, args = job
+        try:
+            conn.send(_run_pytest_in_process(args, cwd))
+        except Exception as e:
+            conn.send(("", f"Error: pytest crashed. Details: {e}", 1))
+
+class PytestWorker:
+    """
+    A pytest process started once per session: interpreter start-up and plugin imports are paid
+    on the first run only. Tests still run outside this process, and a run that hangs is killed
+    (a fresh worker is started on the next call).
+    """
+
+    def __init__(self):
+        # spawn: the worker starts clean instead of inheriting the agent's threads and sockets
+        self._ctx = multiprocessing.get_context("spawn")
+        self._proc = None
+        self._conn = None
+
+    def start(self):
+        if self._proc is not None and self._proc.is_alive():
+            return
+        parent_conn, child_conn = self._ctx.Pipe()
+        self._proc = self._ctx.Process(target=_pytest_worker_loop, args=(child_conn,), daemon=True)
+        self._proc.start()
+        child_conn.close()
+        self._conn = parent_conn
+
+    def run(self, args: list, cwd: str, timeout: int) -> Tuple[str, str, int]:
+        self.start()
+        try:
+            self._conn.send((cwd, args))
+            if self._conn.poll(timeout):
+                return self._conn.recv()
+            error = "Error: Command timed out."
+        except (EOFError, OSError) as e:
+            error = f"Error: pytest worker died. Details: {e}"
+        self.close()
+        return "", error, 1
+
+    def close(self):
+        if self._proc is None:
+            return
+        try:
+            self._conn.send(None)
+        except OSError:
+            pass
+        self._proc.join(timeout=1)
+        if self._proc.is_alive():
+            self._proc.terminate()
+            self._proc.join()
+        self._conn.close()
+        self._proc = None
+        self._conn = None
+
 # --- Project Manager ---
 class ProjectManager:
     """
@@ -183,21 +406,23 @@ class ProjectManager:
     Ensures a clean, isolated environment for each task.
     """
 
-    def __init__(self, base_dir: str = "temp_project"):
+    def __init__(self, base_dir: str = "temp_project", pytest_worker: Optional[PytestWorker] = None):
         self.base_dir = base_dir
         self.current_dir = None
+        self.pytest_worker = pytest_worker
 
     def create_project(self):
         """
-        Creates a new, unique temporary directory for the project.
-        Deletes any existing directory with the same name first.
+        Creates the temporary directory for the project.
+        An existing directory is kept; only the files left in it are removed, which is
+        much cheaper than walking and deleting the whole tree.
         """
         print(f"Creating new project directory at '{self.base_dir}'.")
-        if os.path.exists(self.base_dir):
-            shutil.rmtree(self.base_dir)
-            print(f"Removed old directory.")
-        
-        os.makedirs(self.base_dir)
+        os.makedirs(self.base_dir, exist_ok=True)
+        with os.scandir(self.base_dir) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False):
+                    os.unlink(entry.path)
         self.current_dir = self.base_dir
         print(f"Directory created.")
 
@@ -209,9 +434,12 @@ class ProjectManager:
             raise RuntimeError("No project directory exists. Call create_project() first.")
         
         file_path = os.path.join(self.current_dir, file_name)
+        tmp_path = os.path.join(self.current_dir, f".{file_name}.tmp")
         print(f"Writing file '{file_name}'.")
-        with open(file_path, "w") as f:
+        # One large buffered write, then an atomic rename so pytest never sees a partial file
+        with open(tmp_path, "w", buffering=1 << 20) as f:
             f.write(content)
+        os.replace(tmp_path, file_path)
 
     def read_file(self, file_name: str) -> str:
         """
@@ -242,6 +470,8 @@ class ProjectManager:
             raise RuntimeError("No project directory exists. Call create_project() first.")
 
         print(f"Executing command: {' '.join(command)}")
+        if self.pytest_worker is not None and command[:3] == ['python', '-m', 'pytest']:
+            return self.pytest_worker.run(command[3:], os.path.abspath(self.current_dir), timeout)
         try:
             result = subprocess.run(
                 command,
@@ -283,20 +513,26 @@ def generate_code_and_tests(prompt: str, language: str = "python", test_plan: Op
     
     # Setup
     os.makedirs(OUTPUT_DIR, exist_ok=True)
-    project_manager = ProjectManager(base_dir="temp_coding_project")
+    # Tests run in one long-lived pytest process instead of a new interpreter per attempt
+    pytest_worker = PytestWorker() if pytest is not None else None
+    project_manager = ProjectManager(base_dir="temp_coding_project", pytest_worker=pytest_worker)
     code_file = "generated_module.py"
     test_file = f"test_{code_file}"
     
     try:
         project_manager.create_project()
         
-        # Generate code
-        generated_code = generate_code(language, prompt)
+        # Generate code and, if not provided, the test plan; both only need the prompt,
+        # so the two requests run concurrently on the Ollama server
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            code_future = pool.submit(generate_code, language, prompt)
+            plan_future = pool.submit(generate_test_plan, language, prompt) if not test_plan else None
+            generated_code = code_future.result()
+            if plan_future is not None:
+                test_plan = plan_future.result()
         project_manager.write_file(code_file, generated_code)
         
-        # Generate test plan if not provided
-        if not test_plan:
-            test_plan = generate_test_plan(language, prompt)
+        if plan_future is not None:
             print("\n--- Auto-generated Test Plan ---")
             print(test_plan)
             print("-----------------------------")
@@ -305,13 +541,14 @@ def generate_code_and_tests(prompt: str, language: str = "python", test_plan: Op
         test_passed = False
         test_output = ""
         analysis_result = 'code_bug'  # Default assumption
+        # Tests are only regenerated after a 'test_bug' verdict; a code fix keeps the current tests
+        generated_tests = generate_unit_tests(code_file, generated_code, test_plan)
         
         for attempt in range(MAX_DEBUG_ATTEMPTS + MAX_TEST_REGEN_ATTEMPTS):
             print(f"\n--- Attempt {attempt + 1} ---")
-            generated_tests = generate_unit_tests(code_file, generated_code, test_plan)
             project_manager.write_file(test_file, generated_tests)
             
-            stdout, stderr, returncode = project_manager.run_command(['python', '-m', 'pytest', '-q', '--tb=no', test_file])
+            stdout, stderr, returncode = project_manager.run_command(pytest_command(test_file, generated_tests))
             
             if returncode == 0:
                 print("Tests passed successfully!")
@@ -331,16 +568,16 @@ def generate_code_and_tests(prompt: str, language: str = "python", test_plan: Op
                     project_manager.write_file(code_file, generated_code)
                 elif analysis_result == 'test_bug' and attempt < MAX_TEST_REGEN_ATTEMPTS:
                     print("Identified as a test bug. Regenerating tests...")
-                    pass  # Loop will regenerate tests
+                    generated_tests = generate_unit_tests(code_file, generated_code, test_plan)
                 else:
                     print("Cannot determine cause or max attempts reached. Stopping.")
                     break
 
-        # Save final files
+        # Save final files; the project dir is deleted afterwards, so move them instead of copying
         final_code_path = os.path.join(OUTPUT_DIR, code_file)
         final_test_path = os.path.join(OUTPUT_DIR, test_file)
-        shutil.copy(os.path.join(project_manager.current_dir, code_file), final_code_path)
-        shutil.copy(os.path.join(project_manager.current_dir, test_file), final_test_path)
+        _persist_file(os.path.join(project_manager.current_dir, code_file), final_code_path)
+        _persist_file(os.path.join(project_manager.current_dir, test_file), final_test_path)
         
         print("\n" + "="*50)
         print("          GENERATION COMPLETE")
@@ -368,6 +605,8 @@ def generate_code_and_tests(prompt: str, language: str = "python", test_plan: Op
         print(f"An unexpected error occurred: {e}")
         raise
     finally:
+        if pytest_worker is not None:
+            pytest_worker.close()
         project_manager.cleanup()
 
 # --- Example Usage ---
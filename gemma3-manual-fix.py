@@ -14,17 +14,43 @@ to do:
     *basic parameters of the model, temp, repeat penalty, etc...
     *button to clear conversation context
 """
+import atexit
 import os
 import sys
 import base64
+import functools
 import json
+import mmap
+import re
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime
+
+try:
+    import orjson  # Optional: faster encoding of requests and parsing of streamed chunks
+    json_dumps = orjson.dumps
+    json_loads = orjson.loads
+except ImportError:
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+    json_loads = json.loads
+
 from PyQt5.QtWidgets import QApplication, QWidget, QLabel, QFileDialog, QPushButton, QVBoxLayout, QHBoxLayout, QTextEdit, QComboBox, QMessageBox
 from PyQt5.QtCore import QThread, pyqtSignal
+from PyQt5.QtGui import QTextCursor
 
 # --- Configuration for Ollama API ---
 OLLAMA_BASE_URL = "http://192.168.1.127:11434"  # Change if your ollama server is on a different IP/port
+STREAM_EMIT_INTERVAL = 0.066  # seconds between UI updates while streaming (~15 fps)
+VISION_RE = re.compile(r'vision|llava')  # model names offered in Image to Text mode
+
+# Shared keep-alive session: the model list and every chat turn reuse the same connection
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=Retry(total=2, backoff_factor=0.3)))
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=Retry(total=2, backoff_factor=0.3)))
+_SESSION.headers.update({"Connection": "keep-alive"})
 
 
 # --- New Functions for Direct API Calls ---
@@ -32,24 +58,39 @@ OLLAMA_BASE_URL = "http://192.168.1.127:11434"  # Change if your ollama server i
 def get_ollama_models(base_url):
     """Fetches the list of available models from the Ollama API."""
     try:
-        response = requests.get(f"{base_url}/api/tags")
+        response = _SESSION.get(f"{base_url}/api/tags")
         response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
-        models_data = response.json()
+        models_data = json_loads(response.content)
         return [model['name'] for model in models_data.get('models', [])]
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, ValueError) as e:
         print(f"Error connecting to Ollama: {e}")
         # Return an empty list or handle the error as appropriate for your UI
         return ["Error: Could not connect to Ollama server"]
 
-model_names = get_ollama_models(OLLAMA_BASE_URL)  #manual fix
-vision_models = [m for m in model_names if 'vision' in m or 'llava' in m] #manual fix
-chat_models   = [m for m in model_names if not ('vision' in m or 'llava' in m)] #manual fix
+@functools.lru_cache(maxsize=1)
+def _model_lists():
+    """Fetches the model list once and returns (all, vision, chat) model names."""
+    names = get_ollama_models(OLLAMA_BASE_URL)
+    vision_models, chat_models = [], []
+    for m in names:
+        (vision_models if VISION_RE.search(m) else chat_models).append(m)
+    return names, vision_models, chat_models
+
+@functools.lru_cache(maxsize=64)
+def _b64_cached(filepath, mtime_ns, size):
+    """Base64 of a file; the (mtime, size) arguments make an edited file miss the cache."""
+    with open(filepath, "rb") as image_file:
+        if size == 0:
+            return ""
+        # Map the file instead of reading it into a second in-memory copy
+        with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return base64.b64encode(data).decode('ascii')
 
 def encode_image_to_base64(filepath):
-    """Reads an image file and returns its Base64 encoded string."""
+    """Reads an image file and returns its Base64 encoded string (cached per file version)."""
     try:
-        with open(filepath, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+        st = os.stat(filepath)
+        return _b64_cached(filepath, st.st_mtime_ns, st.st_size)
     except Exception as e:
         print(f"Error encoding image {filepath}: {e}")
         return None
@@ -57,6 +98,9 @@ def encode_image_to_base64(filepath):
 
 # Logger Class (Unchanged)
 class Logger:
+    # Open append handles by filename, shared by all instances so writes to one file stay in order
+    _handles = {}
+
     def __init__(self, log_dir=".logs"):
         """Initializes the logger with a directory for log files."""
         self.log_dir = log_dir
@@ -68,25 +112,47 @@ class Logger:
         model_name = model.replace('/', '_').replace(':', '_')  # Replace slashes/colons for valid filenames
         return os.path.join(self.log_dir, f"{model_name}_conversations.txt")
 
+    def _handle(self, model):
+        """Returns the open append handle for the model's log file, opening it on first use."""
+        filename = self.get_log_filename(model)
+        handle = Logger._handles.get(filename)
+        if handle is None:
+            handle = Logger._handles[filename] = open(filename, 'a', buffering=1 << 14)
+        return handle
+
+    @staticmethod
+    def close_all():
+        """Flushes and closes every open log file."""
+        for handle in Logger._handles.values():
+            handle.close()
+        Logger._handles.clear()
+
     def log_header(self, model):
         """Logs a new conversation header with timestamp and model."""
         now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         header = f"\n\n--- New Conversation ---\nTimestamp: {now}\nModel: {model}\n"
-        filename = self.get_log_filename(model)
-        with open(filename, 'a') as file:
-            file.write(header)
+        self._handle(model).write(header)
 
     def log_user(self, model, user_input):
         """Logs user input."""
-        filename = self.get_log_filename(model)
-        with open(filename, 'a') as file:
-            file.write(f"User: {user_input}\n")
+        self._handle(model).write(f"User: {user_input}\n")
 
     def log_model(self, model, model_response):
-        """Logs model response."""
-        filename = self.get_log_filename(model)
-        with open(filename, 'a') as file:
-            file.write(f"Model: {model_response}\n")
+        """Logs model response; the turn is complete, so it is flushed to disk."""
+        handle = self._handle(model)
+        handle.write(f"Model: {model_response}\n")
+        handle.flush()
+
+
+atexit.register(Logger.close_all)
+
+
+# --- Thread that loads the model list, so the window shows up before the server answers ---
+class ModelListWorker(QThread):
+    models_signal = pyqtSignal(list, list, list)
+
+    def run(self):
+        self.models_signal.emit(*_model_lists())
 
 
 # --- Thread for API Calls to prevent UI freezing ---
@@ -94,43 +160,52 @@ class ApiWorker(QThread):
     response_signal = pyqtSignal(str)
     error_signal = pyqtSignal(str)
 
-    def __init__(self, mode, model, prompt, attached_files, parent=None):
+    def __init__(self, mode, model, prompt, attached_files, chat_history, logger, parent=None):
         super().__init__(parent)
         self.mode = mode
         self.model = model
         self.prompt = prompt
         self.attached_files = attached_files
+        self.chat_history = chat_history  # the app's list, extended in place after each turn
+        self.logger = logger
 
     def run(self):
         try:
             if self.mode == "Chat":
-                self.chat_history = []  # Initialize chat history
-                self.logger = Logger()
                 if not self.chat_history:
                     self.logger.log_header(self.model)
 
-                self.chat_history.append({"role": "user", "content": self.prompt})
-
+                # Earlier turns are sent unchanged, so Ollama can reuse its cached prompt prefix
+                user_message = {"role": "user", "content": self.prompt}
                 payload = {
                     "model": self.model,
-                    "messages": self.chat_history,
+                    "messages": self.chat_history + [user_message],
                     "stream": True  # Enable streaming
                 }
 
                 response_parts = []
-                with requests.post(f"{OLLAMA_BASE_URL}/api/chat", json=payload, stream=True) as response:
+                pending = []  # tokens received since the last UI update
+                last_emit = time.monotonic()
+                with _SESSION.post(f"{OLLAMA_BASE_URL}/api/chat", data=json_dumps(payload), headers={"Content-Type": "application/json"}, stream=True) as response:
                     response.raise_for_status()
                     for line in response.iter_lines():
                         if line:
-                            part = json.loads(line.decode('utf-8'))
+                            part = json_loads(line)  # orjson takes the raw bytes, no decode needed
                             content_part = part['message']['content']
                             response_parts.append(content_part)
-                            self.response_signal.emit("".join(response_parts))  # Emit parts for UI update
-                            # No need for QApplication.processEvents() inside the thread
+                            pending.append(content_part)
+                            # Emit only the new text, batched to ~15 updates per second
+                            now = time.monotonic()
+                            if part.get('done') or now - last_emit >= STREAM_EMIT_INTERVAL:
+                                self.response_signal.emit("".join(pending))
+                                pending = []
+                                last_emit = now
+                if pending:
+                    self.response_signal.emit("".join(pending))
 
                 response_content = "".join(response_parts)
-                self.chat_history.append({"role": "assistant", "content": response_content})
-                self.response_signal.emit(response_content)  # Emit final content
+                # Only a completed turn joins the history, a failed one leaves it untouched
+                self.chat_history.extend([user_message, {"role": "assistant", "content": response_content}])
                 self.logger.log_model(self.model, response_content)
 
             else:  # Image to Text mode
@@ -151,9 +226,9 @@ class ApiWorker(QThread):
                     "stream": False  # No streaming for this mode
                 }
 
-                response = requests.post(f"{OLLAMA_BASE_URL}/api/chat", json=payload)
+                response = _SESSION.post(f"{OLLAMA_BASE_URL}/api/chat", data=json_dumps(payload), headers={"Content-Type": "application/json"})
                 response.raise_for_status()
-                response_data = response.json()
+                response_data = json_loads(response.content)
                 response_content = response_data['message']['content']
                 self.response_signal.emit(response_content)
                 self.logger.log_model(self.model, response_content)
@@ -168,9 +243,16 @@ class ApiWorker(QThread):
 class MultiFunctionApp(QWidget):
     def __init__(self):
         super().__init__()
+        self.logger = Logger()
         self.chat_history = []
         self.attached_files = []
+        self.awaiting_response = False
+        self.vision_models = []
+        self.chat_models = []
         self.init_ui()
+        self.model_loader = ModelListWorker(self)
+        self.model_loader.models_signal.connect(self.set_model_lists)
+        self.model_loader.start()
 
     def init_ui(self):
         self.setWindowTitle("Multi-chat v0.2.7 (API Refactor)")
@@ -200,7 +282,6 @@ class MultiFunctionApp(QWidget):
 
         self.model_label = QLabel("Model:")
         self.model_combo = QComboBox()
-        self.model_combo.addItems(model_names)
 
         self.submit_button = QPushButton("Submit")
         self.submit_button.clicked.connect(self.submit)
@@ -243,12 +324,18 @@ class MultiFunctionApp(QWidget):
             self.file_button.show()
             self.attach_button.hide()
             self.model_combo.clear()
-            self.model_combo.addItems(vision_models)
+            self.model_combo.addItems(self.vision_models)
         else:
             self.file_button.hide()
             self.attach_button.show()
             self.model_combo.clear()
-            self.model_combo.addItems(chat_models)
+            self.model_combo.addItems(self.chat_models)
+
+    def set_model_lists(self, model_names, vision_models, chat_models):
+        """Fills the model combo once the background fetch is done."""
+        self.vision_models = vision_models
+        self.chat_models = chat_models
+        self.update_ui()
 
     def select_image_files(self):
         filenames, _ = QFileDialog.getOpenFileNames(self, "Select image files", "", "Image files (*.png *.jpg *.jpeg *.bmp *.gif)")
@@ -266,17 +353,23 @@ class MultiFunctionApp(QWidget):
         model = self.model_combo.currentText()
 
         self.output_entry.setText("Generating response...")
-        QApplication.processEvents()  # Update the UI to show the message
+        self.awaiting_response = True  # the first streamed text replaces the placeholder
 
         # Create a worker thread for the API call
-        self.worker = ApiWorker(mode, model, prompt, self.attached_files)
+        self.worker = ApiWorker(mode, model, prompt, self.attached_files, self.chat_history, self.logger)
         self.worker.response_signal.connect(self.update_output)
         self.worker.error_signal.connect(self.show_error)
         self.worker.start()
 
     def update_output(self, text):
-        self.output_entry.append(text)
-        QApplication.processEvents()
+        """Adds a piece of streamed text at the end of the output box."""
+        if self.awaiting_response:
+            self.output_entry.clear()
+            self.awaiting_response = False
+        cursor = self.output_entry.textCursor()
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(text)
+        self.output_entry.setTextCursor(cursor)
 
     def show_error(self, message):
         QMessageBox.critical(self, "Error", message)
@@ -286,7 +379,6 @@ class MultiFunctionApp(QWidget):
         self.chat_history = []
         self.output_entry.clear()
         self.chat_history_display.clear()
-        QApplication.processEvents()
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
@@ -11,74 +11,282 @@ Description: Front‑end for Ollama with image‑to‑text and chat capabilities
 
 import os
 import sys
-import base64
+import atexit
+import functools
 import json
-import requests
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+
+try:
+    import orjson  # Optional: faster encoding of requests and parsing of the streamed reply
+    json_dumps = orjson.dumps
+    json_loads = orjson.loads
+except ImportError:
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+    json_loads = json.loads
+
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QLabel, QFileDialog, QPushButton,
-    QVBoxLayout, QHBoxLayout, QTextEdit, QComboBox
+    QVBoxLayout, QHBoxLayout, QTextEdit, QPlainTextEdit, QComboBox
 )
+from PyQt5.QtCore import QThread, pyqtSignal
+from PyQt5.QtGui import QTextCursor
 
 # ------------------------------------------------------------------
 # Configuration
 # ------------------------------------------------------------------
 OLLAMA_BASE_URL = "http://192.168.1.127:11434"  # Change if your Ollama server is elsewhere
+STREAM_EMIT_INTERVAL = 0.03  # seconds between output updates while streaming
+MODEL_CACHE_FILE = os.path.expanduser("~/.cache/ollama_models.json")  # last fetched model list
+MODELS_ERROR = "Error: Could not connect to Ollama server"
+JSON_HEADERS = {"Content-Type": "application/json"}  # request bodies are pre-serialized bytes
+VISION_RE = re.compile(r'vision|llava')  # model names offered in Image to Text mode
+ROLE_LABEL = {"user": "User", "assistant": "Model"}  # chat history pane labels
+
+# Shared keep-alive session: the model list and every chat turn reuse the same connection.
+# It is created (and requests imported) on first use, on a worker thread, so the window
+# does not wait for those imports.
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+def get_session():
+    """Return the shared session, creating it on first use."""
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            # No retries: a connection failure is reported at once instead of after a back-off
+            session.mount("http://", HTTPAdapter(pool_connections=10, pool_maxsize=10, max_retries=0))
+            session.headers.update({"Connection": "keep-alive"})
+            _SESSION = session
+    return _SESSION
 
 # ------------------------------------------------------------------
 # Utility Functions
 # ------------------------------------------------------------------
 def get_ollama_models(base_url):
     """Fetch list of available models from the Ollama API."""
+    import requests
     try:
-        response = requests.get(f"{base_url}/api/tags")
+        response = get_session().get(f"{base_url}/api/tags")
         response.raise_for_status()
-        models_data = response.json()
+        models_data = json_loads(response.content)
         return [model['name'] for model in models_data.get('models', [])]
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, ValueError) as e:
         print(f"Error connecting to Ollama: {e}")
-        return ["Error: Could not connect to Ollama server"]
+        return [MODELS_ERROR]
 
-def encode_image_to_base64(filepath):
-    """Read an image file and return its Base64 encoded string."""
+def encode_image_to_base64(filepath, size=None):
+    """Read an image file and return its Base64 encoded string (size: file size hint in bytes)."""
+    import base64
     try:
+        # With a size hint the buffer is allocated once at its final length
+        encoded = bytearray(((size + 2) // 3) * 4 if size else 0)
+        pos = 0
         with open(filepath, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+            # Encode in chunks whose size is a multiple of 3, so the pieces join without padding
+            # and the raw image is never held in memory in full
+            for chunk in iter(lambda: image_file.read(3 * 65536), b""):
+                piece = base64.b64encode(chunk)
+                encoded[pos:pos + len(piece)] = piece
+                pos += len(piece)
+        del encoded[pos:]  # the file shrank since it was sized
+        return encoded.decode('ascii')
     except Exception as e:
         print(f"Error encoding image {filepath}: {e}")
         return None
 
+@functools.lru_cache(maxsize=32)
+def _read_text_cached(filepath, mtime_ns, size):
+    """Text of a file; the (mtime, size) arguments make an edited file miss the cache."""
+    with open(filepath, "rb") as f:
+        return f.read().decode('utf-8', errors='replace')
+
+def read_text_file(filepath):
+    """Return the text of an attached file, reusing the last read while it is unchanged."""
+    st = os.stat(filepath)
+    return _read_text_cached(filepath, st.st_mtime_ns, st.st_size)
+
 # ------------------------------------------------------------------
 # Model Lists
 # ------------------------------------------------------------------
-model_names = get_ollama_models(OLLAMA_BASE_URL)
-vision_models = [m for m in model_names if 'vision' in m or 'llava' in m]
-chat_models   = [m for m in model_names if not ('vision' in m or 'llava' in m)]
+def split_models(model_names):
+    """Return (vision_models, chat_models), split in one pass."""
+    vision_models, chat_models = [], []
+    for m in model_names:
+        (vision_models if VISION_RE.search(m) else chat_models).append(m)
+    return vision_models, chat_models
+
+def load_cached_models():
+    """Return the model list saved by the last successful fetch, or an empty list."""
+    try:
+        with open(MODEL_CACHE_FILE, "rb") as f:
+            return json_loads(f.read())
+    except (OSError, ValueError):
+        return []
+
+def save_cached_models(model_names):
+    """Save the model list, writing a temp file and renaming it into place."""
+    try:
+        os.makedirs(os.path.dirname(MODEL_CACHE_FILE), exist_ok=True)
+        tmp_path = MODEL_CACHE_FILE + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(model_names, f)
+        os.replace(tmp_path, MODEL_CACHE_FILE)
+    except OSError as e:
+        print(f"Could not write model cache: {e}")
+
+class ModelListWorker(QThread):
+    """Fetches the model list in the background, so the window shows up before the server answers."""
+    models_signal = pyqtSignal(list)
+
+    def run(self):
+        model_names = get_ollama_models(OLLAMA_BASE_URL)
+        if model_names != [MODELS_ERROR]:
+            save_cached_models(model_names)
+        self.models_signal.emit(model_names)
 
 # ------------------------------------------------------------------
 # Logger Class
 # ------------------------------------------------------------------
 class Logger:
+    # Open append handles by filename, shared by all instances so writes to one file stay in order
+    _handles = {}
+
     def __init__(self, log_dir=".logs"):
         self.log_dir = log_dir
+        self._path_cache = {}  # model name -> log file path
         os.makedirs(self.log_dir, exist_ok=True)
 
     def get_log_filename(self, model):
-        name = model.replace('/', '_').replace(':', '_')
-        return os.path.join(self.log_dir, f"{name}_conversations.txt")
+        path = self._path_cache.get(model)
+        if path is None:
+            name = model.replace('/', '_').replace(':', '_')
+            path = self._path_cache[model] = os.path.join(self.log_dir, f"{name}_conversations.txt")
+        return path
+
+    def _handle(self, model):
+        """Return the model's open log file, opening it on first use."""
+        filename = self.get_log_filename(model)
+        handle = Logger._handles.get(filename)
+        if handle is None:
+            handle = Logger._handles[filename] = open(filename, "a", buffering=1 << 16)
+        return handle
+
+    @staticmethod
+    def close_all():
+        """Flush and close every open log file."""
+        for handle in Logger._handles.values():
+            handle.close()
+        Logger._handles.clear()
+
+    def _header(self, model):
+        return f"\n\n--- New Conversation ---\nTimestamp: {datetime.now():%Y-%m-%d %H:%M:%S}\nModel: {model}\n"
 
     def log_header(self, model):
-        header = f"\n\n--- New Conversation ---\nTimestamp: {datetime.now():%Y-%m-%d %H:%M:%S}\nModel: {model}\n"
-        with open(self.get_log_filename(model), "a") as f:
-            f.write(header)
+        self._handle(model).write(self._header(model))
+
+    def log_session_start(self, model, user_input):
+        """Log the conversation header and its first user message in one write."""
+        self._handle(model).writelines([self._header(model), f"User: {user_input}\n"])
 
     def log_user(self, model, user_input):
-        with open(self.get_log_filename(model), "a") as f:
-            f.write(f"User: {user_input}\n")
+        self._handle(model).write(f"User: {user_input}\n")
 
     def log_model(self, model, model_response):
-        with open(self.get_log_filename(model), "a") as f:
-            f.write(f"Model: {model_response}\n")
+        # A reply completes the turn, so the buffered entries go to disk now
+        handle = self._handle(model)
+        handle.write(f"Model: {model_response}\n")
+        handle.flush()
+
+atexit.register(Logger.close_all)
+
+# ------------------------------------------------------------------
+# API Worker
+# ------------------------------------------------------------------
+class ApiWorker(QThread):
+    """Runs one Ollama request off the GUI thread and reports back through signals."""
+    chunk_signal = pyqtSignal(str)  # streamed reply text, in order
+    done_signal = pyqtSignal(str)   # the complete reply
+    error_signal = pyqtSignal(str)
+
+    def __init__(self, mode, model, prompt, messages, parent=None):
+        super().__init__(parent)
+        self.mode = mode
+        self.model = model
+        self.prompt = prompt
+        self.messages = messages  # chat history to send (Chat mode only)
+
+    def run(self):
+        import requests
+        try:
+            if self.mode == "Chat":
+                payload = {"model": self.model, "messages": self.messages, "stream": True}
+
+                response_parts = []
+                emitted = 0  # response_parts[:emitted] are already on screen
+                last_emit = time.monotonic()
+                with get_session().post(f"{OLLAMA_BASE_URL}/api/chat", data=json_dumps(payload), headers=JSON_HEADERS, stream=True) as resp:
+                    resp.raise_for_status()
+                    for line in resp.iter_lines():
+                        if line:
+                            part = json_loads(line)  # both parsers take the raw bytes, no decode needed
+                            content_part = part["message"]["content"]
+                            response_parts.append(content_part)
+                            # Coalesce tokens into one update per interval instead of one per line
+                            now = time.monotonic()
+                            if part.get("done") or now - last_emit >= STREAM_EMIT_INTERVAL:
+                                self.chunk_signal.emit("".join(response_parts[emitted:]))
+                                emitted = len(response_parts)
+                                last_emit = now
+                if emitted < len(response_parts):
+                    self.chunk_signal.emit("".join(response_parts[emitted:]))
+
+                self.done_signal.emit("".join(response_parts))
+
+            else:  # Image to Text
+                image_paths = self.prompt.splitlines()
+                if not image_paths:
+                    raise ValueError("No image paths provided.")
+
+                # One stat per image: reports unreadable paths and gives the encoder its size
+                paths, sizes = [], []
+                for p in image_paths:
+                    try:
+                        sizes.append(os.stat(p).st_size)
+                        paths.append(p)
+                    except OSError as e:
+                        self.chunk_signal.emit(f"⚠️  {p}: {e.strerror}\n")
+
+                # Encode the images in parallel: file reads overlap with encoding
+                with ThreadPoolExecutor(max_workers=max(1, min(8, len(paths)))) as pool:
+                    base64_imgs = [b for b in pool.map(encode_image_to_base64, paths, sizes) if b]
+                if not base64_imgs:
+                    raise ValueError("Could not encode any provided images.")
+
+                payload = {
+                    "model": self.model,
+                    "messages": [{
+                        "role": "user",
+                        "content": "Describe these images.",
+                        "images": base64_imgs
+                    }],
+                    "stream": False
+                }
+                resp = get_session().post(f"{OLLAMA_BASE_URL}/api/chat", data=json_dumps(payload), headers=JSON_HEADERS)
+                resp.raise_for_status()
+                self.done_signal.emit(json_loads(resp.content)["message"]["content"])
+
+        except requests.exceptions.RequestException as e:
+            self.error_signal.emit(f"API Error: {e}")
+        except Exception as e:
+            self.error_signal.emit(f"Unexpected error: {e}")
 
 # ------------------------------------------------------------------
 # Main Application
@@ -89,7 +297,15 @@ class MultiFunctionApp(QWidget):
         self.logger = Logger()
         self.chat_history = []        # List of message dicts for the current session
         self.attached_files = []      # Paths of files attached for a prompt
+        self.awaiting_response = False
+        self.worker = None
+        # Start from the cached model list; the background fetch refreshes it
+        self.model_names = load_cached_models()
+        self.vision_models, self.chat_models = split_models(self.model_names)
         self.init_ui()
+        self.model_loader = ModelListWorker(self)
+        self.model_loader.models_signal.connect(self.set_model_lists)
+        self.model_loader.start()
 
     # --------------------- UI Construction -----------------------
     def init_ui(self):
@@ -99,8 +315,11 @@ class MultiFunctionApp(QWidget):
 
         # Widgets
         self.chat_history_label = QLabel("Chat History:")
-        self.chat_history_display = QTextEdit()
+        # Plain-text panes: cheap appends, no rich-text layout
+        self.chat_history_display = QPlainTextEdit()
         self.chat_history_display.setReadOnly(True)
+        self.chat_history_display.setMaximumBlockCount(5000)  # cap memory in very long sessions
+        self._history_cursor = self.chat_history_display.textCursor()  # reused for every entry
 
         self.mode_label = QLabel("Mode:")
         self.mode_combo = QComboBox()
@@ -111,7 +330,7 @@ class MultiFunctionApp(QWidget):
         self.prompt_entry = QTextEdit()
 
         self.output_label = QLabel("Output:")
-        self.output_entry = QTextEdit()
+        self.output_entry = QPlainTextEdit()
         self.output_entry.setReadOnly(True)
 
         self.file_button = QPushButton("Attach Image…")
@@ -122,7 +341,7 @@ class MultiFunctionApp(QWidget):
 
         self.model_label = QLabel("Model:")
         self.model_combo = QComboBox()
-        self.model_combo.addItems(model_names)
+        self.model_combo.addItems(self.model_names)
 
         self.submit_button = QPushButton("Submit")
         self.submit_button.clicked.connect(self.submit)
@@ -171,12 +390,24 @@ class MultiFunctionApp(QWidget):
             self.file_button.show()
             self.attach_button.hide()
             self.model_combo.clear()
-            self.model_combo.addItems(vision_models)
+            self.model_combo.addItems(self.vision_models)
         else:
             self.file_button.hide()
             self.attach_button.show()
             self.model_combo.clear()
-            self.model_combo.addItems(chat_models)
+            self.model_combo.addItems(self.chat_models)
+
+    def set_model_lists(self, model_names):
+        """Refill the model combo with the freshly fetched list, keeping the selection."""
+        if model_names == [MODELS_ERROR] and self.model_names:
+            return  # server unreachable: keep offering the cached models
+        selected = self.model_combo.currentText()
+        self.model_names = model_names
+        self.vision_models, self.chat_models = split_models(model_names)
+        self.update_ui()
+        index = self.model_combo.findText(selected)
+        if index >= 0:
+            self.model_combo.setCurrentIndex(index)
 
     def select_image_files(self):
         filenames, _ = QFileDialog.getOpenFileNames(
@@ -193,7 +424,7 @@ class MultiFunctionApp(QWidget):
         )
         if filenames:
             self.attached_files = filenames
-            self.output_entry.append("Attached files for the current prompt:\n" + "\n".join(filenames))
+            self.output_entry.appendPlainText("Attached files for the current prompt:\n" + "\n".join(filenames))
 
     # --------------------- Conversation Logic --------------------
     def submit(self):
@@ -202,87 +433,69 @@ class MultiFunctionApp(QWidget):
         model = self.model_combo.currentText()
 
         if not prompt:
-            self.output_entry.setText("⚠️  Prompt is empty.")
+            self.output_entry.setPlainText("⚠️  Prompt is empty.")
             return
 
-        # Start a new conversation if needed
-        if not self.chat_history:
-            self.logger.log_header(model)
-
         # Incorporate attached text files into the prompt
         if self.attached_files:
             for fp in self.attached_files:
                 try:
-                    with open(fp, 'r', encoding='utf-8') as f:
-                        content = f.read()
+                    content = read_text_file(fp)
                     prompt += f"\n\n--- Content of {fp} ---\n{content}"
                 except Exception as e:
-                    self.output_entry.append(f"⚠️  Error reading {fp}: {e}")
+                    self.output_entry.appendPlainText(f"⚠️  Error reading {fp}: {e}")
             self.attached_files.clear()
 
-        self.logger.log_user(model, prompt)
-        self.output_entry.setText("Generating response…")
-        QApplication.processEvents()  # Update UI immediately
-
-        try:
-            if mode == "Chat":
-                # Append user message
-                self.chat_history.append({"role": "user", "content": prompt})
-                payload = {"model": model, "messages": self.chat_history, "stream": True}
-
-                response_parts = []
-                with requests.post(f"{OLLAMA_BASE_URL}/api/chat", json=payload, stream=True) as resp:
-                    resp.raise_for_status()
-                    for line in resp.iter_lines():
-                        if line:
-                            part = json.loads(line.decode('utf-8'))
-                            content_part = part["message"]["content"]
-                            response_parts.append(content_part)
-                            # Stream to UI
-                            self.output_entry.setText("".join(response_parts))
-                            QApplication.processEvents()
-
-                response_text = "".join(response_parts)
-                # Append assistant message
-                self.chat_history.append({"role": "assistant", "content": response_text})
-
-                # Update chat history display
-                history_text = "\n\n".join(
-                    f"{'User' if m['role']=='user' else 'Model'}: {m['content']}"
-                    for m in self.chat_history
-                )
-                self.chat_history_display.setText(history_text)
-                self.output_entry.setText(response_text)
-
-            else:  # Image to Text
-                image_paths = prompt.splitlines()
-                if not image_paths:
-                    raise ValueError("No image paths provided.")
-
-                base64_imgs = [encode_image_to_base64(p) for p in image_paths if os.path.exists(p)]
-                if not base64_imgs:
-                    raise ValueError("Could not encode any provided images.")
-
-                payload = {
-                    "model": model,
-                    "messages": [{
-                        "role": "user",
-                        "content": "Describe these images.",
-                        "images": base64_imgs
-                    }],
-                    "stream": False
-                }
-                resp = requests.post(f"{OLLAMA_BASE_URL}/api/chat", json=payload)
-                resp.raise_for_status()
-                response_text = resp.json()["message"]["content"]
-                self.output_entry.setText(response_text)
-
-            self.logger.log_model(model, response_text)
+        if not self.chat_history:
+            self.logger.log_session_start(model, prompt)  # Start a new conversation
+        else:
+            self.logger.log_user(model, prompt)
+        self.output_entry.setPlainText("Generating response…")
+        self.awaiting_response = True  # the first streamed text replaces the placeholder
+
+        messages = None
+        if mode == "Chat":
+            # Append user message
+            self.chat_history.append({"role": "user", "content": prompt})
+            self.add_history_entry("user", prompt)
+            messages = list(self.chat_history)
+
+        # The request runs on a worker thread; results come back through queued signals
+        self.submit_button.setEnabled(False)
+        self.worker = ApiWorker(mode, model, prompt, messages)
+        self.worker.chunk_signal.connect(self.append_output)
+        self.worker.done_signal.connect(self.finish_response)
+        self.worker.error_signal.connect(self.output_entry.setPlainText)
+        self.worker.finished.connect(lambda: self.submit_button.setEnabled(True))
+        self.worker.start()
+
+    def append_output(self, text):
+        """Add a piece of streamed text at the end of the output box."""
+        if self.awaiting_response:
+            self.output_entry.clear()
+            self.awaiting_response = False
+        cursor = self.output_entry.textCursor()
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(text)
+
+    def add_history_entry(self, role, text):
+        """Add one message at the end of the chat history pane and scroll to it."""
+        self._history_cursor.movePosition(QTextCursor.End)
+        self._history_cursor.insertText(f"{ROLE_LABEL[role]}: {text}\n\n")
+        scroll_bar = self.chat_history_display.verticalScrollBar()
+        scroll_bar.setValue(scroll_bar.maximum())
+
+    def finish_response(self, response_text):
+        """Record a completed reply in the history, the display and the log."""
+        if self.worker.mode == "Chat":
+            # Append assistant message
+            self.chat_history.append({"role": "assistant", "content": response_text})
+            # The display only ever grows, so add the new reply instead of rebuilding it
+            self.add_history_entry("assistant", response_text)
+        else:
+            self.append_output(response_text)  # after any warnings about skipped images
 
-        except requests.exceptions.RequestException as e:
-            self.output_entry.setText(f"API Error: {e}")
-        except Exception as e:
-            self.output_entry.setText(f"Unexpected error: {e}")
+        self.logger.log_model(self.worker.model, response_text)
 
     # --------------------- Reset Logic ----------------------------
     def reset_conversation(self):
@@ -303,7 +516,14 @@ class MultiFunctionApp(QWidget):
         self.logger.log_header(model)
 
         # Inform the user
-        self.output_entry.setText("✅  Conversation reset. You can start a new session now.")
+        self.output_entry.setPlainText("✅  Conversation reset. You can start a new session now.")
+
+    def closeEvent(self, event):
+        """Release the log files and pooled HTTP connections when the window closes."""
+        Logger.close_all()
+        if _SESSION is not None:
+            _SESSION.close()
+        super().closeEvent(event)
 
 # ------------------------------------------------------------------
 # Run Application
@@ -6,75 +6,313 @@ Refactored on Oct 7 2025 (Added Reset Conversation Button)
 import os
 import sys
 import base64
+import functools
 import json
+import re
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+
+try:
+    import orjson  # Optional: faster encoding of requests and parsing of streamed chunks
+    json_dumps = orjson.dumps
+    json_loads = orjson.loads
+except ImportError:
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+    json_loads = json.loads
+
 from PyQt5.QtWidgets import QApplication, QWidget, QLabel, QFileDialog, QPushButton, QVBoxLayout, QHBoxLayout, QTextEdit, QComboBox
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QThread, pyqtSignal
+from PyQt5.QtGui import QTextCursor, QStandardItemModel, QStandardItem
 
 # --- Configuration for Ollama API ---
 OLLAMA_BASE_URL = "http://192.168.1.127:11434"  # Change if your ollama server is on a different IP/port
+MODEL_CACHE_FILE = os.path.expanduser("~/.cache/ollama_model_lists.json")  # model lists by server URL
+MODEL_CACHE_TTL = 60  # seconds a cached model list is used without asking the server again
+MODELS_ERROR = "Error: Could not connect to Ollama server"
+STREAM_EMIT_INTERVAL = 0.04  # seconds between output updates while streaming
+# Streamed replies are asked for uncompressed, so no token waits in a decompressor buffer
+STREAM_HEADERS = {"Content-Type": "application/json", "Accept-Encoding": "identity"}
+HISTORY_MAX_MESSAGES = 40  # persisted messages restored when a model is picked (20 turns)
+VISION_RE = re.compile(r'vision|llava')  # model names offered in Image to Text mode
+
+# Shared keep-alive session: the model list and every chat turn reuse the same connection
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=Retry(total=2, backoff_factor=0.2)))
+_SESSION.headers.update({"Connection": "keep-alive"})
 
 # --- New Functions for Direct API Calls ---
 def get_ollama_models(base_url):
     """Fetches the list of available models from the Ollama API."""
     try:
-        response = requests.get(f"{base_url}/api/tags")
+        response = _SESSION.get(f"{base_url}/api/tags")
         response.raise_for_status()
-        models_data = response.json()
+        models_data = json_loads(response.content)
         return [model['name'] for model in models_data.get('models', [])]
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, ValueError) as e:
         print(f"Error connecting to Ollama: {e}")
-        return ["Error: Could not connect to Ollama server"]
+        return [MODELS_ERROR]
+
+def iter_ndjson_lines(response, chunk_size=4096):
+    """Yields the non-empty lines of a streamed NDJSON response, split in one pass per chunk."""
+    buf = bytearray()
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        buf += chunk
+        start = 0
+        while (nl := buf.find(b'\n', start)) != -1:
+            if nl > start:
+                yield bytes(buf[start:nl])
+            start = nl + 1
+        del buf[:start]
+    if buf.strip():
+        yield bytes(buf)
+
+@functools.lru_cache(maxsize=32)
+def _b64_cached(filepath, mtime_ns, size):
+    """Base64 of a file; the (mtime, size) arguments make an edited file miss the cache."""
+    parts = []
+    with open(filepath, "rb", buffering=1 << 16) as image_file:
+        # 57 KiB chunks: a multiple of 3 bytes, so the encoded pieces join without padding
+        while chunk := image_file.read(57 * 1024):
+            parts.append(base64.b64encode(chunk))
+    return b"".join(parts).decode('ascii')
 
 def encode_image_to_base64(filepath):
-    """Reads an image file and returns its Base64 encoded string."""
+    """Reads an image file and returns its Base64 encoded string (cached per file version), or None if it can't be read."""
     try:
-        with open(filepath, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+        st = os.stat(filepath)
+        return _b64_cached(filepath, st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        return None  # not an existing path, e.g. a line of text in the prompt box
     except Exception as e:
         print(f"Error encoding image {filepath}: {e}")
         return None
 
-# --- Get Model Lists using the new API function ---
-model_names = get_ollama_models(OLLAMA_BASE_URL)
+# --- Model Lists: cached on disk, refreshed in the background ---
+def split_models(model_names):
+    """Filters models into two lists, vision and non-vision, in one pass."""
+    vision_models, chat_models = [], []
+    for model in model_names:
+        (vision_models if VISION_RE.search(model) else chat_models).append(model)
+    return vision_models, chat_models
 
-# Filter models into two lists: vision and non-vision
-vision_models = [model for model in model_names if 'vision' in model or 'llava' in model]
-chat_models = [model for model in model_names if not 'vision' in model or 'llava' in model]
+def _read_model_cache():
+    try:
+        with open(MODEL_CACHE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
-# Logger Class (Unchanged)
+def load_cached_models(base_url):
+    """Returns (model_names, is_fresh) for the server from the on-disk cache."""
+    try:
+        entry = _read_model_cache()[base_url]
+        return list(entry["models"]), time.time() - entry["time"] < MODEL_CACHE_TTL
+    except (KeyError, TypeError):
+        return [], False
+
+def store_cached_models(base_url, model_names):
+    """Saves the server's model list (None drops it); written to a temp file, then renamed into place."""
+    cache = _read_model_cache()
+    if model_names is None:
+        cache.pop(base_url, None)
+    else:
+        cache[base_url] = {"time": time.time(), "models": model_names}
+    try:
+        os.makedirs(os.path.dirname(MODEL_CACHE_FILE), exist_ok=True)
+        with open(MODEL_CACHE_FILE + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(cache, f)
+        os.replace(MODEL_CACHE_FILE + ".tmp", MODEL_CACHE_FILE)
+    except OSError as e:
+        print(f"Could not write model cache: {e}")
+
+class ModelListWorker(QThread):
+    """Fetches the model list off the GUI thread, so the window never waits for the server."""
+    models_signal = pyqtSignal(list)
+
+    def run(self):
+        model_names = get_ollama_models(OLLAMA_BASE_URL)
+        # A failed fetch invalidates the cached list instead of refreshing it
+        store_cached_models(OLLAMA_BASE_URL, None if model_names == [MODELS_ERROR] else model_names)
+        self.models_signal.emit(model_names)
+
+# Logger Class
 class Logger:
+    # Open append handles by filename, shared by all instances so writes to one file stay in order
+    _handles = {}
+
     def __init__(self, log_dir=".logs"):
         """Initializes the logger with a directory for log files."""
         self.log_dir = log_dir
+        self._path_cache = {}  # model name -> log file path
         if not os.path.exists(self.log_dir):
             os.makedirs(self.log_dir)
 
     def get_log_filename(self, model):
-        """Generates a log filename based on the model."""
+        """Generates a log filename based on the model (computed once per model)."""
+        path = self._path_cache.get(model)
+        if path is None:
+            model_name = model.replace('/', '_').replace(':', '_')
+            path = self._path_cache[model] = os.path.join(self.log_dir, f"{model_name}_conversations.txt")
+        return path
+
+    def get_history_path(self, model):
+        """Path of the model's persisted chat history, one JSON message per line."""
         model_name = model.replace('/', '_').replace(':', '_')
-        return os.path.join(self.log_dir, f"{model_name}_conversations.txt")
+        return os.path.join(self.log_dir, f"{model_name}_history.jsonl")
+
+    def _open(self, filename):
+        """Returns the open append handle for a file, opening it on first use."""
+        handle = Logger._handles.get(filename)
+        if handle is None:
+            handle = Logger._handles[filename] = open(filename, 'a', buffering=1 << 16)
+        return handle
+
+    def _handle(self, model):
+        """Returns the open append handle for the model's log file."""
+        return self._open(self.get_log_filename(model))
+
+    @staticmethod
+    def close_all():
+        """Flushes and closes every open log file."""
+        for handle in Logger._handles.values():
+            handle.close()
+        Logger._handles.clear()
 
     def log_header(self, model):
         """Logs a new conversation header with timestamp and model."""
         now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         header = f"\n\n--- New Conversation ---\nTimestamp: {now}\nModel: {model}\n"
-        filename = self.get_log_filename(model)
-        with open(filename, 'a') as file:
-            file.write(header)
+        self._handle(model).write(header)
 
     def log_user(self, model, user_input):
         """Logs user input."""
-        filename = self.get_log_filename(model)
-        with open(filename, 'a') as file:
-            file.write(f"User: {user_input}\n")
+        self._handle(model).write(f"User: {user_input}\n")
 
     def log_model(self, model, model_response):
-        """Logs model response."""
-        filename = self.get_log_filename(model)
-        with open(filename, 'a') as file:
-            file.write(f"Model: {model_response}\n")
+        """Logs model response; the turn is complete, so it is flushed to disk."""
+        handle = self._handle(model)
+        handle.write(f"Model: {model_response}\n")
+        handle.flush()
+
+    def append_history(self, model, messages):
+        """Appends chat messages to the model's persisted history and flushes them to disk."""
+        handle = self._open(self.get_history_path(model))
+        handle.writelines(json.dumps(message) + "\n" for message in messages)
+        handle.flush()
+
+    def load_history(self, model, max_messages):
+        """Returns the model's last max_messages persisted messages (an empty list if there are none)."""
+        messages = []
+        try:
+            with open(self.get_history_path(model), 'r') as f:
+                for line in deque(f, maxlen=max_messages):
+                    try:
+                        messages.append(json_loads(line))
+                    except ValueError:
+                        continue  # a line cut short by a crash
+        except OSError:
+            pass
+        return messages
+
+    def clear_history(self, model):
+        """Deletes the model's persisted history."""
+        path = self.get_history_path(model)
+        handle = Logger._handles.pop(path, None)
+        if handle is not None:
+            handle.close()
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+# Thread for the streamed chat request, so the UI keeps running while the model answers
+class ApiWorker(QThread):
+    chunk_signal = pyqtSignal(str)  # streamed reply text, in order
+    done_signal = pyqtSignal(str)   # the complete reply
+    error_signal = pyqtSignal(str)
+
+    def __init__(self, model, messages, parent=None):
+        super().__init__(parent)
+        self.model = model
+        self.messages = messages
+
+    def run(self):
+        try:
+            payload = {
+                "model": self.model,
+                "messages": self.messages,
+                "stream": True
+            }
+
+            response_parts = []
+            emitted = 0  # response_parts[:emitted] are already on screen
+            last_emit = time.monotonic()
+            with _SESSION.post(f"{OLLAMA_BASE_URL}/api/chat", data=json_dumps(payload), headers=STREAM_HEADERS, stream=True) as response:
+                response.raise_for_status()
+                for line in iter_ndjson_lines(response):
+                    part = json_loads(line)  # orjson takes the raw bytes, no decode needed
+                    content_part = part['message']['content']
+                    response_parts.append(content_part)
+                    # Coalesce tokens into one output update per interval
+                    now = time.monotonic()
+                    if part.get('done') or now - last_emit >= STREAM_EMIT_INTERVAL:
+                        self.chunk_signal.emit("".join(response_parts[emitted:]))
+                        emitted = len(response_parts)
+                        last_emit = now
+            if emitted < len(response_parts):
+                self.chunk_signal.emit("".join(response_parts[emitted:]))
+
+            self.done_signal.emit("".join(response_parts))
+
+        except requests.exceptions.RequestException as e:
+            self.error_signal.emit(f"API Error: {e}")
+        except Exception as e:
+            self.error_signal.emit(f"Error: {e}")
+
+class ImageWorker(QThread):
+    done_signal = pyqtSignal(str)   # the image description
+    error_signal = pyqtSignal(str)
+
+    def __init__(self, model, filenames, io_pool, parent=None):
+        super().__init__(parent)
+        self.model = model
+        self.filenames = filenames
+        self.io_pool = io_pool
+
+    def run(self):
+        try:
+            text_prompt = "Describe these images."
+
+            # Missing files come back as None from the open itself, no separate exists() check
+            base64_images = [b for b in self.io_pool.map(encode_image_to_base64, self.filenames) if b]
+            if not base64_images:
+                raise ValueError("Could not find or encode any valid images.")
+
+            payload = {
+                "model": self.model,
+                "messages": [{
+                    "role": "user",
+                    "content": text_prompt,
+                    "images": base64_images
+                }],
+                "stream": False
+            }
+
+            response = _SESSION.post(f"{OLLAMA_BASE_URL}/api/chat", data=json_dumps(payload), headers={"Content-Type": "application/json"})
+            response.raise_for_status()
+            response_data = json_loads(response.content)
+            self.done_signal.emit(response_data['message']['content'])
+
+        except requests.exceptions.RequestException as e:
+            self.error_signal.emit(f"API Error: {e}")
+        except Exception as e:
+            self.error_signal.emit(f"Error: {e}")
 
 # Main Application (UI with Reset Button)
 class MultiFunctionApp(QWidget):
@@ -83,7 +321,22 @@ class MultiFunctionApp(QWidget):
         self.logger = Logger()
         self.chat_history = []
         self.attached_files = []
+        self.awaiting_response = False
+        self.worker = None
+        self.history_is_restored = False  # chat_history only holds turns loaded from disk
+        self._updating_ui = False
+        self.io_pool = ThreadPoolExecutor(max_workers=8)  # reads and encodes attached files concurrently
+        # Show the cached model list right away; ask the server only once it is older than the TTL
+        self.model_names, cache_is_fresh = load_cached_models(OLLAMA_BASE_URL)
+        self.vision_models, self.chat_models = split_models(self.model_names)
+        self._models_by_mode = {}
+        self._build_model_items()
         self.init_ui()
+        self.model_loader = None
+        if not cache_is_fresh:
+            self.model_loader = ModelListWorker(self)
+            self.model_loader.models_signal.connect(self.set_model_lists)
+            self.model_loader.start()
 
     def init_ui(self):
         self.setWindowTitle("Multi-chat v0.2.8 (API Refactor + Reset Button)")
@@ -123,7 +376,7 @@ class MultiFunctionApp(QWidget):
         self.mode_label = QLabel("Mode:")
         self.mode_combo = QComboBox()
         self.mode_combo.addItems(["Chat", "Image to Text"])
-        self.mode_combo.currentTextChanged.connect(self.update_ui)
+        self.mode_combo.currentIndexChanged.connect(self._on_mode_changed)
 
         self.prompt_label = QLabel("Prompt:")
         self.prompt_entry = QTextEdit()
@@ -138,8 +391,8 @@ class MultiFunctionApp(QWidget):
         self.attach_button.clicked.connect(self.attach_text_files)
 
         self.model_label = QLabel("Model:")
-        self.model_combo = QComboBox()
-        self.model_combo.addItems(model_names)
+        self.model_combo = QComboBox()  # filled by update_ui with the list for the current mode
+        self.model_combo.currentTextChanged.connect(self.restore_history)
 
         # NEW: Reset Conversation Button
         self.reset_button = QPushButton("Reset Conversation")
@@ -150,6 +403,9 @@ class MultiFunctionApp(QWidget):
         """)
         self.reset_button.clicked.connect(self.reset_conversation)
 
+        self.clear_history_button = QPushButton("Clear Saved History")
+        self.clear_history_button.clicked.connect(self.clear_saved_history)
+
         self.submit_button = QPushButton("Submit")
         self.submit_button.clicked.connect(self.submit)
 
@@ -164,8 +420,11 @@ class MultiFunctionApp(QWidget):
         self.left_layout.addWidget(self.model_label)
         self.left_layout.addWidget(self.model_combo)
         
-        # Place reset button above submit button
-        self.left_layout.addWidget(self.reset_button)
+        # Place reset buttons above submit button
+        reset_layout = QHBoxLayout()
+        reset_layout.addWidget(self.reset_button)
+        reset_layout.addWidget(self.clear_history_button)
+        self.left_layout.addLayout(reset_layout)
         self.left_layout.addWidget(self.output_label)
         self.left_layout.addWidget(self.output_entry)
         
@@ -190,13 +449,48 @@ class MultiFunctionApp(QWidget):
         if mode == "Image to Text":
             self.file_button.show()
             self.attach_button.hide()
-            self.model_combo.clear()
-            self.model_combo.addItems(vision_models)
         else:
             self.file_button.hide()
             self.attach_button.show()
-            self.model_combo.clear()
-            self.model_combo.addItems(chat_models)
+        # Swap in the prepared item model instead of clearing and re-adding every name
+        self.model_combo.blockSignals(True)
+        self.model_combo.setModel(self._models_by_mode.get(mode, self._models_by_mode["Chat"]))
+        self.model_combo.blockSignals(False)
+        self.restore_history(self.model_combo.currentText())
+
+    def _on_mode_changed(self, index):
+        """Refreshes the UI for the newly picked mode, ignoring changes made while it is being refreshed."""
+        if self._updating_ui:
+            return
+        self._updating_ui = True
+        try:
+            self.update_ui()
+        finally:
+            self._updating_ui = False
+
+    def _build_model_items(self):
+        """Prepares a sorted combo item model per mode; redone only when the model list changes."""
+        old_models = list(self._models_by_mode.values())
+        for mode, names in (("Chat", self.chat_models), ("Image to Text", self.vision_models)):
+            item_model = QStandardItemModel(self)  # owned by the window, so the combo never deletes it
+            for name in sorted(names):
+                item_model.appendRow(QStandardItem(name))
+            self._models_by_mode[mode] = item_model
+        for item_model in old_models:
+            item_model.deleteLater()  # after update_ui has swapped in the new ones
+
+    def set_model_lists(self, model_names):
+        """Applies the fetched model list if it differs from the one shown, keeping the selection."""
+        if model_names == self.model_names:
+            return
+        selected = self.model_combo.currentText()
+        self.model_names = model_names
+        self.vision_models, self.chat_models = split_models(model_names)
+        self._build_model_items()
+        self.update_ui()
+        index = self.model_combo.findText(selected)
+        if index >= 0:
+            self.model_combo.setCurrentIndex(index)
 
     def select_image_files(self):
         filenames, _ = QFileDialog.getOpenFileNames(self, "Select image files", "", "Image files (*.png *.jpg *.jpeg *.bmp *.gif)")
@@ -211,11 +505,27 @@ class MultiFunctionApp(QWidget):
     def reset_conversation(self):
         """Clears chat history and resets UI state."""
         self.chat_history = []
+        self.history_is_restored = False
         self.chat_history_display.setText("")
         self.output_entry.setText("Conversation reset. Start new chat!")
         self.attached_files = []  # Clear attached files list
         self.logger.log_header("RESET")  # Log reset event
 
+    def clear_saved_history(self):
+        """Deletes the current model's persisted history and starts a fresh conversation."""
+        self.logger.clear_history(self.model_combo.currentText())
+        self.reset_conversation()
+
+    def restore_history(self, model):
+        """Loads the model's persisted history, unless a conversation is already under way."""
+        if not model or (self.chat_history and not self.history_is_restored):
+            return
+        self.chat_history = self.logger.load_history(model, HISTORY_MAX_MESSAGES)
+        self.history_is_restored = bool(self.chat_history)
+        self.chat_history_display.setText("".join(
+            f"User: {msg['content']}\n\n" if msg['role'] == "user" else f"Model: {msg['content']}\n\n" for msg in self.chat_history
+        ))
+
     def submit(self):
         mode = self.mode_combo.currentText()
         prompt = self.prompt_entry.toPlainText()
@@ -225,83 +535,75 @@ class MultiFunctionApp(QWidget):
             self.logger.log_header(model)
 
         if self.attached_files:
-            for filepath in self.attached_files:
-                try:
-                    with open(filepath, 'r') as file:
-                        file_content = file.read()
-                        prompt += f"\n\n--- Content of {filepath} ---\n{file_content}"
-                except Exception as e:
-                        self.output_entry.append(f"Error reading {filepath}: {e}")
+            # Read all attachments at once, then add them to the prompt in the order they were picked
+            for filepath, file_content, error in self.io_pool.map(self._read_text_file, self.attached_files):
+                if error is None:
+                    prompt += f"\n\n--- Content of {filepath} ---\n{file_content}"
+                else:
+                    self.output_entry.append(f"Error reading {filepath}: {error}")
             self.attached_files = []
 
         self.logger.log_user(model, prompt)
         
         self.output_entry.setText("Generating response...")
-        QApplication.processEvents()
-
-        # --- REFACTORED API CALL LOGIC ---
+        self.awaiting_response = True  # the first streamed text replaces the placeholder
+
+        # Both requests run on a worker thread; results come back through queued signals
+        self.submit_button.setEnabled(False)
+        if mode == "Chat":
+            self.chat_history.append({"role": "user", "content": prompt})
+            self.worker = ApiWorker(model, list(self.chat_history))
+            self.worker.chunk_signal.connect(self.append_output)
+            self.worker.done_signal.connect(self.finish_chat)
+        else:
+            # Image to Text mode
+            self.worker = ImageWorker(model, prompt.splitlines(), self.io_pool)
+            self.worker.done_signal.connect(self.finish_image)
+        self.worker.error_signal.connect(self.output_entry.setText)
+        self.worker.finished.connect(lambda: self.submit_button.setEnabled(True))
+        self.worker.start()
+
+    def finish_image(self, response_content):
+        """Shows and logs a finished image description."""
+        self.output_entry.setText(response_content)
+        self.logger.log_model(self.worker.model, response_content)
+
+    @staticmethod
+    def _read_text_file(filepath):
+        """Returns (filepath, content, error) for one attached file."""
         try:
-            if mode == "Chat":
-                self.chat_history.append({"role": "user", "content": prompt})
-
-                payload = {
-                    "model": model,
-                    "messages": self.chat_history,
-                    "stream": True
-                }
-                
-                response_parts = []
-                with requests.post(f"{OLLAMA_BASE_URL}/api/chat", json=payload, stream=True) as response:
-                    response.raise_for_status()
-                    for line in response.iter_lines():
-                        if line:
-                            part = json.loads(line.decode('utf-8'))
-                            content_part = part['message']['content']
-                            response_parts.append(content_part)
-                            self.output_entry.setText("".join(response_parts))
-                            QApplication.processEvents()
-
-                response_content = "".join(response_parts)
-                self.chat_history.append({"role": "assistant", "content": response_content})
-                
-                self.chat_history_display.setText("\n\n".join(
-                    [f"User: {msg['content']}" if msg['role'] == "user" else f"Model: {msg['content']}" for msg in self.chat_history]
-                ))
-                self.output_entry.setText(response_content)
-
-            else:  # Image to Text mode
-                filenames = prompt.splitlines()
-                text_prompt = "Describe these images."
-                
-                base64_images = [encode_image_to_base64(f) for f in filenames if os.path.exists(f)]
-                if not base64_images:
-                    raise ValueError("Could not find or encode any valid images.")
-                
-                payload = {
-                    "model": model,
-                    "messages": [{
-                        "role": "user",
-                        "content": text_prompt,
-                        "images": base64_images
-                    }],
-                    "stream": False
-                }
-                
-                response = requests.post(f"{OLLAMA_BASE_URL}/api/chat", json=payload)
-                response.raise_for_status()
-                response_data = response.json()
-                response_content = response_data['message']['content']
-                self.output_entry.setText(response_content)
-
-            self.logger.log_model(model, response_content)
-
-        except requests.exceptions.RequestException as e:
-            self.output_entry.setText(f"API Error: {e}")
+            with open(filepath, 'r') as file:
+                return filepath, file.read(), None
         except Exception as e:
-            self.output_entry.setText(f"Error: {e}")
+            return filepath, None, e
+
+    def append_output(self, text):
+        """Adds a piece of streamed text at the end of the output box."""
+        if self.awaiting_response:
+            self.output_entry.clear()
+            self.awaiting_response = False
+        cursor = self.output_entry.textCursor()
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(text)
+
+    def finish_chat(self, response_content):
+        """Records a completed chat reply in the history, the history display and the log."""
+        assistant_message = {"role": "assistant", "content": response_content}
+        self.chat_history.append(assistant_message)
+        self.history_is_restored = False
+        # Persist the finished turn, so the next session can pick the conversation up again
+        self.logger.append_history(self.worker.model, [self.worker.messages[-1], assistant_message])
+
+        # Only the new turn is added; the earlier ones are already on display
+        prompt = self.worker.messages[-1]['content']
+        cursor = self.chat_history_display.textCursor()
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(f"User: {prompt}\n\nModel: {response_content}\n\n")
+        self.logger.log_model(self.worker.model, response_content)
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
+    app.aboutToQuit.connect(Logger.close_all)
     window = MultiFunctionApp()
     window.show()
     sys.exit(app.exec_())
\ No newline at end of file